@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Conversion of array attributes to numpy arrays.
+
+Depending on the provider and the QGIS version, array columns are read either as
+Python lists or as text ('{1.2,3.4,NULL}'). Both are converted to float64 arrays
+where NULL values are mapped to NaN.
+"""
+
+import warnings
+
+import numpy as np
+
+def _is_null(value):
+    """NULL values may be read as None, as a NULL QVariant or as text"""
+    if value is None:
+        return True
+    if hasattr(value, "isNull"):
+        return value.isNull()
+    return hasattr(value, "strip") and value.strip() == "NULL"
+
+def parse_array_string(text):
+    """Parse a text encoded array like '{1.2,3.4,NULL}' into a float64 array"""
+    body = text.strip()[1:-1]
+    if not body.strip():
+        return np.empty(0, dtype=np.float64)
+    try:
+        # the string is parsed in C, without creating a Python object per value.
+        # numpy < 2 stops at the first unexpected value with a DeprecationWarning only
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(body.replace("NULL", "nan"), dtype=np.float64, sep=",")
+        if len(values) == body.count(",") + 1:
+            return values
+    except (ValueError, DeprecationWarning):
+        pass
+    # unexpected content, let float() report the faulty value
+    return np.array([np.nan if _is_null(value) else float(value)
+                     for value in body.split(",")], dtype=np.float64)
+
+def array_from_list(values):
+    """Convert a list of values natively read by QGIS into a float64 array"""
+    try:
+        # None values are converted to NaN by numpy, as well as numeric strings
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        # NULL values not converted to None
+        return np.array([np.nan if _is_null(value) else float(value)
+                         for value in values], dtype=np.float64)
+
+def array_from_attribute(value):
+    """Convert an array attribute, either read as a list or as a string, into a float64 array"""
+    if isinstance(value, (list, tuple)):
+        return array_from_list(value)
+    return parse_array_string(value)
+
+# micro benchmark of the conversion of array attributes
+if __name__ == '__main__':
+    import sys
+    import timeit
+
+    n_values = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    values = np.round(np.random.uniform(0.0, 1000.0, n_values), 3)
+    values[::10] = np.nan
+    as_list = [None if np.isnan(v) else float(v) for v in values]
+    as_text = "{" + ",".join("NULL" if v is None else repr(v) for v in as_list) + "}"
+
+    def per_value_text():
+        return [None if value == 'NULL' else float(value)
+                for value in as_text[1:-1].split(",")]
+
+    def per_value_list():
+        return [np.nan if value is None else float(value) for value in as_list]
+
+    assert np.array_equal(parse_array_string(as_text), values, equal_nan=True)
+    assert np.array_equal(array_from_list(as_list), values, equal_nan=True)
+
+    n_runs = 20
+    for name, f in [("text, per value", per_value_text),
+                    ("text, vectorized", lambda: parse_array_string(as_text)),
+                    ("list, per value", per_value_list),
+                    ("list, vectorized", lambda: array_from_list(as_list))]:
+        t = timeit.timeit(f, number=n_runs) / n_runs
+        print("{:<20} {:8.2f} ms for {} values".format(name, t * 1000.0, n_values))
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2019 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Headless export of well log sheets and time series to PNG, PDF or SVG.
+
+Views are built from the layer configuration (see layer_config.py.sample) for a list of
+station ids, without any window, and rendered on the offscreen Qt platform. Stations are
+spread over a pool of processes, each one running its own QGIS application.
+
+Run it from the directory of the plugin:
+
+    python -m qgeologis.batch_export --config layer_config.py --format pdf --dpi 300 \\
+        --output-dir sheets 12 13 14
+
+A well log sheet is as high as the page and as wide as its columns, the depth window covering
+all the data of the station. A time series sheet is as wide as the page and as high as its rows.
+Imagery data are not exported.
+
+Curves are rendered synchronously. On SVG and PDF outputs, they are drawn as geometries
+decimated to the resolution of the output, rather than as images.
+"""
+
+from qgis.PyQt.QtCore import Qt, QRectF, QSize, QSizeF, QCoreApplication, QEvent
+from qgis.PyQt.QtGui import QImage, QPainter
+from qgis.PyQt.QtSvg import QSvgGenerator
+from qgis.PyQt.QtPrintSupport import QPrinter
+
+from .qt_qgis_compat import qgsApplication, QgsVectorLayer, QgsFeatureRequest
+
+from .log_view import WellLogView
+from .timeseries_view import TimeSeriesView
+from .data_interface import FeatureData, LayerData
+from .series import OVERLAP_KEEP_FIRST
+from .disk_cache import disk_cache
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+FORMATS = ("png", "pdf", "svg")
+
+WELL_LOG = "well_log"
+TIMESERIES = "timeseries"
+
+# resolution of the scene units, in dots per inch
+SCENE_DPI = 96.0
+
+# height of the station name above the sheet, in scene units
+HEADER_HEIGHT = 30
+
+def load_layer_config(config_file, layer_name=None):
+    """Returns ((uri, provider), configuration) of a base layer of a configuration file
+
+    :param layer_name: name of the base layer ("layer_name" entry), may be None if the file
+                       configures only one base layer
+    """
+    v = {}
+    with open(config_file, "r") as f:
+        # the configuration file is a regular Python file
+        exec(f.read(), v)
+    layer_config = v["layer_config"]
+    if layer_name is None:
+        if len(layer_config) != 1:
+            raise ValueError("Several base layers are configured, choose one with --layer")
+        return list(layer_config.items())[0]
+    for key, cfg in layer_config.items():
+        if cfg.get("layer_name") == layer_name:
+            return key, cfg
+    raise ValueError("Unknown base layer: {}".format(layer_name))
+
+def peak_memory():
+    """Returns the peak resident memory of the process, in bytes, None if unknown"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def _measure_data(cfg, feature_id):
+    """Yields (data, title, unit of measure) of a measure configuration for a station.
+    Data are loaded synchronously"""
+    uri, provider = cfg["source"]
+    layer = QgsVectorLayer(uri, "data_layer", provider)
+    filter_expr = "{}={}".format(cfg["feature_ref_column"], feature_id)
+    req = QgsFeatureRequest()
+    req.setFilterExpression(filter_expr)
+    req.setFlags(QgsFeatureRequest.NoGeometry)
+
+    if cfg["type"] == "continuous":
+        req.setSubsetOfAttributes([])
+        fids = [f.id() for f in layer.getFeatures(req)]
+        if not fids:
+            return
+        yield (FeatureData(layer, cfg["values_column"], feature_ids=fids,
+                           x_start_fieldname=cfg["start_measure_column"],
+                           x_delta_fieldname=cfg["interval_column"],
+                           overlap_policy=cfg.get("overlap_policy", OVERLAP_KEEP_FIRST),
+                           filter_expression=filter_expr,
+                           disk_cache=disk_cache()),
+               cfg["name"], cfg["uom"])
+
+    elif cfg["type"] == "instantaneous":
+        if cfg.get("feature_filter_type") == "unique_data_from_values":
+            # one column per value of the filter column
+            req.setSubsetOfAttributes([cfg["feature_filter_column"]], layer.fields())
+            values = sorted(set(f[cfg["feature_filter_column"]] for f in layer.getFeatures(req)))
+            filters = [(filter_expr + " and {}='{}'".format(cfg["feature_filter_column"], value), value)
+                       for value in values]
+        else:
+            req.setSubsetOfAttributes([])
+            req.setLimit(1)
+            filters = [(filter_expr, cfg["name"])] if len(list(layer.getFeatures(req))) > 0 else []
+        uom = cfg["uom"] if "uom" in cfg else "@" + cfg["uom_column"]
+        for expr, title in filters:
+            # windowed data are loaded whole, the sheet covers all the data
+            data = LayerData(layer, cfg["event_column"], cfg["value_column"], filter_expression=expr, uom=uom,
+                             disk_cache=disk_cache())
+            yield data, title, data.uom()
+
+def _data_window(datas):
+    """Returns (min, max) of the X values of data, None if there is no value"""
+    bounds = [(data.get_x_min(), data.get_x_max()) for data in datas]
+    bounds = [(x_min, x_max) for x_min, x_max in bounds if x_min is not None]
+    if not bounds:
+        return None
+    return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+def build_well_log(config, feature):
+    """Returns a WellLogView of a station, with its stratigraphy and log measures"""
+    name = feature[config["name_column"]]
+    view = WellLogView(name)
+    window = None
+
+    cfg = config.get("stratigraphy_config")
+    if cfg is not None:
+        uri, provider = cfg["source"]
+        layer = QgsVectorLayer(uri, "layer", provider)
+        layer.setSubsetString("{}={}".format(cfg["feature_ref_column"], feature.id()))
+        view.add_stratigraphy(layer, (cfg["depth_from_column"],
+                                      cfg["depth_to_column"],
+                                      cfg["formation_code_column"],
+                                      cfg["rock_code_column"],
+                                      cfg.get("formation_description_column"),
+                                      cfg.get("rock_description_column")), "Stratigraphy")
+        depths = [(f[cfg["depth_from_column"]], f[cfg["depth_to_column"]]) for f in layer.getFeatures()]
+        if depths:
+            window = (min(d[0] for d in depths), max(d[1] for d in depths))
+
+    datas = []
+    for cfg in config.get("log_measures", []):
+        for data, title, uom in _measure_data(cfg, feature.id()):
+            view.add_data_column(data, title, uom, station_name=name)
+            datas.append(data)
+
+    data_window = _data_window(datas)
+    if data_window is not None:
+        window = data_window if window is None else (min(window[0], data_window[0]), max(window[1], data_window[1]))
+    if window is not None:
+        view.set_depth_window(*window)
+    return view
+
+def build_timeseries(config, feature):
+    """Returns a TimeSeriesView of a station, with its time series"""
+    name = feature[config["name_column"]]
+    view = TimeSeriesView(name)
+    datas = []
+    for cfg in config.get("timeseries", []):
+        for data, title, uom in _measure_data(cfg, feature.id()):
+            view.add_data_row(data, title, uom, station_name=name)
+            datas.append(data)
+    window = _data_window(datas)
+    if window is not None:
+        view.set_time_window(*window)
+    return view
+
+class _Sheet(object):
+    """Paint device of an output file"""
+
+    def __init__(self, file_name, output_format, width, height, dpi, title):
+        """
+        width, height: size of the sheet, in scene units
+        """
+        self.__file_name = file_name
+        self.__dpi = dpi
+        self.__image = None
+        self.__device = None
+        # rectangle of the page in painter coordinates, the viewport of the painter if None
+        self.__page = None
+        scale = dpi / SCENE_DPI
+        size = QSize(int(round(width * scale)), int(round(height * scale)))
+        if output_format == "png":
+            self.__image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            self.__image.fill(Qt.white)
+            if hasattr(self.__image, "setDevicePixelRatio"):
+                # the image is painted in scene units, curves are rendered at the device pixel ratio
+                self.__image.setDevicePixelRatio(scale)
+                self.__page = QRectF(0, 0, width, height)
+            self.__device = self.__image
+        elif output_format == "svg":
+            self.__device = QSvgGenerator()
+            self.__device.setFileName(file_name)
+            self.__device.setSize(size)
+            self.__device.setViewBox(QRectF(0, 0, size.width(), size.height()))
+            self.__device.setResolution(int(dpi))
+            self.__device.setTitle(title)
+        elif output_format == "pdf":
+            self.__device = QPrinter(QPrinter.HighResolution)
+            self.__device.setOutputFormat(QPrinter.PdfFormat)
+            self.__device.setOutputFileName(file_name)
+            self.__device.setResolution(int(dpi))
+            self.__device.setFullPage(True)
+            self.__device.setPaperSize(QSizeF(width / SCENE_DPI * 25.4, height / SCENE_DPI * 25.4),
+                                       QPrinter.Millimeter)
+            self.__device.setDocName(title)
+        else:
+            raise ValueError("Unknown format: {}".format(output_format))
+
+    def device(self):
+        return self.__device
+
+    def page(self, painter):
+        """Returns the rectangle of the page, in the coordinates of a painter of the device"""
+        return QRectF(self.__page) if self.__page is not None else QRectF(painter.viewport())
+
+    def save(self):
+        if self.__image is not None:
+            # the resolution is only set once painted, text is laid out in scene units
+            dots_per_meter = int(round(self.__dpi / 0.0254))
+            self.__image.setDotsPerMeterX(dots_per_meter)
+            self.__image.setDotsPerMeterY(dots_per_meter)
+            if not self.__image.save(self.__file_name):
+                raise IOError("Cannot write {}".format(self.__file_name))
+
+def _file_name(name, station_id):
+    """Returns a file name of a station, without extension"""
+    safe_name = re.sub(r"[^\w.-]+", "_", u"{}".format(name)).strip("_")
+    return "{}_{}".format(station_id, safe_name) if safe_name else str(station_id)
+
+def export_view(view, view_type, file_name, output_format, dpi, page_width, page_height, title):
+    """Render a view to a file
+
+    :param view_type: WELL_LOG or TIMESERIES
+    :param page_width, page_height: size of the page, in mm. A well log is as wide as its columns,
+                                    a time series as high as its rows
+    """
+    if view_type == WELL_LOG:
+        scene_height = page_height / 25.4 * SCENE_DPI - HEADER_HEIGHT
+        width, height = view.columns_width(), scene_height + HEADER_HEIGHT
+    else:
+        scene_width = page_width / 25.4 * SCENE_DPI
+        width, height = scene_width, view.rows_height() + HEADER_HEIGHT
+
+    sheet = _Sheet(file_name, output_format, width, height, dpi, title)
+    painter = QPainter(sheet.device())
+    try:
+        painter.setRenderHints(QPainter.Antialiasing | QPainter.TextAntialiasing)
+        page = sheet.page(painter)
+        header_height = page.height() * HEADER_HEIGHT / height
+        painter.drawText(QRectF(page.x(), page.y(), page.width(), header_height), Qt.AlignCenter, title)
+        target = QRectF(page.x(), page.y() + header_height, page.width(), page.height() - header_height)
+        if view_type == WELL_LOG:
+            view.render_columns(painter, scene_height, target)
+        else:
+            view.render_rows(painter, scene_width, target)
+    finally:
+        painter.end()
+    sheet.save()
+
+class _Worker(object):
+    """Exports stations in a process, with its own QGIS application"""
+
+    def __init__(self, options):
+        # no display is needed
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        self.__app = qgsApplication([sys.argv[0]], True)
+        self.__app.initQgis()
+        self.__options = options
+        (uri, provider), self.__config = load_layer_config(options.config, options.layer)
+        self.__base_layer = QgsVectorLayer(uri, "base_layer", provider)
+
+    def export(self, station_id):
+        """Returns (station id, output file, time in s, memory, error message).
+        memory is (peak memory of the worker, its growth during the export), in bytes"""
+        options = self.__options
+        start = time.time()
+        # ru_maxrss is the peak of the whole life of the worker
+        peak_before = peak_memory()
+        def memory():
+            peak = peak_memory()
+            return (peak, peak - peak_before) if peak is not None else None
+        try:
+            features = list(self.__base_layer.getFeatures(QgsFeatureRequest(station_id)))
+            if not features:
+                raise ValueError("Unknown station")
+            feature = features[0]
+            name = feature[self.__config["name_column"]]
+            build = build_well_log if options.view == WELL_LOG else build_timeseries
+            view = build(self.__config, feature)
+            file_name = os.path.join(options.output_dir,
+                                     "{}.{}".format(_file_name(name, station_id), options.format))
+            try:
+                export_view(view, options.view, file_name, options.format, options.dpi,
+                            options.page_width, options.page_height, u"{}".format(name))
+            finally:
+                # release the data
+                view.close()
+                view.deleteLater()
+                QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+        except Exception as e:
+            return station_id, None, time.time() - start, memory(), str(e)
+        return station_id, file_name, time.time() - start, memory(), None
+
+_worker = None
+
+def _init_worker(options):
+    global _worker
+    _worker = _Worker(options)
+
+def _export_station(station_id):
+    return _worker.export(station_id)
+
+def batch_export(options, station_ids):
+    """Export stations over a pool of processes, printing the result of each one.
+
+    Returns the number of failed stations"""
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+    failed = 0
+    start = time.time()
+    pool = multiprocessing.Pool(options.processes, _init_worker, (options,))
+    try:
+        for station_id, file_name, elapsed, memory, error in pool.imap_unordered(_export_station, station_ids):
+            memory_text = "?"
+            if memory is not None:
+                memory_text = "{:.1f} MiB, +{:.1f} MiB for this station".format(memory[0] / 1024.0 / 1024.0,
+                                                                            memory[1] / 1024.0 / 1024.0)
+            if error is not None:
+                failed += 1
+                print("Station {}: error: {} ({:.2f} s, worker peak memory {})".format(station_id, error, elapsed, memory_text))
+            else:
+                print("Station {}: {} ({:.2f} s, worker peak memory {})".format(station_id, file_name, elapsed, memory_text))
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+    print("{} stations exported in {:.1f} s, {} failed".format(len(station_ids) - failed, time.time() - start, failed))
+    return failed
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Export well log sheets or time series of stations")
+    parser.add_argument("station_ids", metavar="STATION_ID", type=int, nargs="*",
+                        help="feature ids of the stations on the base layer")
+    parser.add_argument("--stations-file", help="file of station ids, one per line")
+    parser.add_argument("--config", required=True, help="layer configuration file")
+    parser.add_argument("--layer", help="name of the base layer, if the configuration has several ones")
+    parser.add_argument("--view", choices=(WELL_LOG, TIMESERIES), default=WELL_LOG)
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument("--dpi", type=float, default=150.0)
+    parser.add_argument("--page-width", type=float, default=210.0, help="page width of time series, in mm")
+    parser.add_argument("--page-height", type=float, default=297.0, help="page height of well logs, in mm")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes")
+    options = parser.parse_args(args)
+
+    station_ids = list(options.station_ids)
+    if options.stations_file:
+        with open(options.stations_file, "r") as f:
+            station_ids += [int(line) for line in f if line.strip()]
+    if not station_ids:
+        parser.error("no station to export")
+    return 1 if batch_export(options, station_ids) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,9 +16,11 @@
 #   License along with this library; if not, see <http://www.gnu.org/licenses/>.
 #
 
-from qgis.PyQt.QtCore import Qt, pyqtSignal
+from qgis.PyQt.QtCore import Qt, QObject, QPointF, QTimer, pyqtSignal
 from qgis.PyQt.QtGui import QColor, QPen, QBrush
-from qgis.PyQt.QtWidgets import QGraphicsWidget
+from qgis.PyQt.QtWidgets import QGraphicsWidget, QGraphicsScene
+
+import bisect
 
 from qgis.core import QgsMapToPixel, QgsRenderContext
 
@@ -47,6 +49,173 @@ def qgis_render_context(painter, width, height):
     context.setPainter(painter)
     return context
 
+class RenderSession(object):
+    """Render context and started renderer, kept alive across paints.
+
+    startRender() prepares the symbol layers of a renderer, which is costly for rule-based
+    or SVG symbols. It is only called again when the renderer, the fields or the size change,
+    or after reset().
+    """
+
+    def __init__(self):
+        self.__key = None
+        self.__renderer = None
+        self.__context = None
+
+    def context(self, painter, renderer, fields, width, height):
+        """Returns a render context drawing on painter, with renderer started
+
+        fields: QgsFields of the features that will be rendered
+        """
+        key = (id(renderer), tuple(fields[i].name() for i in range(fields.count())), width, height)
+        if self.__context is None or key != self.__key:
+            self.reset()
+            self.__context = qgis_render_context(painter, width, height)
+            renderer.startRender(self.__context, fields)
+            self.__key = key
+            self.__renderer = renderer
+        else:
+            self.__context.setPainter(painter)
+        return self.__context
+
+    def reset(self):
+        """Stop the renderer. To be called when it is modified or before it is edited"""
+        if self.__renderer is not None:
+            self.__renderer.stopRender(self.__context)
+        self.__key = None
+        self.__renderer = None
+        self.__context = None
+
+# minimum interval between two updates of a view during an interaction, in ms (about 60 fps)
+FRAME_INTERVAL = 16
+# delay after the last input before items are rendered in full quality again, in ms
+IDLE_DELAY = 250
+
+class InteractionLoop(QObject):
+    """Applies the input of an interaction (pan, zoom) at most once per display frame.
+
+    Input events only update the requested window, then call request_update(). The first
+    request is applied at once, the following ones are coalesced until the next frame.
+    Items are rendered in fast mode while the input goes on.
+    """
+
+    def __init__(self, apply_callback, fast_rendering_callback, parent=None):
+        """
+        apply_callback: function called to apply the pending input
+        fast_rendering_callback: function called with True when an interaction starts
+                                 and False when the input goes idle
+        """
+        QObject.__init__(self, parent)
+        self.__apply = apply_callback
+        self.__set_fast_rendering = fast_rendering_callback
+        self.__pending = False
+        self.__interacting = False
+
+        self.__frame_timer = QTimer(self)
+        self.__frame_timer.setSingleShot(True)
+        self.__frame_timer.setInterval(FRAME_INTERVAL)
+        self.__frame_timer.timeout.connect(self.__on_frame)
+
+        self.__idle_timer = QTimer(self)
+        self.__idle_timer.setSingleShot(True)
+        self.__idle_timer.setInterval(IDLE_DELAY)
+        self.__idle_timer.timeout.connect(self.__on_idle)
+
+    def request_update(self):
+        """Request the pending input to be applied"""
+        if not self.__interacting:
+            self.__interacting = True
+            self.__set_fast_rendering(True)
+        self.__idle_timer.start()
+        if self.__frame_timer.isActive():
+            self.__pending = True
+        else:
+            self.__apply()
+            self.__frame_timer.start()
+
+    def __on_frame(self):
+        if self.__pending:
+            self.__pending = False
+            self.__apply()
+            self.__frame_timer.start()
+
+    def __on_idle(self):
+        self.__interacting = False
+        self.__set_fast_rendering(False)
+
+class _HoverEvent(object):
+    """Mouse move event dispatched after the Qt event has been handled"""
+    def __init__(self, scene_pos):
+        self.__scene_pos = QPointF(scene_pos)
+
+    def scenePos(self):
+        return self.__scene_pos
+
+class GridScene(QGraphicsScene):
+    """Scene of items laid out in cells along one axis (columns or rows).
+
+    Mouse moves are passed to the item under the mouse, found by a bisection on the
+    offsets of the cells, at most once per frame.
+    """
+
+    def __init__(self, x, y, w, h, vertical_cells):
+        """
+        vertical_cells: True if cells are columns, laid out along X, False if they are rows
+        """
+        QGraphicsScene.__init__(self, x, y, w, h)
+        self.__vertical_cells = vertical_cells
+        # sorted offset of each cell and items of each cell, None if not set by the view
+        self.__offsets = None
+        self.__cells = []
+        # (item, scene position) of the last mouse move, not dispatched yet
+        self.__hover = None
+        self.__hover_timer = QTimer(self)
+        self.__hover_timer.setSingleShot(True)
+        self.__hover_timer.setInterval(FRAME_INTERVAL)
+        self.__hover_timer.timeout.connect(self.__dispatch_hover)
+
+    def set_cells(self, offsets, cells):
+        """Set the layout of the items, to be called each time the view places them
+
+        offsets: sorted offsets of the cells along the layout axis
+        cells: list of the items of each cell
+        """
+        self.__offsets = list(offsets)
+        self.__cells = [list(items) for items in cells]
+
+    def item_at(self, pos):
+        """Returns the item of a cell containing the scene position, or None"""
+        if self.__offsets is None:
+            candidates = self.items()
+        else:
+            i = bisect.bisect_right(self.__offsets, pos.x() if self.__vertical_cells else pos.y()) - 1
+            candidates = self.__cells[i] if i >= 0 else []
+        for item in candidates:
+            r = item.boundingRect()
+            r.translate(item.pos())
+            if r.contains(pos):
+                return item
+        return None
+
+    def mouseMoveEvent(self, event):
+        # pass the event to the underlying item
+        item = self.item_at(event.scenePos())
+        if item is None:
+            return QGraphicsScene.mouseMoveEvent(self, event)
+        # tooltips are computed at most once per frame
+        self.__hover = (item, _HoverEvent(event.scenePos()))
+        if not self.__hover_timer.isActive():
+            self.__dispatch_hover()
+
+    def __dispatch_hover(self):
+        if self.__hover is None:
+            return
+        item, event = self.__hover
+        self.__hover = None
+        if item.scene() is self:
+            item.mouseMoveEvent(event)
+        self.__hover_timer.start()
+
 class LogItem(QGraphicsWidget):
 
     # the item has requested to display a tooltip string
@@ -57,6 +226,16 @@ class LogItem(QGraphicsWidget):
 
         self.__selected = False
 
+    def mouseMoveEvent(self, event):
+        # mouse moves are passed by the scene (see GridScene), possibly after the Qt event
+        # has been handled. Items that request tooltips override this
+        pass
+
+    def set_depth_window(self, min_depth, max_depth):
+        """Set both edges of the displayed depth (or time) range"""
+        self.set_min_depth(min_depth)
+        self.set_max_depth(max_depth)
+
     def selected(self):
         return self.__selected
 
@@ -83,3 +262,46 @@ class LogItem(QGraphicsWidget):
             painter.drawRect(0, 0, self.boundingRect().width(), self.boundingRect().height()-1)
         painter.setBrush(old_brush)
         painter.setPen(old_pen)
+
+if __name__ == '__main__':
+    import sys
+    import timeit
+
+    from qgis.PyQt.QtGui import QImage, QPainter
+    from qt_qgis_compat import qgsApplication, QgsFeatureRendererV2, QgsFeature, QgsFields, QgsGeometry, QgsRectangle
+
+    app = qgsApplication(sys.argv, False)
+    app.initQgis()
+
+    width, height = 150, 800
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    painter = QPainter(image)
+    renderer = QgsFeatureRendererV2.defaultRenderer(LINE_RENDERER)
+    fields = QgsFields()
+    feature = QgsFeature(fields, 1)
+    feature.setGeometry(QgsGeometry.fromWkt("LINESTRING(0 0, 75 400, 150 800)"))
+
+    def per_frame_context():
+        context = qgis_render_context(painter, width, height)
+        context.setExtent(QgsRectangle(0, 0, width, height))
+        renderer.startRender(context, fields)
+        renderer.renderFeature(feature, context)
+        renderer.stopRender(context)
+
+    session = RenderSession()
+    def with_session():
+        context = session.context(painter, renderer, fields, width, height)
+        renderer.renderFeature(feature, context)
+
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    timings = []
+    for name, f in [("context per frame", per_frame_context),
+                    ("render session", with_session)]:
+        t = timeit.timeit(f, number=n_runs) / n_runs
+        timings.append(t)
+        print("{:<20} {:8.3f} ms per frame".format(name, t * 1000.0))
+    print("{:<20} {:8.2f}x".format("speed-up", timings[0] / timings[1]))
+    session.reset()
+
+    painter.end()
+    app.exitQgis()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Correlation view: many wells side by side in one scene.
+
+All the wells share one depth window. The depths displayed for a well are the window shifted
+by the reference depth of the well, given by the reference mode: depth, elevation of the
+well head, or depth of the top of a formation (flattening).
+"""
+
+from qgis.PyQt.QtCore import Qt, QSizeF
+from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtWidgets import QWidget, QToolBar, QAction, QLabel, QVBoxLayout, QComboBox, QStatusBar
+
+from .common import POLYGON_RENDERER, ORIENTATION_DOWNWARD, ORIENTATION_LEFT_TO_RIGHT, RenderSession
+
+from .log_plot import PlotItem
+from .log_view import LogGraphicsView, MyScene
+from .z_scale import ZScaleItem
+from .stratigraphy import StratigraphyItem, load_stratigraphy_renderer
+from .legend_item import LegendItem
+from .data_cache import data_cache
+
+import os
+
+# reference modes
+# the window is a depth
+REFERENCE_DEPTH = "depth"
+# the window is a depth below the 0 elevation
+REFERENCE_ELEVATION = "elevation"
+# the window is a depth below the top of a formation
+REFERENCE_FORMATION = "formation"
+
+class _Well(object):
+    """Columns of a well"""
+
+    def __init__(self, well_id, name, elevation, stratigraphy):
+        self.well_id = well_id
+        self.name = name
+        # elevation of the well head, None if unknown
+        self.elevation = elevation
+        # (depth_from, depth_to, formation_code, rock_code, formation_description, rock_description) rows
+        self.stratigraphy = stratigraphy
+        # (item, legend) of each column
+        self.columns = []
+        # data -> (plot_item, legend_item)
+        self.data = {}
+        # offset added to the window of the view, None if the well cannot be displayed
+        # in the current reference mode
+        self.reference_depth = 0.0
+
+    def formation_top(self, formation_code):
+        """Returns the depth of the top of a formation, None if the well does not cross it"""
+        tops = [row[0] for row in self.stratigraphy if row[2] == formation_code]
+        return min(tops) if tops else None
+
+class CorrelationView(QWidget):
+
+    DEFAULT_COLUMN_WIDTH = 150
+
+    def __init__(self, title=None, style_file=None, image_dir=None, parent=None):
+        QWidget.__init__(self, parent)
+
+        self.__scene = MyScene(0, 0, 600, 600)
+        self.__view = LogGraphicsView(self.__scene)
+        self.__view.setAlignment(Qt.AlignLeft|Qt.AlignTop)
+        self.__scene.sceneRectChanged.connect(self.on_rect_changed)
+
+        if image_dir is None:
+            image_dir = os.path.join(os.path.dirname(__file__), "img")
+
+        toolbar = QToolBar()
+        self.__action_add_column = QAction(QIcon(os.path.join(image_dir, "add.svg")), "Add a data column", toolbar)
+        self.__action_add_column.triggered.connect(self.on_add_column)
+        toolbar.addAction(self.__action_add_column)
+
+        self.__reference_combo = QComboBox()
+        for text, mode in [("Depth", REFERENCE_DEPTH),
+                           ("Elevation", REFERENCE_ELEVATION),
+                           ("Flatten on formation", REFERENCE_FORMATION)]:
+            self.__reference_combo.addItem(text, mode)
+        self.__formation_combo = QComboBox()
+        self.__formation_combo.setEnabled(False)
+        self.__reference_combo.currentIndexChanged.connect(self.on_reference_changed)
+        self.__formation_combo.currentIndexChanged.connect(self.on_reference_changed)
+        toolbar.addWidget(self.__reference_combo)
+        toolbar.addWidget(self.__formation_combo)
+
+        self.__title_label = QLabel()
+        if title is not None:
+            self.__title_label.setText(title)
+        self.__status_bar = QStatusBar()
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.__title_label)
+        vbox.addWidget(toolbar)
+        vbox.addWidget(self.__view)
+        vbox.addWidget(self.__status_bar)
+        self.setLayout(vbox)
+
+        if style_file is None:
+            style_file = os.path.join(os.path.dirname(__file__), "styles", "stratigraphy_style.xml")
+        # one renderer for all the stratigraphy columns, started once for all of them
+        self.__stratigraphy_renderer = load_stratigraphy_renderer(style_file)
+        self.__stratigraphy_session = RenderSession()
+
+        self.__wells = []
+        # data -> list of (signal, slot) connected by this view
+        self.__data_connections = {}
+        self.__selected_column = None
+
+        self._min_z = 0
+        self._max_z = 40
+
+        self.__z_scale = ZScaleItem(self.DEFAULT_COLUMN_WIDTH / 2, self.__scene.height(), self._min_z, self._max_z)
+        self.__z_scale_legend = LegendItem(self.DEFAULT_COLUMN_WIDTH / 2, "Depth", unit_of_measure="m")
+        self.__scene.addItem(self.__z_scale)
+        self.__scene.addItem(self.__z_scale_legend)
+
+    def closeEvent(self, event):
+        for well in self.__wells:
+            for data in list(well.data):
+                self.__release_data(well, data)
+        QWidget.closeEvent(self, event)
+
+    def wells(self):
+        """Returns the ids of the wells, from left to right"""
+        return [well.well_id for well in self.__wells]
+
+    def add_well(self, well_id, name, stratigraphy=None, elevation=None):
+        """Add a well, with a stratigraphy column
+
+        :param stratigraphy: list of (depth_from, depth_to, formation_code, rock_code,
+                             formation_description, rock_description)
+        :param elevation: elevation of the well head, used in the elevation reference mode
+        """
+        well = _Well(well_id, name, elevation, sorted(stratigraphy or [], key=lambda row: row[0]))
+        item = StratigraphyItem(self.DEFAULT_COLUMN_WIDTH, self.__scene.height(),
+                                renderer=self.__stratigraphy_renderer,
+                                render_session=self.__stratigraphy_session)
+        item.set_data(well.stratigraphy)
+        item.tooltipRequested.connect(lambda txt: self.on_plot_tooltip(txt, name))
+        legend = LegendItem(self.DEFAULT_COLUMN_WIDTH, name)
+        self.__add_column(well, item, legend)
+        self.__wells.append(well)
+        self.__update_formations()
+        self.__update_reference_depths()
+        self._place_items()
+        self._update_column_depths()
+
+    def add_data_column(self, well_id, data, title, uom):
+        """Add a data column to a well. Data are released (see data_cache.py) when the view is closed"""
+        well = self.__well(well_id)
+        if data in well.data:
+            # already displayed, data shared through the cache are the same object
+            data_cache().release(data)
+            return
+
+        plot_item = PlotItem(size=QSizeF(self.DEFAULT_COLUMN_WIDTH, self.__scene.height()),
+                             render_type = POLYGON_RENDERER,
+                             x_orientation = ORIENTATION_DOWNWARD,
+                             y_orientation = ORIENTATION_LEFT_TO_RIGHT)
+        plot_item.set_layer(data.get_layer())
+        plot_item.tooltipRequested.connect(lambda txt: self.on_plot_tooltip(txt, well.name))
+        legend_item = LegendItem(self.DEFAULT_COLUMN_WIDTH, title, unit_of_measure=uom)
+        plot_item.valueRangeChanged.connect(lambda min_value, max_value:
+                                            legend_item.set_scale("{:.1f}".format(min_value), "{:.1f}".format(max_value)))
+        if data.is_loading():
+            plot_item.set_loading_progress(0.0)
+
+        connections = [(data.data_modified, lambda: self.__update_data_column(well, data)),
+                       (data.loading_progress, plot_item.set_loading_progress),
+                       (data.loading_finished, lambda: plot_item.set_loading_progress(None))]
+        for signal, slot in connections:
+            signal.connect(slot)
+        self.__data_connections[data] = connections
+
+        well.data[data] = (plot_item, legend_item)
+        # data columns follow the columns of the well
+        self.__add_column(well, plot_item, legend_item)
+        self._place_items()
+        self.__update_data_column(well, data)
+
+    def __well(self, well_id):
+        for well in self.__wells:
+            if well.well_id == well_id:
+                return well
+        raise ValueError("Unknown well: {}".format(well_id))
+
+    def __add_column(self, well, item, legend):
+        self.__scene.addItem(item)
+        self.__scene.addItem(legend)
+        well.columns.append((item, legend))
+
+    def __release_data(self, well, data):
+        """Disconnect the data from this view and release them (see data_cache.py)"""
+        for signal, slot in self.__data_connections.pop(data, []):
+            signal.disconnect(slot)
+        well.data[data][0].cancel_rendering()
+        if not data_cache().release(data):
+            data.cancel_loading()
+
+    def __update_data_column(self, well, data):
+        plot_item, legend_item = well.data[data]
+        series = data.get_series()
+        if series is None or len(series) == 0:
+            plot_item.set_data_window(None)
+            plot_item.update()
+            return
+        plot_item.set_series(series, data.get_y_min(), data.get_y_max())
+        plot_item.set_lod(data.lod_pyramid())
+        if well.reference_depth is not None:
+            plot_item.set_depth_window(self._min_z + well.reference_depth, self._max_z + well.reference_depth)
+        plot_item.update()
+        legend_item.update()
+
+    def _place_items(self):
+        """Place the columns of the wells from left to right, after the Z scale"""
+        legend_height = self.__z_scale_legend.boundingRect().height()
+        self.__z_scale_legend.setPos(0, 0)
+        self.__z_scale.setPos(0, legend_height)
+        x = self.__z_scale.boundingRect().width()
+        offsets = [0]
+        cells = [(self.__z_scale, self.__z_scale_legend)]
+        for well in self.__wells:
+            for item, legend in well.columns:
+                legend.setPos(x, 0)
+                item.setPos(x, legend_height)
+                offsets.append(x)
+                cells.append((item, legend))
+                x += item.boundingRect().width()
+        self.__scene.set_cells(offsets, cells)
+        self.__view.set_content_width(x)
+
+    def on_rect_changed(self, rect):
+        self.__z_scale.set_height(rect.height())
+        for well in self.__wells:
+            for item, _ in well.columns:
+                item.set_height(rect.height())
+
+    def reference_mode(self):
+        return self.__reference_combo.itemData(self.__reference_combo.currentIndex())
+
+    def set_reference_mode(self, mode, formation_code=None):
+        """Set how the window of the view is shifted for each well
+
+        :param mode: REFERENCE_DEPTH, REFERENCE_ELEVATION or REFERENCE_FORMATION
+        :param formation_code: formation to flatten on, in the REFERENCE_FORMATION mode
+        """
+        self.__reference_combo.setCurrentIndex(self.__reference_combo.findData(mode))
+        if formation_code is not None:
+            self.__formation_combo.setCurrentIndex(self.__formation_combo.findText(formation_code))
+        self.on_reference_changed()
+
+    def on_reference_changed(self, *args):
+        mode = self.reference_mode()
+        self.__formation_combo.setEnabled(mode == REFERENCE_FORMATION)
+        titles = {REFERENCE_DEPTH: "Depth",
+                  REFERENCE_ELEVATION: "Depth below 0",
+                  REFERENCE_FORMATION: "Depth below top"}
+        self.__z_scale_legend.set_title(titles[mode])
+        self.__update_reference_depths()
+        self._update_column_depths()
+
+    def __update_formations(self):
+        """Fill the formation combo box with the formations of all the wells"""
+        current = self.__formation_combo.currentText()
+        formations = sorted(set(row[2] for well in self.__wells for row in well.stratigraphy if row[2]))
+        self.__formation_combo.blockSignals(True)
+        self.__formation_combo.clear()
+        self.__formation_combo.addItems(formations)
+        if current in formations:
+            self.__formation_combo.setCurrentIndex(formations.index(current))
+        self.__formation_combo.blockSignals(False)
+
+    def __update_reference_depths(self):
+        mode = self.reference_mode()
+        formation_code = self.__formation_combo.currentText()
+        for well in self.__wells:
+            if mode == REFERENCE_ELEVATION:
+                well.reference_depth = well.elevation
+            elif mode == REFERENCE_FORMATION:
+                well.reference_depth = well.formation_top(formation_code)
+            else:
+                well.reference_depth = 0.0
+            # wells that cannot be placed are hidden
+            for item, legend in well.columns:
+                item.setVisible(well.reference_depth is not None)
+                legend.setVisible(well.reference_depth is not None)
+
+    def _update_column_depths(self):
+        """Apply the window of the view to all the wells, then redraw the scene once"""
+        self.__z_scale.set_depth_window(self._min_z, self._max_z)
+        for well in self.__wells:
+            if well.reference_depth is None:
+                continue
+            min_z = self._min_z + well.reference_depth
+            max_z = self._max_z + well.reference_depth
+            for data in well.data:
+                data.set_x_window(min_z, max_z)
+            for item, _ in well.columns:
+                item.set_depth_window(min_z, max_z)
+        self.__scene.update()
+
+    def _set_fast_rendering(self, fast):
+        for well in self.__wells:
+            for plot_item, _ in well.data.values():
+                plot_item.set_fast_rendering(fast)
+
+    def select_column_at(self, pos):
+        item = self.__scene.item_at(pos)
+        for well in self.__wells:
+            for column in well.columns:
+                selected = item in column
+                column[0].set_selected(selected)
+                column[1].set_selected(selected)
+        self.__scene.update()
+
+    def on_plot_tooltip(self, txt, well_name):
+        self.__status_bar.showMessage(u"Station: {} ".format(well_name) + txt)
+
+    def on_add_column(self):
+        # to be overridden by subclasses
+        pass
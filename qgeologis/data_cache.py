@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Process-wide registry of loaded data, shared between views.
+
+Data are keyed by (source URI, provider, filter expression, columns). The same DataInterface
+is handed out to every view that asks for the same key, and is kept in memory, up to a memory
+budget, once the last view has released it.
+"""
+
+from qgis.PyQt.QtCore import QSettings
+
+from collections import OrderedDict
+
+# default memory budget of released data, in MiB
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+class DataCache(object):
+    """Reference counted registry of DataInterface"""
+
+    def __init__(self, memory_budget):
+        """
+        memory_budget: maximum memory used by data no view uses anymore, in bytes
+        """
+        self.__memory_budget = memory_budget
+        # key -> [data, reference count]
+        self.__entries = {}
+        # data -> key
+        self.__keys = {}
+        # released entries, least recently used first: key -> size
+        self.__released = OrderedDict()
+
+    def memory_budget(self):
+        return self.__memory_budget
+
+    def set_memory_budget(self, memory_budget):
+        self.__memory_budget = memory_budget
+        self.__evict()
+
+    def acquire(self, key, factory):
+        """Returns the data of the given key, created by calling factory() if not in the cache.
+        Each call must be balanced by a call to release().
+
+        key: (source URI, provider, filter expression, columns), columns being a tuple
+             that identifies how the data are read
+        factory: function that returns a new DataInterface
+        """
+        entry = self.__entries.get(key)
+        if entry is None:
+            data = factory()
+            if data is None:
+                return None
+            entry = [data, 0]
+            self.__entries[key] = entry
+            self.__keys[data] = key
+        self.__released.pop(key, None)
+        entry[1] += 1
+        return entry[0]
+
+    def contains(self, key):
+        """Returns True if the data of the given key are in the cache"""
+        return key in self.__entries
+
+    def release(self, data):
+        """Release data acquired from this cache.
+
+        Returns False if the data do not come from the cache.
+        """
+        key = self.__keys.get(data)
+        if key is None:
+            return False
+        entry = self.__entries[key]
+        entry[1] -= 1
+        if entry[1] > 0:
+            return True
+
+        if data.is_loading():
+            # partially loaded data cannot be reused
+            data.cancel_loading()
+            self.__remove(key)
+        else:
+            self.__released[key] = data.nbytes()
+            self.__evict()
+        return True
+
+    def clear(self):
+        """Forget all the data no view uses anymore"""
+        for key in list(self.__released.keys()):
+            self.__remove(key)
+
+    def __remove(self, key):
+        data, _ = self.__entries.pop(key)
+        del self.__keys[data]
+        self.__released.pop(key, None)
+
+    def __evict(self):
+        """Remove least recently released data until the memory budget is met"""
+        while self.__released and sum(self.__released.values()) > self.__memory_budget:
+            self.__remove(next(iter(self.__released)))
+
+_data_cache = None
+
+def data_cache():
+    """Returns the process-wide data cache.
+
+    Its memory budget is read from the 'data_cache_budget_mb' setting.
+    """
+    global _data_cache
+    if _data_cache is None:
+        s = QSettings("Oslandia", "qgeologis")
+        budget = int(s.value("data_cache_budget_mb", DEFAULT_MEMORY_BUDGET_MB))
+        _data_cache = DataCache(budget * 1024 * 1024)
+    return _data_cache
@@ -16,19 +16,226 @@
 #   License along with this library; if not, see <http://www.gnu.org/licenses/>.
 #
 
-from qgis.PyQt.QtCore import pyqtSignal, QObject
-from qgis.core import QgsFeatureRequest
+from qgis.PyQt.QtCore import pyqtSignal, QObject, QTimer
+from qgis.core import QgsFeatureRequest, QgsExpression, QgsExpressionContext, QgsExpressionContextUtils
+from qgis.core import QgsAggregateCalculator
+
+from .qt_qgis_compat import QgsApplication, QgsMessageLog, QgsTask, QgsVectorLayerFeatureSource
+from .lod import LodPyramid, m4_indices
+from .array_parser import array_from_attribute
+from .series import SampledSeries, RegularSeries, SegmentMerger, _read_only
+from .series import OVERLAP_POLICIES, OVERLAP_KEEP_FIRST, OVERLAP_KEEP_LATEST, OVERLAP_AVERAGE
 
 import numpy as np
+from collections import OrderedDict
+
+# initial size of the columnar buffers used while reading features,
+# and number of features per chunk for background loading
+LOAD_CHUNK_SIZE = 65536
+
+def _to_float(value):
+    """Convert an attribute value to float, NULL values are mapped to NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _nan_min_max(values):
+    """Return (min, max) of an array, ignoring NaN. (None, None) if there is no valid value"""
+    if len(values) == 0 or np.isnan(values).all():
+        return (None, None)
+    return (float(np.nanmin(values)), float(np.nanmax(values)))
+
+def _patch_min_max(current, removed, added, values):
+    """Update a (min, max) pair after some values have been removed and added.
+
+    The whole array is only scanned again when a removed value was an extremum.
+    """
+    v_min, v_max = current
+    if v_min is None or np.any(removed == v_min) or np.any(removed == v_max):
+        return _nan_min_max(values)
+    a_min, a_max = _nan_min_max(added)
+    if a_min is None:
+        return current
+    return (min(v_min, a_min), max(v_max, a_max))
+
+def _expression_filter(layer, filter_expression):
+    """Returns a predicate that tells if a feature of the layer matches the filter expression"""
+    expression = QgsExpression(filter_expression)
+    context = QgsExpressionContext()
+    context.appendScope(QgsExpressionContextUtils.layerScope(layer))
+    expression.prepare(context)
+
+    def accept(feature):
+        context.setFeature(feature)
+        return bool(expression.evaluate(context))
+    return accept
+
+def _aggregate(layer, aggregate, fieldname, filter_expression=None):
+    """Compute an aggregate of a column, the provider may compute it on its side"""
+    params = QgsAggregateCalculator.AggregateParameters()
+    if filter_expression is not None:
+        params.filter = filter_expression
+    value, ok = layer.aggregate(aggregate, fieldname, params)
+    if not ok:
+        return None
+    return _to_float(value)
+
+def _change_token(layer):
+    """Returns a token that changes when features are added to or removed from the layer:
+    its feature count and the maximum of its primary key"""
+    max_id = None
+    pk_indexes = layer.dataProvider().pkAttributeIndexes()
+    if len(pk_indexes) == 1:
+        max_id = _aggregate(layer, QgsAggregateCalculator.Max, layer.fields().at(pk_indexes[0]).name())
+    return (layer.featureCount(), max_id)
+
+def _read_columns(source, req, x_idx, y_idx, nodata_value, accept=None, chunk_size=None):
+    """Read feature ids, X and Y values of the features of a request in one pass.
+
+    source: a layer, or a feature source if called from a worker thread
+    accept: optional predicate on features, used to filter them on the client side
+    chunk_size: if set, unsorted (fids, x_values, y_values) chunks of at most chunk_size
+                features are yielded as soon as they are read. Otherwise everything is yielded
+                in one chunk.
+    """
+    # values are stored in columnar buffers that grow by chunks
+    size = chunk_size or LOAD_CHUNK_SIZE
+    fids = np.empty(size, dtype=np.int64)
+    x_values = np.empty(size, dtype=np.float64)
+    y_values = np.empty(size, dtype=np.float64)
+    n = 0
+    for f in source.getFeatures(req):
+        if accept is not None and not accept(f):
+            continue
+        if n == size:
+            if chunk_size is not None:
+                yield fids, x_values, y_values
+                fids = np.empty(size, dtype=np.int64)
+                x_values = np.empty(size, dtype=np.float64)
+                y_values = np.empty(size, dtype=np.float64)
+                n = 0
+            else:
+                size *= 2
+                fids.resize(size, refcheck=False)
+                x_values.resize(size, refcheck=False)
+                y_values.resize(size, refcheck=False)
+        attrs = f.attributes()
+        fids[n] = f.id()
+        x_values[n] = _to_float(attrs[x_idx])
+        y_values[n] = _to_float(attrs[y_idx] or nodata_value)
+        n += 1
+
+    if n > 0 or chunk_size is None:
+        yield fids[:n], x_values[:n], y_values[:n]
+
+class DataLoadTask(QgsTask if QgsTask is not None else QObject):
+    """Task that reads data in a background thread and hands them over by chunks.
+
+    read_chunks: function called from the worker thread with the task as argument.
+                 It must return an iterable of chunks and may report progress
+                 with task.setProgress().
+    """
+
+    # a chunk of data has been read. Connections are queued, so that
+    # chunks are received in the thread of the receiver
+    chunkLoaded = pyqtSignal(object)
+
+    def __init__(self, description, read_chunks):
+        QgsTask.__init__(self, description, QgsTask.CanCancel)
+        self.__read_chunks = read_chunks
+        self.__exception = None
+
+    def run(self):
+        try:
+            for chunk in self.__read_chunks(self):
+                if self.isCanceled():
+                    return False
+                self.chunkLoaded.emit(chunk)
+        except Exception as e:
+            self.__exception = e
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        if self.__exception is not None:
+            QgsMessageLog.logMessage("{}: {}".format(self.description(), self.__exception), "QGeoloGIS")
 
 class DataInterface(QObject):
     """DataInterface is a class that abstracts how a bunch of (X,Y) data are represented"""
 
     data_modified = pyqtSignal()
 
+    # progress of a background loading, in percent
+    loading_progress = pyqtSignal(float)
+    # a background loading is over, either finished or canceled
+    loading_finished = pyqtSignal()
+
     def __init__(self):
         QObject.__init__(self)
 
+        self.__lod = None
+
+    def get_series(self):
+        """Returns the values as a series (see series.py), None if there is no value.
+        Subclasses may return a more compact representation than explicit X values"""
+        x_values, y_values = self.get_x_values(), self.get_y_values()
+        if x_values is None:
+            return None
+        return SampledSeries(x_values, y_values)
+
+    def lod_pyramid(self):
+        """Returns the level of detail pyramid of the values, built on first use.
+        None if there is no value"""
+        if self.__lod is None:
+            series = self.get_series()
+            if series is None or len(series) == 0:
+                return None
+            self.__lod = LodPyramid(series)
+        return self.__lod
+
+    def _lod_arrays(self):
+        """Returns the arrays of the level of detail pyramid, to be stored in a disk cache"""
+        lod = self.lod_pyramid()
+        return lod.arrays() if lod is not None else {}
+
+    def _restore_lod(self, arrays):
+        """Restore the level of detail pyramid from arrays returned by _lod_arrays()"""
+        series = self.get_series()
+        if series is not None and len(series) > 0:
+            self.__lod = LodPyramid.from_arrays(series, arrays)
+
+    def _values_changed(self, from_index=0):
+        """To be called by subclasses when their values have changed.
+
+        from_index: first sorted index that has changed
+        """
+        if self.__lod is not None:
+            self.__lod.update(self.get_series(), from_index)
+
+    def nbytes(self):
+        """Memory used by the values and their level of detail pyramid, in bytes"""
+        series = self.get_series()
+        size = series.nbytes() if series is not None else 0
+        if self.__lod is not None:
+            size += self.__lod.nbytes()
+        return size
+
+    def is_loading(self):
+        """Returns True while data are being loaded in the background"""
+        return False
+
+    def cancel_loading(self):
+        """Cancel a background loading, if any"""
+        pass
+
+    def set_x_window(self, x_min, x_max):
+        """Called by views when the displayed X range changes.
+
+        Data that are not entirely loaded in memory can use it to fetch the needed values.
+        """
+        pass
+
     def get_x_values(self):
         raise("DataInterface is an abstract class, get_x_values() "
               "must be defined")
@@ -70,7 +277,14 @@ class LayerData(DataInterface):
     They will be sorted on X before being displayed.
     """
 
-    def __init__(self, layer, x_fieldname, y_fieldname, filter_expression = None, nodata_value = 0.0, uom = None):
+    def __init__(self, layer, x_fieldname, y_fieldname, filter_expression = None, nodata_value = 0.0, uom = None,
+                 load_async = False, disk_cache = None):
+        """
+        load_async: if True, data are loaded in a background task and data_modified is emitted
+                    each time a new chunk of data is available
+        disk_cache: optional DiskCache (see disk_cache.py) where loaded values are stored,
+                    and read from when the layer has not changed
+        """
 
         DataInterface.__init__(self)
 
@@ -87,19 +301,54 @@ class LayerData(DataInterface):
         self.__nodata_value = nodata_value
         self.__uom = uom
 
-        layer.attributeValueChanged.connect(self.__build_data)
-        layer.featureAdded.connect(self.__build_data)
-        layer.featureDeleted.connect(self.__build_data)
+        # fids aligned with the sorted x / y arrays
+        self.__fids = None
+        # fid -> sorted position index, built on demand
+        self.__fid_index = None
+
+        # changes received during the current event loop iteration
+        self.__pending_fids = set()
+        self.__pending_reload = False
+        self.__update_scheduled = False
+
+        # background loading task, if any
+        self.__task = None
+
+        self.__disk_cache = disk_cache
+        # key of the values in the disk cache, if any
+        self.__disk_cache_key = None
 
-        self.__build_data()
+        layer.attributeValueChanged.connect(self.__on_attribute_value_changed)
+        layer.featureAdded.connect(self.__on_feature_changed)
+        layer.featureDeleted.connect(self.__on_feature_changed)
+        # feature ids are remapped on commit, and a rollback may not be
+        # notified feature by feature
+        layer.editingStopped.connect(self.__on_layer_reset)
+
+        # Get unit of the first feature if needed
+        if self.__uom is not None and self.__uom.startswith("@"):
+            req = self.__filter_request()
+            req.setSubsetOfAttributes([self.__uom[1:]], self.__layer.fields())
+            req.setLimit(1)
+            for f in self.__layer.getFeatures(req):
+                self.__uom = f[self.__uom[1:]]
+
+        if self.__load_from_disk_cache():
+            return
+        if load_async and QgsTask is not None:
+            self.__load_async()
+        else:
+            self.__build_data()
 
     def get_y_values(self):
+        """Returns Y values as a read-only numpy array, sorted on X"""
         return self.__y_values
 
     def get_layer(self):
         return self.__layer
 
     def get_x_values(self):
+        """Returns sorted X values as a read-only numpy array"""
         return self.__x_values
 
     def get_x_min(self):
@@ -117,38 +366,540 @@ class LayerData(DataInterface):
     def uom(self):
         return self.__uom
 
-    def __build_data(self):
+    def is_loading(self):
+        return self.__task is not None
 
+    def cancel_loading(self):
+        if self.__task is not None:
+            self.__task.cancel()
+
+    def __request(self, extra_columns=()):
+        """Returns a feature request on the needed columns only, without geometries"""
         req = QgsFeatureRequest()
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+        columns = [self.__x_fieldname, self.__y_fieldname] + list(extra_columns)
+        req.setSubsetOfAttributes(columns, self.__layer.fields())
+        return req
+
+    def __filter_request(self):
+        """Returns a request on the features matching the filter expression"""
+        req = self.__request()
         if self.__filter_expression is not None:
             req.setFilterExpression(self.__filter_expression)
         # TODO It should have been way more better to use addOrderBy on
         # QgsFeatureRequest but it doesn't work well (with memory data for
         # instance) in QGIS 2 To be changed in QGIS 3
+        return req
+
+    def __read_features(self, req, accept=None, chunk_size=None, source=None):
+        fields = self.__layer.fields()
+        return _read_columns(source or self.__layer, req,
+                             fields.indexFromName(self.__x_fieldname),
+                             fields.indexFromName(self.__y_fieldname),
+                             self.__nodata_value, accept, chunk_size)
+
+    def __set_values(self, fids, x_values, y_values):
+        """Replace all the values by unsorted ones"""
+        order = np.argsort(x_values, kind="mergesort")
+        self.__fids = fids[order]
+        self.__fid_index = None
+        self.__x_values = _read_only(x_values[order])
+        self.__y_values = _read_only(y_values[order])
+
+        self.__x_min, self.__x_max = _nan_min_max(self.__x_values)
+        self.__y_min, self.__y_max = _nan_min_max(self.__y_values)
+        self._values_changed()
+
+    def __set_sorted_values(self, fids, x_values, y_values):
+        """Replace all the values by values already sorted on X, without copying them"""
+        self.__fids = fids
+        self.__fid_index = None
+        self.__x_values = _read_only(x_values)
+        self.__y_values = _read_only(y_values)
+
+        self.__x_min, self.__x_max = _nan_min_max(self.__x_values)
+        self.__y_min, self.__y_max = _nan_min_max(self.__y_values)
+        self._values_changed()
 
-        # Sort data on x for correct display
-        xy_values = list(zip([f[self.__x_fieldname]
-                              for f in self.__layer.getFeatures(req)],
-                             [f[self.__y_fieldname] or self.__nodata_value
-                              for f in self.__layer.getFeatures(req)]))
+    def __insert_values(self, fids, x_values, y_values, keep=None):
+        """Insert unsorted values at their sorted positions.
+
+        keep: optional boolean mask of the current values to keep
+        """
+        order = np.argsort(x_values, kind="mergesort")
+        fids, x_values, y_values = fids[order], x_values[order], y_values[order]
+        old_fids, old_x, old_y = self.__fids, self.__x_values, self.__y_values
+        removed_x = removed_y = np.empty(0)
+        # first sorted position that changes
+        first_change = len(old_x)
+        if keep is not None:
+            removed_x, removed_y = old_x[~keep], old_y[~keep]
+            old_fids, old_x, old_y = old_fids[keep], old_x[keep], old_y[keep]
+            if not keep.all():
+                first_change = int(np.argmin(keep))
+
+        where = np.searchsorted(old_x, x_values, side="right")
+        if len(where) > 0:
+            first_change = min(first_change, int(where[0]))
+        self.__fids = np.insert(old_fids, where, fids)
+        self.__fid_index = None
+        self.__x_values = _read_only(np.insert(old_x, where, x_values))
+        self.__y_values = _read_only(np.insert(old_y, where, y_values))
+
+        self.__x_min, self.__x_max = _patch_min_max((self.__x_min, self.__x_max), removed_x, x_values, self.__x_values)
+        self.__y_min, self.__y_max = _patch_min_max((self.__y_min, self.__y_max), removed_y, y_values, self.__y_values)
+        self._values_changed(first_change)
+
+    def __build_data(self):
+        self.__disk_cache_key = self.__cache_key()
+        fids, x_values, y_values = next(self.__read_features(self.__filter_request()))
+        self.__set_values(fids, x_values, y_values)
+        self.__store_in_disk_cache()
+        self.data_modified.emit()
+
+    def __cache_key(self):
+        """Returns the key of the values in the disk cache, None if they cannot be cached"""
+        if self.__disk_cache is None or self.__layer.isModified():
+            return None
+        layer = self.__layer
+        return self.__disk_cache.key("LayerData", layer.source(), layer.providerType(), self.__filter_expression,
+                                     self.__x_fieldname, self.__y_fieldname, self.__nodata_value,
+                                     _change_token(layer))
+
+    def __load_from_disk_cache(self):
+        """Load values from the disk cache, returns False if they are not there"""
+        key = self.__cache_key()
+        arrays = self.__disk_cache.load(key) if key is not None else None
+        if arrays is None:
+            return False
+        self.__disk_cache_key = key
+        # memory-mapped arrays are used as is
+        self.__set_sorted_values(arrays["fids"], arrays["x_values"], arrays["y_values"])
+        self._restore_lod(arrays)
+        self.data_modified.emit()
+        return True
+
+    def __store_in_disk_cache(self):
+        if self.__disk_cache_key is None:
+            return
+        arrays = {"fids": self.__fids, "x_values": self.__x_values, "y_values": self.__y_values}
+        arrays.update(self._lod_arrays())
+        self.__disk_cache.store(self.__disk_cache_key, arrays)
+
+    def __load_async(self):
+        # start with no data, chunks are inserted as they arrive
+        self.__set_values(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        self.__disk_cache_key = self.__cache_key()
+
+        # the layer must not be accessed from the worker thread, use a feature source
+        source = QgsVectorLayerFeatureSource(self.__layer)
+        req = self.__filter_request()
+        total = self.__layer.featureCount()
+        chunks = self.__read_features(req, chunk_size=LOAD_CHUNK_SIZE, source=source)
+
+        def read_chunks(task):
+            n = 0
+            for chunk in chunks:
+                n += len(chunk[0])
+                if total > 0:
+                    task.setProgress(min(100.0, 100.0 * n / total))
+                yield chunk
+
+        self.__task = DataLoadTask("Loading {}".format(self.__layer.name()), read_chunks)
+        self.__task.chunkLoaded.connect(self.__on_chunk_loaded)
+        self.__task.progressChanged.connect(self.loading_progress)
+        # only complete data are cached
+        self.__task.taskCompleted.connect(self.__store_in_disk_cache)
+        self.__task.taskCompleted.connect(self.__on_loading_finished)
+        self.__task.taskTerminated.connect(self.__on_loading_finished)
+        QgsApplication.taskManager().addTask(self.__task)
+
+    def __on_chunk_loaded(self, chunk):
+        self.__insert_values(*chunk)
+        self.data_modified.emit()
+
+    def __on_loading_finished(self):
+        self.__task = None
+        self.loading_finished.emit()
+        # apply changes received during the loading
+        if self.__pending_fids or self.__pending_reload:
+            self.__schedule_update()
+
+    def __on_attribute_value_changed(self, fid, idx, value):
+        field_name = self.__layer.fields().at(idx).name()
+        if field_name in (self.__x_fieldname, self.__y_fieldname):
+            self.__on_feature_changed(fid)
+
+    def __on_feature_changed(self, fid):
+        self.__pending_fids.add(fid)
+        self.__schedule_update()
+
+    def __on_layer_reset(self):
+        self.__pending_reload = True
+        self.__schedule_update()
+
+    def __schedule_update(self):
+        # signals received in the same event loop iteration are coalesced,
+        # they are kept for later during a background loading
+        if not self.__update_scheduled and self.__task is None:
+            self.__update_scheduled = True
+            QTimer.singleShot(0, self.__apply_pending_changes)
+
+    def __positions_of(self, fids):
+        """Returns the sorted positions of the given feature ids, unknown ids are ignored"""
+        if self.__fid_index is None:
+            order = np.argsort(self.__fids, kind="mergesort")
+            self.__fid_index = (self.__fids[order], order)
+        sorted_fids, order = self.__fid_index
+        if len(sorted_fids) == 0:
+            return np.empty(0, dtype=np.int64)
+        query = np.fromiter(fids, dtype=np.int64, count=len(fids))
+        i = np.minimum(np.searchsorted(sorted_fids, query), len(sorted_fids) - 1)
+        return order[i[sorted_fids[i] == query]]
+
+    def __apply_pending_changes(self):
+        self.__update_scheduled = False
+        fids, self.__pending_fids = self.__pending_fids, set()
+        if self.__pending_reload:
+            self.__pending_reload = False
+            # committed changes are not always seen by the change token
+            if self.__disk_cache_key is not None:
+                self.__disk_cache.remove(self.__disk_cache_key)
+            self.__build_data()
+            return
+        if not fids:
+            return
+
+        # the previous state of the changed features will be removed
+        keep = np.ones(len(self.__fids), dtype=bool)
+        keep[self.__positions_of(fids)] = False
+
+        # read their current state (deleted features are simply not returned)
+        # the filter expression cannot be combined with a fid filter, it is evaluated here
+        req = self.__request()
+        accept = None
+        if self.__filter_expression is not None:
+            req = self.__request(QgsExpression(self.__filter_expression).referencedColumns())
+            accept = _expression_filter(self.__layer, self.__filter_expression)
+        req.setFilterFids(list(fids))
+        new_fids, new_x, new_y = next(self.__read_features(req, accept))
+
+        self.__insert_values(new_fids, new_x, new_y, keep)
+        self.data_modified.emit()
+
+
+class WindowedLayerData(DataInterface):
+    """WindowedLayerData model the same data as LayerData, but only the X range displayed is loaded.
+
+    The X axis is split into tiles of a fixed size. Tiles are fetched in the background with a range
+    filter on X, that providers can run on their side, and kept in a LRU cache bounded by a number
+    of tiles and a memory budget. Tiles next to the displayed window, in the direction it moves,
+    are prefetched.
+
+    Each loaded tile is also summarized by a M4 decimation (see lod.py) that is kept when the tile
+    is evicted. Windows wider than the tile cache display these summaries instead of the full values.
+    """
+
+    # resolution of the summary of a tile, in columns
+    SUMMARY_COLUMNS = 256
+
+    def __init__(self, layer, x_fieldname, y_fieldname, filter_expression = None, nodata_value = 0.0, uom = None,
+                 tile_size = None, memory_budget = 64 * 1024 * 1024, prefetch_tiles = 2, max_tiles = 32):
+        """
+        tile_size: size of a tile, in X units. Defaults to 1/256th of the X extent
+        memory_budget: maximum size of cached tiles, in bytes
+        prefetch_tiles: number of tiles to prefetch in the direction of the move
+        max_tiles: maximum number of cached tiles. Wider windows display tile summaries
+        """
+
+        DataInterface.__init__(self)
+
+        self.__y_fieldname = y_fieldname
+        self.__x_fieldname = x_fieldname
+        self.__layer = layer
+        self.__filter_expression = filter_expression
+        self.__nodata_value = nodata_value
+        self.__uom = uom
+        self.__memory_budget = memory_budget
+        self.__prefetch_tiles = prefetch_tiles
+        self.__max_tiles = max(max_tiles, 1)
+
+        self.__x_values = np.empty(0)
+        self.__y_values = np.empty(0)
+
+        self.__x_min = None
+        self.__x_max = None
+        self.__y_min = None
+        self.__y_max = None
+        self.__update_extent()
+
+        if tile_size is None and self.__x_min is not None:
+            tile_size = (self.__x_max - self.__x_min) / 256.0
+        self.__tile_size = tile_size or 1.0
+
+        # tile index -> (x_values, y_values), least recently used first
+        self.__tiles = OrderedDict()
+        self.__tiles_size = 0
+        # tile index -> decimated (x_values, y_values)
+        self.__summaries = {}
+        # tile range currently displayed, whether it displays summaries and the tiles it contains
+        self.__tile_range = None
+        self.__wide = False
+        self.__displayed = set()
+        # tiles being loaded and the loading tasks
+        self.__loading = set()
+        self.__tasks = []
+        # tiles read before the last invalidation are ignored
+        self.__generation = 0
+
+        self.__invalidate_scheduled = False
+        layer.attributeValueChanged.connect(self.__on_layer_changed)
+        layer.featureAdded.connect(self.__on_layer_changed)
+        layer.featureDeleted.connect(self.__on_layer_changed)
+        layer.editingStopped.connect(self.__on_layer_changed)
 
         # Get unit of the first feature if needed
         if self.__uom is not None and self.__uom.startswith("@"):
-            for f in self.__layer.getFeatures(req):
+            req = QgsFeatureRequest()
+            req.setFlags(QgsFeatureRequest.NoGeometry)
+            if filter_expression is not None:
+                req.setFilterExpression(filter_expression)
+            req.setSubsetOfAttributes([self.__uom[1:]], layer.fields())
+            req.setLimit(1)
+            for f in layer.getFeatures(req):
                 self.__uom = f[self.__uom[1:]]
-                break
 
-        # sort on x
-        xy_values.sort(key=lambda coord: coord[0])
+    def get_y_values(self):
+        """Returns Y values of the current window as a read-only numpy array, sorted on X"""
+        return self.__y_values
+
+    def get_layer(self):
+        return self.__layer
+
+    def get_x_values(self):
+        """Returns sorted X values of the current window as a read-only numpy array"""
+        return self.__x_values
 
-        self.__x_values = [coord[0] for coord in xy_values]
-        self.__y_values = [coord[1] for coord in xy_values]
+    def get_x_min(self):
+        return self.__x_min
+
+    def get_x_max(self):
+        return self.__x_max
+
+    def get_y_min(self):
+        return self.__y_min
+
+    def get_y_max(self):
+        return self.__y_max
+
+    def uom(self):
+        return self.__uom
+
+    def is_loading(self):
+        return len(self.__tasks) > 0
+
+    def cancel_loading(self):
+        for task in self.__tasks:
+            task.cancel()
+
+    def set_x_window(self, x_min, x_max):
+        if self.__x_min is None:
+            # no data
+            return
+        last_tile = self.__last_tile()
+        first = min(max(int((x_min - self.__x_min) // self.__tile_size), 0), last_tile)
+        # a window that ends on a tile boundary does not need the next tile
+        last = min(max(int(np.ceil((x_max - self.__x_min) / self.__tile_size)) - 1, first), last_tile)
+
+        previous_range = self.__tile_range
+        if (first, last) != previous_range:
+            self.__tile_range = (first, last)
+            self.__wide = last - first + 1 > self.__max_tiles
+            self.__display_tiles()
+
+        # summaries of the tiles are kept, full values may have been evicted
+        available = self.__summaries if self.__wide else self.__tiles
+        missing = [i for i in range(first, last + 1) if i not in available and i not in self.__loading]
+        self.__load(missing, "Loading {}")
+
+        # prefetch in the direction of the move
+        if previous_range is not None and not self.__wide:
+            if first > previous_range[0] or last > previous_range[1]:
+                to_prefetch = range(last + 1, min(last + self.__prefetch_tiles, last_tile) + 1)
+            elif first < previous_range[0] or last < previous_range[1]:
+                to_prefetch = range(max(first - self.__prefetch_tiles, 0), first)
+            else:
+                to_prefetch = []
+            self.__load([i for i in to_prefetch if i not in self.__tiles and i not in self.__loading],
+                        "Prefetching {}")
 
-        self.__x_min, self.__x_max = (min(self.__x_values), max(self.__x_values))
-        self.__y_min, self.__y_max = (min(self.__y_values), max(self.__y_values))
+    def __last_tile(self):
+        return int((self.__x_max - self.__x_min) // self.__tile_size)
 
+    def __tile_request(self, tile):
+        """Returns a request on the features of a tile"""
+        x_start = self.__x_min + tile * self.__tile_size
+        x_column = QgsExpression.quotedColumnRef(self.__x_fieldname)
+        expression = "{x} >= {start:.17g} AND {x} < {end:.17g}".format(x=x_column, start=x_start, end=x_start + self.__tile_size)
+        if tile == self.__last_tile():
+            # the last tile includes the upper bound
+            expression = "{x} >= {start:.17g}".format(x=x_column, start=x_start)
+        if self.__filter_expression is not None:
+            expression = "({}) AND {}".format(self.__filter_expression, expression)
+
+        req = QgsFeatureRequest()
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes([self.__x_fieldname, self.__y_fieldname], self.__layer.fields())
+        req.setFilterExpression(expression)
+        return req
+
+    def __read_tiles(self, source, tiles):
+        """Returns a generator of (tile, (x_values, y_values), summary) for the given tiles.
+
+        Requests are prepared here, so that the generator can run in a worker thread.
+        """
+        fields = self.__layer.fields()
+        x_idx = fields.indexFromName(self.__x_fieldname)
+        y_idx = fields.indexFromName(self.__y_fieldname)
+        requests = [(tile, self.__tile_request(tile)) for tile in tiles]
+        nodata_value = self.__nodata_value
+        x_min, tile_size, columns = self.__x_min, self.__tile_size, self.SUMMARY_COLUMNS
+
+        def read():
+            for tile, req in requests:
+                _, x_values, y_values = next(_read_columns(source, req, x_idx, y_idx, nodata_value))
+                order = np.argsort(x_values, kind="mergesort")
+                x_values, y_values = _read_only(x_values[order]), _read_only(y_values[order])
+                # the last tile may be longer, its values are clipped to the last column
+                pixels = np.minimum((x_values - x_min - tile * tile_size) * (columns / tile_size), columns - 1)
+                kept = m4_indices(pixels, y_values)
+                summary = (_read_only(x_values[kept]), _read_only(y_values[kept]))
+                yield tile, (x_values, y_values), summary
+        return read()
+
+    def __load(self, tiles, description):
+        """Read tiles in the background, they are received by __on_tile_loaded"""
+        if not tiles:
+            return
+        if QgsTask is None:
+            # no background task with QGIS 2
+            for chunk in self.__read_tiles(self.__layer, tiles):
+                self.__on_tile_loaded(self.__generation, chunk)
+            return
+
+        self.__loading.update(tiles)
+        # the layer must not be accessed from the worker thread, use a feature source
+        chunks = self.__read_tiles(QgsVectorLayerFeatureSource(self.__layer), tiles)
+
+        def read_chunks(task):
+            for i, chunk in enumerate(chunks):
+                yield chunk
+                task.setProgress(100.0 * (i + 1) / len(tiles))
+
+        generation = self.__generation
+        task = DataLoadTask(description.format(self.__layer.name()), read_chunks)
+        task.chunkLoaded.connect(lambda chunk: self.__on_tile_loaded(generation, chunk))
+        task.taskCompleted.connect(lambda: self.__on_load_finished(task, generation, tiles))
+        task.taskTerminated.connect(lambda: self.__on_load_finished(task, generation, tiles))
+        self.__tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+
+    def __on_tile_loaded(self, generation, chunk):
+        if generation != self.__generation:
+            # outdated
+            return
+        tile, values, summary = chunk
+        self.__loading.discard(tile)
+        self.__summaries[tile] = summary
+        if tile not in self.__tiles:
+            self.__tiles[tile] = values
+            self.__tiles_size += values[0].nbytes + values[1].nbytes
+
+        first, last = self.__tile_range if self.__tile_range is not None else (0, -1)
+        if first <= tile <= last and tile not in self.__displayed:
+            self._values_changed(self.__insert_tile(tile, summary if self.__wide else values))
+            self.data_modified.emit()
+        # displayed values are copies, tiles can be evicted whatever the window
+        self.__evict()
+
+    def __on_load_finished(self, task, generation, tiles):
+        self.__tasks.remove(task)
+        if generation == self.__generation:
+            # tiles not received (canceled or failed) may be requested again
+            self.__loading.difference_update(tiles)
+        if not self.__tasks:
+            self.loading_finished.emit()
+
+    def __display_tiles(self):
+        """Display the available tiles of the current range"""
+        first, last = self.__tile_range
+        self.__displayed = set()
+        self.__x_values = _read_only(np.empty(0))
+        self.__y_values = _read_only(np.empty(0))
+        for tile in range(first, last + 1):
+            if self.__wide:
+                values = self.__summaries.get(tile)
+            else:
+                values = self.__tiles.pop(tile, None)
+                if values is not None:
+                    # most recently used
+                    self.__tiles[tile] = values
+            if values is not None:
+                self.__insert_tile(tile, values)
+        self._values_changed()
         self.data_modified.emit()
 
+    def __insert_tile(self, tile, values):
+        """Insert the values of a tile among the displayed values, tiles do not overlap.
+        Returns the index of the first inserted value"""
+        x_values, y_values = values
+        where = 0
+        if len(x_values) > 0:
+            where = int(np.searchsorted(self.__x_values, x_values[0]))
+            self.__x_values = _read_only(np.insert(self.__x_values, where, x_values))
+            self.__y_values = _read_only(np.insert(self.__y_values, where, y_values))
+        self.__displayed.add(tile)
+        return where
+
+    def __evict(self):
+        """Remove least recently used tiles until the number of tiles and the memory budget are met"""
+        while self.__tiles and (len(self.__tiles) > self.__max_tiles or self.__tiles_size > self.__memory_budget):
+            _, (x_values, y_values) = self.__tiles.popitem(last=False)
+            self.__tiles_size -= x_values.nbytes + y_values.nbytes
+
+    def __update_extent(self):
+        # extents are computed without reading data
+        layer, filter_expression = self.__layer, self.__filter_expression
+        self.__x_min = _aggregate(layer, QgsAggregateCalculator.Min, self.__x_fieldname, filter_expression)
+        self.__x_max = _aggregate(layer, QgsAggregateCalculator.Max, self.__x_fieldname, filter_expression)
+        self.__y_min = _aggregate(layer, QgsAggregateCalculator.Min, self.__y_fieldname, filter_expression)
+        self.__y_max = _aggregate(layer, QgsAggregateCalculator.Max, self.__y_fieldname, filter_expression)
+
+    def __on_layer_changed(self, *args):
+        # edits received in the same event loop iteration are coalesced
+        if not self.__invalidate_scheduled:
+            self.__invalidate_scheduled = True
+            QTimer.singleShot(0, self.__invalidate)
+
+    def __invalidate(self):
+        """Drop cached tiles and reload the current window"""
+        self.__invalidate_scheduled = False
+        self.__tiles.clear()
+        self.__tiles_size = 0
+        self.__summaries.clear()
+        # tiles being loaded may be outdated
+        self.__generation += 1
+        self.__loading.clear()
+        self.cancel_loading()
+        if self.__tile_range is not None:
+            # reload the same X range, the tile grid may have moved with the extent
+            first, last = self.__tile_range
+            x_min = self.__x_min + first * self.__tile_size
+            x_max = self.__x_min + (last + 1) * self.__tile_size
+            self.__tile_range = None
+            self.__update_extent()
+            self.set_x_window(x_min, x_max)
+
 
 class FeatureData(DataInterface):
     """FeatureData model data that are stored on one feature (resp. row) in a layer (resp. table).
@@ -158,7 +909,9 @@ class FeatureData(DataInterface):
     construction.
     """
 
-    def __init__(self, layer, y_fieldname, x_values=None, feature_ids=None, x_start=None, x_delta=None, x_start_fieldname=None, x_delta_fieldname=None):
+    def __init__(self, layer, y_fieldname, x_values=None, feature_ids=None, x_start=None, x_delta=None, x_start_fieldname=None, x_delta_fieldname=None,
+                 load_async=False, overlap_policy=OVERLAP_KEEP_FIRST, filter_expression=None, disk_cache=None,
+                 segments=None):
         """
         layer: input QgsVectorLayer
         y_fieldname: name of the field in the input layer that carries data
@@ -168,10 +921,23 @@ class FeatureData(DataInterface):
         x_delta: interval between two X values.
         feature_ids: IDs of the features read. If set to None, the input data are assumed to represent one feature with ID=0
                      If more than one feature id is passed, their data will be merged.
-                     In case of overlap between features, one will be arbitrarily chosen, and a warning will be raised.
         x_start_fieldname: name of the field in the input layer that carries the starting X value
         x_delta_fieldname: name of the field in the input layer that carries the interval between two X values
+        load_async: if True, features are read in a background task and data_modified is emitted
+                    each time a batch of features has been merged
+        overlap_policy: how values of overlapping features are merged, see series.OVERLAP_POLICIES.
+                        The first feature is the one with the lowest ID.
+        filter_expression: expression that selects the features of the data, if any.
+                           Features added to the layer are then merged if they match it,
+                           otherwise only the given feature ids are followed.
+        disk_cache: optional DiskCache (see disk_cache.py) where loaded values are stored,
+                    and read from when the layer has not changed. Not used with given x_values
+        segments: (feature id, x_start, x_delta, y_values) of the features, if they have already been read
+                  (see read_station_segments). The layer is then not read
         """
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError("Unknown overlap policy: {}".format(overlap_policy))
+
         x_start_defined = x_start is not None or x_start_fieldname is not None
         x_delta_defined = x_delta is not None or x_delta_fieldname is not None
 
@@ -193,25 +959,66 @@ class FeatureData(DataInterface):
 
         self.__y_fieldname = y_fieldname
         self.__layer = layer
-        self.__x_values = x_values
+        self.__given_x_values = x_values
+        self.__overlap_policy = overlap_policy
+        # (x_start, x_delta, y_values) of each feature, by feature id
+        self.__segments = {}
+        # incremental merge of the segments, not used with given x_values
+        self.__merger = None
+        self.__series = None
+        self.__x_min = None
+        self.__x_max = None
+        self.__y_min = None
+        self.__y_max = None
         self.__x_start = x_start
         self.__x_start_fieldname = x_start_fieldname
         self.__x_delta = x_delta
         self.__x_delta_fieldname = x_delta_fieldname
-        self.__feature_ids = feature_ids
+        self.__feature_ids = set(feature_ids)
+        self.__filter_expression = filter_expression
+
+        # changes received during the current event loop iteration
+        self.__pending_fids = set()
+        self.__pending_reload = False
+        self.__update_scheduled = False
 
-        # TODO connect on feature modification
+        # background loading task, if any
+        self.__task = None
 
-        self.__build_data()
+        self.__disk_cache = disk_cache
+        # key of the values in the disk cache, if any
+        self.__disk_cache_key = None
+
+        layer.attributeValueChanged.connect(self.__on_attribute_value_changed)
+        layer.featureAdded.connect(self.__on_feature_added)
+        layer.featureDeleted.connect(self.__on_feature_changed)
+        # feature ids are remapped on commit, and a rollback may not be
+        # notified feature by feature
+        layer.editingStopped.connect(self.__on_layer_reset)
+
+        if self.__load_from_disk_cache():
+            return
+        if segments is not None:
+            self.__build_data(segments)
+        elif load_async and QgsTask is not None:
+            self.__load_async()
+        else:
+            self.__build_data()
+
+    def get_series(self):
+        """Returns a RegularSeries, or a SampledSeries if X values are given"""
+        return self.__series
 
     def get_y_values(self):
-        return self.__y_values
+        return self.__series.y_values() if self.__series is not None else None
 
     def get_layer(self):
         return self.__layer
 
     def get_x_values(self):
-        return self.__x_values
+        """Returns the X values. Regularly sampled X values are computed on each call,
+        get_series() should be preferred"""
+        return self.__series.x_values() if self.__series is not None else None
 
     def get_x_min(self):
         return self.__x_min
@@ -225,54 +1032,314 @@ class FeatureData(DataInterface):
     def get_y_max(self):
         return self.__y_max
 
-    def __build_data(self):
+    def is_loading(self):
+        return self.__task is not None
+
+    def cancel_loading(self):
+        if self.__task is not None:
+            self.__task.cancel()
+
+    def __columns(self):
+        """Returns the columns that carry the data"""
+        return [c for c in (self.__y_fieldname, self.__x_start_fieldname, self.__x_delta_fieldname)
+                if c is not None]
 
+    def __request(self, fids, extra_columns=()):
+        """Returns a request on the given features, with only the needed columns"""
         req = QgsFeatureRequest()
-        req.setFilterFids(self.__feature_ids)
-
-        self.__x_values = []
-        self.__y_values = []
-        current_data_range = None
-        for f in self.__layer.getFeatures(req):
-            raw_data = f[self.__y_fieldname]
-            if self.__x_start_fieldname is not None:
-                x_start = f[self.__x_start_fieldname]
-                x_delta = f[self.__x_delta_fieldname]
-            else:
-                x_start = self.__x_start
-                x_delta = self.__x_delta
+        req.setFilterFids(list(fids))
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes(self.__columns() + list(extra_columns), self.__layer.fields())
+        return req
 
-            if isinstance(raw_data, list):
-                # QGIS 3 natively reads array values
-                y_values = raw_data
-            else:
-                y_values = [None if value == 'NULL' else float(value)
-                                   for value in raw_data[1:-1].split(",")]
-
-            x_values = np.linspace(x_start, x_start + x_delta * len(y_values), len(y_values)).tolist()
-            
-            data_range = (x_start, x_start + x_delta * len(y_values))
-            if current_data_range is None:
-                current_data_range = data_range
-                self.__x_values = x_values
-                self.__y_values = y_values
-            else:
-                # look for overlap
-                if (current_data_range[0] < data_range[0] < current_data_range[1]) or \
-                   (current_data_range[0] < data_range[1] < current_data_range[1]):
-                    print("Overlap in data around feature #{}".format(f.id()))
-                    continue
-                if current_data_range[0] > data_range[1]:
-                    # new data are "on the left"
-                    self.__x_values = x_values + self.__x_values
-                    self.__y_values = y_values + self.__y_values
-                else:
-                    # new data are "on the right"
-                    self.__x_values = self.__x_values + x_values
-                    self.__y_values = self.__y_values + y_values
-                current_data_range = (self.__x_values[0], self.__x_values[-1])
-
-        self.__x_min, self.__x_max = (min(self.__x_values), max(self.__x_values))
-        self.__y_min, self.__y_max = (min([y for y in self.__y_values if y is not None]), max(self.__y_values))
+    def __read_segments(self, source=None, fids=None):
+        """Returns a generator of the segments of the given features, all the features by default.
+
+        Features that do not match the filter expression are skipped.
+        """
+        if fids is None:
+            fids = self.__feature_ids
+        req = self.__request(fids)
+        accept = None
+        if self.__filter_expression is not None and source is None:
+            # the filter expression cannot be combined with a fid filter, it is evaluated here
+            req = self.__request(fids, QgsExpression(self.__filter_expression).referencedColumns())
+            accept = _expression_filter(self.__layer, self.__filter_expression)
+        return _read_segments(source or self.__layer, req, self.__y_fieldname,
+                              self.__x_start, self.__x_delta,
+                              self.__x_start_fieldname, self.__x_delta_fieldname, accept)
+
+    def __build_data(self, segments=None):
+
+        self.__disk_cache_key = self.__cache_key()
+        self.__segments = {}
+        for segment in (segments if segments is not None else self.__read_segments()):
+            self.__add_segment(*segment)
+        self.__merger = None
+        self.__merge()
+        self._values_changed()
+        self.__store_in_disk_cache()
 
         self.data_modified.emit()
+
+    def __cache_key(self):
+        """Returns the key of the values in the disk cache, None if they cannot be cached"""
+        if self.__disk_cache is None or self.__given_x_values is not None or self.__layer.isModified():
+            return None
+        layer = self.__layer
+        return self.__disk_cache.key("FeatureData", layer.source(), layer.providerType(), sorted(self.__feature_ids),
+                                     self.__filter_expression, self.__y_fieldname,
+                                     self.__x_start, self.__x_delta, self.__x_start_fieldname, self.__x_delta_fieldname,
+                                     self.__overlap_policy, _change_token(layer))
+
+    def __load_from_disk_cache(self):
+        """Load values from the disk cache, returns False if they are not there"""
+        key = self.__cache_key()
+        arrays = self.__disk_cache.load(key) if key is not None else None
+        if arrays is None:
+            return False
+        self.__disk_cache_key = key
+        # segments of each feature, as views on the memory-mapped arrays
+        fids, starts, deltas, offsets = arrays["fids"], arrays["starts"], arrays["deltas"], arrays["offsets"]
+        y_values = arrays["y_values"]
+        self.__segments = dict((int(fid), (starts[i], deltas[i], y_values[offsets[i]:offsets[i+1]]))
+                               for i, fid in enumerate(fids))
+        self.__series = RegularSeries.from_arrays(dict((name, arrays["merged_" + name])
+                                                       for name in RegularSeries.ARRAYS))
+        # segments are merged again on the first change
+        self.__merger = None
+        self.__update_extent()
+        self._restore_lod(arrays)
+        self.data_modified.emit()
+        return True
+
+    def __store_in_disk_cache(self):
+        if self.__disk_cache_key is None:
+            return
+        fids = sorted(self.__segments.keys())
+        segments = [self.__segments[fid] for fid in fids]
+        arrays = {"fids": np.array(fids, dtype=np.int64),
+                  "starts": np.array([segment[0] for segment in segments], dtype=np.float64),
+                  "deltas": np.array([segment[1] for segment in segments], dtype=np.float64),
+                  "offsets": np.cumsum([0] + [len(segment[2]) for segment in segments]).astype(np.int64),
+                  "y_values": np.concatenate([np.asarray(segment[2], dtype=np.float64) for segment in segments])
+                              if segments else np.empty(0)}
+        for name, array in self.__series.arrays().items():
+            arrays["merged_" + name] = array
+        arrays.update(self._lod_arrays())
+        self.__disk_cache.store(self.__disk_cache_key, arrays)
+
+    def __load_async(self):
+        self.__disk_cache_key = self.__cache_key()
+        self.__segments = {}
+        self.__merger = None
+        self.__merge()
+
+        # the layer must not be accessed from the worker thread, use a feature source
+        segments = self.__read_segments(QgsVectorLayerFeatureSource(self.__layer))
+        total = len(self.__feature_ids)
+
+        def read_chunks(task):
+            # segments are sent by batches, each batch is merged and displayed at once
+            batch, batch_size = [], 0
+            for i, segment in enumerate(segments):
+                batch.append(segment)
+                batch_size += len(segment[3])
+                if batch_size >= LOAD_CHUNK_SIZE:
+                    task.setProgress(100.0 * (i + 1) / total)
+                    yield batch
+                    batch, batch_size = [], 0
+            if batch:
+                yield batch
+
+        self.__task = DataLoadTask("Loading {}".format(self.__layer.name()), read_chunks)
+        self.__task.chunkLoaded.connect(self.__on_chunk_loaded)
+        self.__task.progressChanged.connect(self.loading_progress)
+        # only complete data are cached
+        self.__task.taskCompleted.connect(self.__store_in_disk_cache)
+        self.__task.taskCompleted.connect(self.__on_loading_finished)
+        self.__task.taskTerminated.connect(self.__on_loading_finished)
+        QgsApplication.taskManager().addTask(self.__task)
+
+    def __on_chunk_loaded(self, segments):
+        for segment in segments:
+            self.__add_segment(*segment)
+        self._values_changed(self.__merge([segment[0] for segment in segments]))
+        self.data_modified.emit()
+
+    def __on_loading_finished(self):
+        self.__task = None
+        self.loading_finished.emit()
+        # apply changes received during the loading
+        if self.__pending_fids or self.__pending_reload:
+            self.__schedule_update()
+
+    def __on_attribute_value_changed(self, fid, idx, value):
+        field_name = self.__layer.fields().at(idx).name()
+        if field_name in self.__columns():
+            self.__on_feature_changed(fid)
+        elif self.__filter_expression is not None and \
+             field_name in QgsExpression(self.__filter_expression).referencedColumns():
+            # the feature may enter or leave the data
+            self.__on_feature_added(fid)
+
+    def __on_feature_added(self, fid):
+        if self.__filter_expression is not None:
+            self.__pending_fids.add(fid)
+            self.__schedule_update()
+
+    def __on_feature_changed(self, fid):
+        if fid in self.__feature_ids:
+            self.__pending_fids.add(fid)
+            self.__schedule_update()
+
+    def __on_layer_reset(self):
+        self.__pending_reload = True
+        self.__schedule_update()
+
+    def __schedule_update(self):
+        # signals received in the same event loop iteration are coalesced,
+        # they are kept for later during a background loading
+        if not self.__update_scheduled and self.__task is None:
+            self.__update_scheduled = True
+            QTimer.singleShot(0, self.__apply_pending_changes)
+
+    def __apply_pending_changes(self):
+        self.__update_scheduled = False
+        fids, self.__pending_fids = self.__pending_fids, set()
+        if self.__pending_reload:
+            self.__pending_reload = False
+            if self.__filter_expression is not None:
+                # ids of new features have changed on commit
+                req = QgsFeatureRequest()
+                req.setFilterExpression(self.__filter_expression)
+                req.setFlags(QgsFeatureRequest.NoGeometry)
+                req.setSubsetOfAttributes([])
+                self.__feature_ids = set(f.id() for f in self.__layer.getFeatures(req))
+            # committed changes are not always seen by the change token
+            if self.__disk_cache_key is not None:
+                self.__disk_cache.remove(self.__disk_cache_key)
+            self.__build_data()
+            return
+        if not fids:
+            return
+
+        for fid in fids:
+            self.__segments.pop(fid, None)
+        self.__feature_ids.difference_update(fids)
+
+        # only the changed features are read again (deleted features are simply not returned)
+        new_fids = []
+        for segment in self.__read_segments(fids=fids):
+            self.__feature_ids.add(segment[0])
+            self.__add_segment(*segment)
+            new_fids.append(segment[0])
+
+        # only the X range of the previous and new states of the features is merged again
+        self._values_changed(self.__merge(new_fids, removed=fids))
+        self.data_modified.emit()
+
+    def __add_segment(self, fid, x_start, x_delta, y_values):
+        """Store the values of one feature, they are merged by __merge"""
+        if self.__given_x_values is None:
+            x_start, x_delta = _to_float(x_start), _to_float(x_delta)
+            # also false for NaN
+            if not (x_delta > 0 and np.isfinite(x_start)):
+                QgsMessageLog.logMessage("Invalid X start or interval on feature #{}".format(fid),
+                                         "QGeoloGIS", QgsMessageLog.WARNING)
+                return
+        self.__segments[fid] = (x_start, x_delta, y_values)
+
+    def __merge(self, fids=(), removed=()):
+        """Merge the values of the given features, replacing their previous values
+        and the values of the removed features.
+
+        Returns the index of the first value of the series that has changed
+        """
+        # features by decreasing priority
+        latest_first = self.__overlap_policy == OVERLAP_KEEP_LATEST
+        first_change = 0
+        if self.__given_x_values is not None:
+            # all the features share the same X values, they are merged again
+            fids = sorted(self.__segments.keys(), reverse=latest_first)
+            y_values = _merge_values([self.__segments[fid][2] for fid in fids], self.__overlap_policy)
+            if y_values is None:
+                y_values = np.empty(0)
+                x_values = np.empty(0)
+            else:
+                x_values = self.__given_x_values
+            self.__series = SampledSeries(x_values, y_values)
+        else:
+            if self.__merger is None:
+                self.__merger = SegmentMerger(self.__overlap_policy, reverse=latest_first)
+                fids, removed = list(self.__segments.keys()), ()
+            # X values are never expanded, only the X range of the features is merged again
+            first_change = self.__merger.update([(fid,) + self.__segments[fid] for fid in fids if fid in self.__segments],
+                                                removed)
+            self.__series = self.__merger.series()
+        self.__update_extent()
+        return first_change
+
+    def __update_extent(self):
+        self.__x_min, self.__x_max = self.__series.x_min(), self.__series.x_max()
+        self.__y_min, self.__y_max = _nan_min_max(self.__series.y_values())
+
+
+def _merge_values(values, overlap_policy):
+    """Merge arrays of values sampled on the same X values, by decreasing priority.
+    Returns None if there is no array"""
+    if not values:
+        return None
+    if overlap_policy != OVERLAP_AVERAGE or len(values) == 1:
+        return np.asarray(values[0], dtype=np.float64)
+    values = np.vstack(values)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.where(valid, values, 0.0).sum(axis=0) / counts, np.nan)
+
+
+def _read_segments(source, req, y_fieldname, x_start, x_delta, x_start_fieldname, x_delta_fieldname, accept=None):
+    """Read the array of values carried by each feature of a request.
+
+    source: a layer, or a feature source if called from a worker thread
+    accept: optional predicate on features, rejected features are skipped
+    Yields (feature id, x_start, x_delta, y_values) for each feature
+    """
+    for f in source.getFeatures(req):
+        if accept is not None and not accept(f):
+            continue
+        yield _feature_segment(f, y_fieldname, x_start, x_delta, x_start_fieldname, x_delta_fieldname)
+
+
+def _feature_segment(f, y_fieldname, x_start, x_delta, x_start_fieldname, x_delta_fieldname):
+    """Returns (feature id, x_start, x_delta, y_values) of a feature"""
+    raw_data = f[y_fieldname]
+    if x_start_fieldname is not None:
+        start = f[x_start_fieldname]
+        delta = f[x_delta_fieldname]
+    else:
+        start = x_start
+        delta = x_delta
+
+    # QGIS 3 natively reads array values, otherwise they are text encoded
+    y_values = array_from_attribute(raw_data)
+
+    return f.id(), start, delta, y_values
+
+
+def read_station_segments(layer, ref_fieldname, station_ids, y_fieldname, x_start_fieldname, x_delta_fieldname):
+    """Read the values of the features of several stations in one request, to be given to FeatureData.
+
+    ref_fieldname: name of the field that references the station of a feature
+    Returns {station id: [(feature id, x_start, x_delta, y_values)]}
+    """
+    req = QgsFeatureRequest()
+    req.setFilterExpression("{} IN ({})".format(ref_fieldname, ",".join(str(station_id) for station_id in station_ids)))
+    req.setFlags(QgsFeatureRequest.NoGeometry)
+    req.setSubsetOfAttributes([ref_fieldname, y_fieldname, x_start_fieldname, x_delta_fieldname], layer.fields())
+    segments = {}
+    for f in layer.getFeatures(req):
+        segments.setdefault(f[ref_fieldname], []).append(
+            _feature_segment(f, y_fieldname, None, None, x_start_fieldname, x_delta_fieldname))
+    return segments
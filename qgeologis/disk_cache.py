@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent cache of loaded series, on disk.
+
+Each entry is a directory of .npy files, one per array, that are opened memory-mapped: pages
+are read on demand and shared through the OS page cache. Entries are keyed by a hash of the
+source, the filter, the columns and a change token of the layer. The least recently used
+entries are removed when the cache exceeds its maximum size.
+"""
+
+from qgis.PyQt.QtCore import QSettings
+from .qt_qgis_compat import QgsApplication, QgsMessageLog
+
+import numpy as np
+import hashlib
+import os
+import shutil
+
+# default maximum size of the cache, in MiB
+DEFAULT_MAX_SIZE_MB = 1024
+
+# suffix of the directories of entries being written, followed by the pid of the writer
+_TMP_SUFFIX = ".tmp"
+
+def _log_warning(message):
+    QgsMessageLog.logMessage(message, "QGeoloGIS", QgsMessageLog.WARNING)
+
+class DiskCache(object):
+    """Cache of named numpy arrays, on disk"""
+
+    def __init__(self, directory, max_size):
+        """
+        directory: directory where entries are stored, created if needed
+        max_size: maximum size of the cache, in bytes
+        """
+        self.__directory = directory
+        self.__max_size = max_size
+
+    def directory(self):
+        return self.__directory
+
+    def key(self, *parts):
+        """Returns the key of an entry from its description (source, filter, columns, change token, ...)"""
+        return hashlib.sha1(repr(parts).encode("utf8")).hexdigest()
+
+    def load(self, key):
+        """Returns the arrays stored under the key, as a dict of read-only memory-mapped arrays.
+        None if the entry does not exist"""
+        path = os.path.join(self.__directory, key)
+        if not os.path.isdir(path):
+            return None
+        arrays = {}
+        try:
+            for file_name in os.listdir(path):
+                if not file_name.endswith(".npy"):
+                    continue
+                file_path = os.path.join(path, file_name)
+                try:
+                    array = np.load(file_path, mmap_mode="r")
+                except ValueError:
+                    # empty arrays cannot be memory-mapped
+                    array = np.load(file_path)
+                    array.flags.writeable = False
+                arrays[file_name[:-4]] = array
+            # the modification time of an entry is its last use
+            os.utime(path, None)
+        except (IOError, OSError, ValueError) as e:
+            _log_warning("Invalid cache entry {}: {}".format(path, e))
+            self.remove(key)
+            return None
+        return arrays
+
+    def store(self, key, arrays):
+        """Store a dict of arrays under the key, then evict old entries if the cache is too large"""
+        path = os.path.join(self.__directory, key)
+        tmp_path = "{}{}{}".format(path, _TMP_SUFFIX, os.getpid())
+        try:
+            if not os.path.isdir(self.__directory):
+                os.makedirs(self.__directory)
+            os.mkdir(tmp_path)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(array))
+            if os.path.isdir(path):
+                # already stored by another process
+                shutil.rmtree(tmp_path)
+            else:
+                # entries appear atomically
+                os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            _log_warning("Cannot write cache entry {}: {}".format(path, e))
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.__evict()
+
+    def remove(self, key):
+        shutil.rmtree(os.path.join(self.__directory, key), ignore_errors=True)
+
+    def clear(self):
+        """Remove all the entries"""
+        for key, _, _ in self.__entries():
+            self.remove(key)
+
+    def size(self):
+        """Size of the cache, in bytes"""
+        return sum(size for _, _, size in self.__entries())
+
+    def __entries(self):
+        """Returns the list of (key, last use, size) of the entries.
+
+        The cache may be shared by several processes: entries being written are ignored, and
+        entries removed during the scan are skipped.
+        """
+        try:
+            keys = os.listdir(self.__directory)
+        except OSError:
+            # no cache yet
+            return []
+        entries = []
+        for key in keys:
+            if _TMP_SUFFIX in key:
+                continue
+            path = os.path.join(self.__directory, key)
+            try:
+                if not os.path.isdir(path):
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((key, os.path.getmtime(path), size))
+            except OSError:
+                # removed by another process
+                continue
+        return entries
+
+    def __evict(self):
+        """Remove least recently used entries until the cache fits in its maximum size"""
+        try:
+            entries = sorted(self.__entries(), key=lambda entry: entry[1])
+            size = sum(entry[2] for entry in entries)
+            for key, _, entry_size in entries:
+                if size <= self.__max_size:
+                    break
+                # files of entries still opened are removed once unmapped (on POSIX systems)
+                self.remove(key)
+                size -= entry_size
+        except OSError as e:
+            _log_warning("Cannot evict cache entries of {}: {}".format(self.__directory, e))
+
+_disk_cache = None
+
+def disk_cache():
+    """Returns the disk cache of the plugin.
+
+    Its location and maximum size are read from the 'disk_cache_dir' and 'disk_cache_size_mb' settings.
+    """
+    global _disk_cache
+    if _disk_cache is None:
+        s = QSettings("Oslandia", "qgeologis")
+        directory = s.value("disk_cache_dir", os.path.join(QgsApplication.qgisSettingsDirPath(), "qgeologis_cache"))
+        max_size = int(s.value("disk_cache_size_mb", DEFAULT_MAX_SIZE_MB))
+        _disk_cache = DiskCache(directory, max_size * 1024 * 1024)
+    return _disk_cache
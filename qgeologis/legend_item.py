@@ -52,6 +52,9 @@ class LegendItem(LogItem):
         fm2 = QFontMetrics(self.__font2)
         self.__height = self.LEGEND_LINE_MARGIN * 3 + fm1.height() + fm2.height() + 10 + self.LEGEND_ITEM_MARGIN
 
+    def set_title(self, title):
+        self.__title = title
+
     def set_scale(self, min_value, max_value):
         self.__min_value = min_value
         self.__max_value = max_value
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Level of detail of series of values.
+
+A LodPyramid summarizes the values of a series at power-of-two resolutions, so that
+only a few samples per pixel are needed to draw it, whatever its length.
+m4_indices then aligns the decimation on pixels, just before drawing.
+"""
+
+import numpy as np
+
+class _Level(object):
+    """Summary of a series by buckets of a fixed number of consecutive samples.
+
+    For each bucket are stored the min and max values, their indices in the series, the
+    number of valid (non NaN) values and the index of the first NaN value (gap marker), -1 if
+    there is none. Indices of the first and last samples of a bucket are implicit.
+    Empty buckets have NaN min / max and -1 indices.
+    """
+
+    # names of the arrays, in the order of the constructor arguments
+    ARRAYS = ("mins", "maxs", "imins", "imaxs", "counts", "inans")
+    def __init__(self, mins, maxs, imins, imaxs, counts, inans):
+        self.mins = mins
+        self.maxs = maxs
+        self.imins = imins
+        self.imaxs = imaxs
+        self.counts = counts
+        self.inans = inans
+
+    def __len__(self):
+        return len(self.counts)
+
+    def head(self, n_buckets):
+        """Returns a level with only the n first buckets"""
+        return _Level(self.mins[:n_buckets], self.maxs[:n_buckets],
+                      self.imins[:n_buckets], self.imaxs[:n_buckets], self.counts[:n_buckets],
+                      self.inans[:n_buckets])
+
+    def tail(self, first_bucket):
+        """Returns a level without the first buckets"""
+        return _Level(self.mins[first_bucket:], self.maxs[first_bucket:],
+                      self.imins[first_bucket:], self.imaxs[first_bucket:], self.counts[first_bucket:],
+                      self.inans[first_bucket:])
+
+    def concatenate(self, other):
+        return _Level(np.concatenate((self.mins, other.mins)),
+                      np.concatenate((self.maxs, other.maxs)),
+                      np.concatenate((self.imins, other.imins)),
+                      np.concatenate((self.imaxs, other.imaxs)),
+                      np.concatenate((self.counts, other.counts)),
+                      np.concatenate((self.inans, other.inans)))
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+def _reduce_values(y_values, bucket_size, offset):
+    """Build a level from raw values.
+
+    offset: index in the series of the first value
+    """
+    n_buckets = (len(y_values) + bucket_size - 1) // bucket_size
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:len(y_values)] = y_values
+    padded = padded.reshape(n_buckets, bucket_size)
+
+    valid = ~np.isnan(padded)
+    counts = valid.sum(axis=1)
+    local_imins = np.argmin(np.where(valid, padded, np.inf), axis=1)
+    local_imaxs = np.argmax(np.where(valid, padded, -np.inf), axis=1)
+    buckets = np.arange(n_buckets)
+    mins = padded[buckets, local_imins]
+    maxs = padded[buckets, local_imaxs]
+    first_indices = offset + buckets * bucket_size
+    empty = counts == 0
+    imins = np.where(empty, -1, first_indices + local_imins)
+    imaxs = np.where(empty, -1, first_indices + local_imaxs)
+    # NaN values of the padding are not gap markers
+    nans = ~valid
+    nans.reshape(-1)[len(y_values):] = False
+    inans = np.where(nans.any(axis=1), first_indices + np.argmax(nans, axis=1), -1)
+    return _Level(mins, maxs, imins, imaxs, counts, inans)
+
+def _reduce_level(level):
+    """Build a level by merging pairs of buckets of the previous one"""
+    if len(level) % 2 == 1:
+        level = level.concatenate(_Level(np.array([np.nan]), np.array([np.nan]),
+                                         np.array([-1]), np.array([-1]), np.array([0]), np.array([-1])))
+    a_mins, b_mins = level.mins[0::2], level.mins[1::2]
+    a_maxs, b_maxs = level.maxs[0::2], level.maxs[1::2]
+    a_counts, b_counts = level.counts[0::2], level.counts[1::2]
+
+    # comparisons with NaN are False, so that empty buckets are never taken
+    take_b_min = (a_counts == 0) | (b_mins < a_mins)
+    take_b_max = (a_counts == 0) | (b_maxs > a_maxs)
+    return _Level(np.where(take_b_min, b_mins, a_mins),
+                  np.where(take_b_max, b_maxs, a_maxs),
+                  np.where(take_b_min, level.imins[1::2], level.imins[0::2]),
+                  np.where(take_b_max, level.imaxs[1::2], level.imaxs[0::2]),
+                  a_counts + b_counts,
+                  np.where(level.inans[0::2] >= 0, level.inans[0::2], level.inans[1::2]))
+
+def m4_indices(pixels, y_values):
+    """M4 decimation: returns the sorted indices of the samples to keep so that a line
+    drawn through them covers the same pixels as a line drawn through all samples.
+
+    Lines are not drawn across NaN values, so each run of values between NaN values is
+    decimated on its own: for each pixel column and run, the first, last, min and max samples
+    are kept. The first NaN of each run of NaN values of a column is kept to separate them.
+
+    pixels: sorted position of each sample along the X axis, in device pixels
+    y_values: values of the samples
+    """
+    n = len(pixels)
+    if n == 0:
+        return np.arange(0)
+    columns = np.floor(pixels).astype(np.int64)
+    valid = ~np.isnan(y_values)
+    # groups of contiguous samples of the same column, either all valid or all NaN
+    starts = np.flatnonzero(np.concatenate(([True], (columns[1:] != columns[:-1]) | (valid[1:] != valid[:-1]))))
+    ends = np.concatenate((starts[1:], [n]))
+    group_of = np.repeat(np.arange(len(starts)), ends - starts)
+
+    mins_key = np.where(valid, y_values, np.inf)
+    maxs_key = np.where(valid, y_values, -np.inf)
+    mins = np.minimum.reduceat(mins_key, starts)
+    maxs = np.maximum.reduceat(maxs_key, starts)
+
+    def first_of_groups(mask):
+        """first index of each group where mask is True"""
+        candidates = np.flatnonzero(mask)
+        _, first = np.unique(group_of[candidates], return_index=True)
+        return candidates[first]
+
+    indices = np.concatenate((starts, (ends - 1)[valid[starts]],
+                              first_of_groups(valid & (mins_key == mins[group_of])),
+                              first_of_groups(valid & (maxs_key == maxs[group_of]))))
+    return np.unique(indices)
+
+class LodPyramid(object):
+    """Multi-resolution summary of a series of (X, Y) values sorted on X (see series.py).
+
+    Level l summarizes the values by buckets of 2**l consecutive samples.
+    Levels are built from MIN_LEVEL up to a level with only one bucket.
+    """
+
+    # finest level, below it raw values are used
+    MIN_LEVEL = 3
+
+    def __init__(self, series):
+        self.__series = None
+        self.__y_values = None
+        # levels[i] has buckets of 2 ** (MIN_LEVEL + i) samples
+        self.__levels = []
+        self.update(series)
+
+    def __len__(self):
+        return len(self.__y_values)
+
+    @classmethod
+    def from_arrays(cls, series, arrays):
+        """Build a pyramid of the series from the arrays returned by arrays(), without copying them"""
+        if "level0_counts" in arrays and "level0_inans" not in arrays:
+            # stored by a previous version, without gap markers
+            return cls(series)
+        pyramid = cls.__new__(cls)
+        pyramid.__series = series
+        pyramid.__y_values = series.y_values()
+        pyramid.__levels = []
+        while "level{}_counts".format(len(pyramid.__levels)) in arrays:
+            prefix = "level{}_".format(len(pyramid.__levels))
+            pyramid.__levels.append(_Level(*[arrays[prefix + name] for name in _Level.ARRAYS]))
+        return pyramid
+
+    def snapshot(self):
+        """Returns a pyramid sharing the current arrays, not affected by later updates,
+        that can be read from another thread"""
+        pyramid = self.__class__.__new__(self.__class__)
+        pyramid.__series = self.__series
+        pyramid.__y_values = self.__y_values
+        pyramid.__levels = list(self.__levels)
+        return pyramid
+
+    def arrays(self):
+        """Returns the arrays of the pyramid, by name"""
+        arrays = {}
+        for i, level in enumerate(self.__levels):
+            for name in _Level.ARRAYS:
+                arrays["level{}_{}".format(i, name)] = getattr(level, name)
+        return arrays
+
+    def levels(self):
+        """Returns the available levels"""
+        return list(range(self.MIN_LEVEL, self.MIN_LEVEL + len(self.__levels)))
+
+    def nbytes(self):
+        """Memory used by the pyramid, in bytes"""
+        return sum(level.nbytes() for level in self.__levels)
+
+    def update(self, series, from_index=0):
+        """Update the pyramid after the values have changed.
+
+        from_index: index of the first value modified, buckets before it are kept
+        """
+        old_levels = self.__levels if self.__y_values is not None else []
+        if old_levels:
+            from_index = min(from_index, len(self.__y_values))
+        else:
+            from_index = 0
+        self.__series = series
+        self.__y_values = series.y_values()
+
+        # only buckets from the one of the first modified value are computed again
+        first_bucket = from_index >> self.MIN_LEVEL
+        start = first_bucket << self.MIN_LEVEL
+        new_buckets = _reduce_values(self.__y_values[start:], 1 << self.MIN_LEVEL, start)
+        levels = []
+        while True:
+            if first_bucket > 0:
+                level = old_levels[len(levels)].head(first_bucket).concatenate(new_buckets)
+            else:
+                level = new_buckets
+            levels.append(level)
+            if len(level) <= 1:
+                break
+            first_bucket //= 2
+            new_buckets = _reduce_level(level.tail(2 * first_bucket))
+        self.__levels = levels
+
+    def level_for(self, n_samples, n_pixels):
+        """Returns the coarsest level with at least two buckets per pixel, or None if raw values should be used"""
+        if n_pixels <= 0 or n_samples <= 0:
+            return None
+        level = int(np.floor(np.log2(max(n_samples / (2.0 * n_pixels), 1.0))))
+        if level < self.MIN_LEVEL:
+            return None
+        return min(level, self.MIN_LEVEL + len(self.__levels) - 1)
+
+    def indices(self, i_start, i_end, level):
+        """Returns the sorted indices of the samples to draw the values between i_start and i_end (excluded).
+
+        For each bucket, its first, last, min and max samples are kept. Lines are not drawn across
+        NaN values: buckets with both valid and NaN values are split into the buckets of the finer
+        levels, down to raw samples, so that runs of values are summarized separately. Buckets
+        without any valid value only keep their first NaN.
+        Buckets that are partially in the range are replaced by their raw samples.
+        """
+        bucket_size = 1 << level
+        b_start = (i_start + bucket_size - 1) // bucket_size
+        b_end = i_end // bucket_size
+        if b_end <= b_start:
+            return np.arange(i_start, i_end)
+
+        indices = [np.arange(i_start, b_start * bucket_size), np.arange(b_end * bucket_size, i_end)]
+        buckets = np.arange(b_start, b_end)
+        while True:
+            data = self.__levels[level - self.MIN_LEVEL]
+            counts, inans = data.counts[buckets], data.inans[buckets]
+            runs = buckets[(inans < 0) & (counts > 0)]
+            firsts = runs << level
+            indices += [firsts, firsts + (1 << level) - 1, data.imins[runs], data.imaxs[runs],
+                        inans[counts == 0]]
+            # buckets with a gap inside
+            buckets = buckets[(inans >= 0) & (counts > 0)]
+            if level == self.MIN_LEVEL:
+                indices.append(((buckets << level)[:, np.newaxis] + np.arange(1 << level)).ravel())
+                break
+            level -= 1
+            buckets = np.concatenate((2 * buckets, 2 * buckets + 1))
+        return np.unique(np.concatenate(indices))
+
+    def range_min_max(self, i_start, i_end):
+        """Returns (min, max) of the values between i_start and i_end (excluded), NaN being ignored.
+        (None, None) if there is no valid value.
+
+        At most two buckets per level and a few raw values are read: O(log n).
+        """
+        y_values = self.__y_values
+        i_start, i_end = max(i_start, 0), min(i_end, len(y_values))
+        bucket_size = 1 << self.MIN_LEVEL
+        # raw values before the first and after the last complete bucket of the finest level
+        first = min((i_start + bucket_size - 1) // bucket_size, i_end // bucket_size)
+        last = max(i_end // bucket_size, first)
+        raw = np.concatenate((y_values[i_start:min(first * bucket_size, i_end)],
+                              y_values[max(last * bucket_size, i_start):i_end]))
+        mins, maxs = [], []
+        raw = raw[~np.isnan(raw)]
+        if len(raw) > 0:
+            mins.append(raw.min())
+            maxs.append(raw.max())
+
+        # complete buckets, from the finest level to the coarsest
+        for level in self.__levels:
+            if first >= last:
+                break
+            buckets = []
+            if first % 2 == 1:
+                buckets.append(first)
+                first += 1
+            if last % 2 == 1:
+                last -= 1
+                buckets.append(last)
+            for bucket in buckets:
+                if level.counts[bucket] > 0:
+                    mins.append(level.mins[bucket])
+                    maxs.append(level.maxs[bucket])
+            first //= 2
+            last //= 2
+
+        if not mins:
+            return None, None
+        return float(min(mins)), float(max(maxs))
+
+    def window_min_max(self, x_min, x_max):
+        """Returns (min, max) of the values between x_min and x_max, see range_min_max"""
+        return self.range_min_max(self.__series.index_left(x_min), self.__series.index_right(x_max))
+
+    def window(self, x_min, x_max, n_pixels):
+        """Returns decimated (x_values, y_values) arrays covering [x_min, x_max] for n_pixels,
+        or None if raw values should be drawn. NaN Y values of kept samples mark gaps."""
+        series = self.__series
+        i_start = max(series.index_left(x_min) - 1, 0)
+        i_end = min(series.index_right(x_max) + 1, len(series))
+        level = self.level_for(i_end - i_start, n_pixels)
+        if level is None:
+            return None
+        indices = self.indices(i_start, i_end, level)
+        # X values are only computed for the kept samples
+        x_values = series.x_at(indices)
+        y_values = self.__y_values[indices]
+        valid = ~np.isnan(x_values)
+        return x_values[valid], y_values[valid]
@@ -16,24 +16,490 @@
 #   License along with this library; if not, see <http://www.gnu.org/licenses/>.
 #
 
-from qgis.PyQt.QtCore import Qt, QSizeF, QRectF, QPoint
-from qgis.PyQt.QtGui import QBrush, QColor, QFontMetrics
+from qgis.PyQt.QtCore import Qt, QSizeF, QRectF, QPoint, QPointF, QObject, QRunnable, QThreadPool, pyqtSignal
+from qgis.PyQt.QtGui import QBrush, QColor, QFontMetrics, QImage, QPainter, QPaintEngine, QPen, QPolygonF, QTransform
 from qgis.PyQt.QtWidgets import QGraphicsItem, QComboBox, QDialog, QVBoxLayout, QDialogButtonBox
 from qgis.PyQt.QtWidgets import QStackedWidget, QToolTip
-from .qt_qgis_compat import QgsFeatureRendererV2, QgsGeometry, QgsFields, QgsFeature, QgsRectangle
+from .qt_qgis_compat import QgsFeatureRendererV2, QgsGeometry, QgsFields, QgsFeature, QgsRectangle, QgsMessageLog
+from .qt_qgis_compat import QgsSymbolV2
 
 from .common import POINT_RENDERER, LINE_RENDERER, POLYGON_RENDERER
-from .common import ORIENTATION_UPWARD, ORIENTATION_DOWNWARD, ORIENTATION_LEFT_TO_RIGHT, LogItem, qgis_render_context
+from .common import ORIENTATION_UPWARD, ORIENTATION_DOWNWARD, ORIENTATION_LEFT_TO_RIGHT, LogItem, RenderSession
 
 from .time_scale import UTC
+from .series import SampledSeries, _runs
+from .lod import m4_indices
 
 import numpy as np
-import bisect
-import math
+import threading
 from datetime import datetime
 
+def _device_pixel_ratio(painter):
+    """Number of device pixels per logical pixel of the painter"""
+    device = painter.device()
+    if hasattr(device, "devicePixelRatioF"):
+        return device.devicePixelRatioF()
+    if hasattr(device, "devicePixelRatio"):
+        return device.devicePixelRatio()
+    return 1.0
+
+# paint engines of vector outputs, on which curves are drawn as geometries rather than images
+_VECTOR_PAINT_ENGINES = (QPaintEngine.SVG, QPaintEngine.Pdf)
+
+def _is_vector_device(painter):
+    """Returns True if the painter draws to a vector output (SVG, PDF)"""
+    engine = painter.paintEngine()
+    return engine is not None and engine.type() in _VECTOR_PAINT_ENGINES
+
+def _vector_pixel_ratio(painter):
+    """Number of output units per logical pixel of a vector painter, used to decimate
+    curves at the resolution of the output"""
+    t = painter.deviceTransform()
+    return max(abs(t.m11()), abs(t.m22()), abs(t.m12()), abs(t.m21()), 1e-3)
+
+def _multilinestring_wkb(xx, yy, runs):
+    """Returns the WKB of a multilinestring, with one linestring per (start, end) run of points"""
+    # WKB structure of a multilinestring
+    #
+    #   01 : endianness
+    #   05 00 00 00 : WKB type (multilinestring)
+    #   nn nn nn nn : number of linestrings (int32)
+    # Then, for each linestring:
+    #   01 : endianness
+    #   02 00 00 00 : WKB type (linestring)
+    #   nn nn nn nn : number of points (int32)
+    # Then, for each point:
+    #   xx xx xx xx xx xx xx xx : X coordinate (float64)
+    #   yy yy yy yy yy yy yy yy : Y coordinate (float64)
+    n_points = sum(end - start for start, end in runs)
+    wkb = np.zeros(9 + 9*len(runs) + 8*2*n_points, dtype='uint8')
+    wkb[0] = 1 # wkb endianness
+    wkb[1] = 5 # multilinestring
+    wkb[5:9] = np.array([len(runs)], dtype='int32').view('uint8')
+    offset = 9
+    for start, end in runs:
+        n = end - start
+        wkb[offset] = 1 # wkb endianness
+        wkb[offset+1] = 2 # linestring
+        wkb[offset+5:offset+9] = np.array([n], dtype='int32').view('uint8')
+        coords_view = np.ndarray(buffer=wkb, dtype='float64', offset=offset+9, shape=(n,2))
+        coords_view[:,0] = xx[start:end]
+        coords_view[:,1] = yy[start:end]
+        offset += 9 + 8*2*n
+    return wkb
+
+def _multipoint_wkb(xx, yy):
+    """Returns the WKB of a multipoint"""
+    # WKB structure of a multipoint
+    #
+    #   01 : endianness
+    #   04 00 00 00 : WKB type (multipoint)
+    #   nn nn nn nn : number of points (int32)
+    # Then, for each point:
+    #   01 : endianness
+    #   01 00 00 00 : WKB type (point)
+    #   xx xx xx xx xx xx xx xx : X coordinate (float64)
+    #   yy yy yy yy yy yy yy yy : Y coordinate (float64)
+    n_points = len(xx)
+    wkb = np.zeros((8*2+5)*n_points+9, dtype='uint8')
+    wkb[0] = 1 # wkb endianness
+    wkb[1] = 4 # multipoint
+    size_view = np.ndarray(buffer=wkb, dtype='int32', offset=5, shape=(1,))
+    size_view[0] = n_points
+    coords_view = np.ndarray(buffer=wkb, dtype='float64', offset=9+5, shape=(n_points,2), strides=(16+5,8))
+    coords_view[:,0] = xx[:]
+    coords_view[:,1] = yy[:]
+    # header of each point
+    h_view = np.ndarray(buffer=wkb, dtype='uint8', offset=9, shape=(n_points,2), strides=(16+5,1))
+    h_view[:,0] = 1 # endianness
+    h_view[:,1] = 1 # point
+    return wkb
+
+def _multipolygon_wkb(xx, yy, runs, vertical):
+    """Returns the WKB of a multipolygon, with one polygon per (start, end) run of points.
+
+    Each polygon is closed on the value axis, which is vertical if vertical is True."""
+    # WKB structure of a multipolygon
+    #
+    #   01 : endianness
+    #   06 00 00 00 : WKB type (multipolygon)
+    #   nn nn nn nn : number of polygons (int32)
+    # Then, for each polygon:
+    #   01 : endianness
+    #   03 00 00 00 : WKB type (polygon)
+    #   01 00 00 00 : Number of rings (always 1 here)
+    #   nn nn nn nn : number of points (int32)
+    # Then, for each point:
+    #   xx xx xx xx xx xx xx xx : X coordinate (float64)
+    #   yy yy yy yy yy yy yy yy : Y coordinate (float64)
+    #
+    # We add two additional points to close each polygon
+    n_points = sum(end - start + 2 for start, end in runs)
+    wkb = np.zeros(9 + 13*len(runs) + 8*2*n_points, dtype='uint8')
+    wkb[0] = 1 # wkb endianness
+    wkb[1] = 6 # multipolygon
+    wkb[5:9] = np.array([len(runs)], dtype='int32').view('uint8')
+    offset = 9
+    for start, end in runs:
+        n = end - start
+        wkb[offset] = 1 # wkb endianness
+        wkb[offset+1] = 3 # polygon
+        wkb[offset+5] = 1 # number of rings
+        wkb[offset+9:offset+13] = np.array([n+2], dtype='int32').view('uint8')
+        coords_view = np.ndarray(buffer=wkb, dtype='float64', offset=offset+13, shape=(n+2,2))
+        coords_view[:n,0] = xx[start:end]
+        coords_view[:n,1] = yy[start:end]
+        # two extra points
+        if vertical:
+            coords_view[n] = (0.0, coords_view[n-1,1])
+            coords_view[n+1] = (0.0, coords_view[0,1])
+        else:
+            coords_view[n] = (coords_view[n-1,0], 0.0)
+            coords_view[n+1] = (coords_view[0,0], 0.0)
+        offset += 13 + 8*2*(n+2)
+    return wkb
+
+# types of the simple symbol layers that can be drawn directly with a QPainter, by render type
+_SIMPLE_SYMBOL_LAYERS = {POINT_RENDERER: "SimpleMarker", LINE_RENDERER: "SimpleLine", POLYGON_RENDERER: "SimpleFill"}
+
+# units drawn as pixels by the render contexts of this plugin (scale factor of 1, one map unit
+# per pixel): millimeters, map units and pixels. Their values differ between QGIS 2 and 3
+_PIXEL_UNITS = (QgsSymbolV2.MM, QgsSymbolV2.MapUnit, QgsSymbolV2.Pixel)
+
+def _simple_symbol_style(renderer, render_type):
+    """Returns (pen, brush, marker size) to draw the symbol of the renderer with a QPainter.
+
+    None if the renderer is not a single symbol made of one simple symbol layer, without
+    data-defined properties, in which case the QGIS renderer must be used.
+    """
+    if renderer.type() != "singleSymbol":
+        return None
+    symbol = renderer.symbol()
+    if symbol is None or symbol.symbolLayerCount() != 1:
+        return None
+    layer = symbol.symbolLayer(0)
+    if layer.layerType() != _SIMPLE_SYMBOL_LAYERS[render_type] or layer.outputUnit() not in _PIXEL_UNITS:
+        return None
+    if hasattr(layer, "dataDefinedProperties"):
+        if layer.dataDefinedProperties().hasActiveProperties():
+            return None
+    elif layer.hasDataDefinedProperties():
+        return None
+
+    opacity = symbol.opacity() if hasattr(symbol, "opacity") else symbol.alpha()
+    def color(c):
+        c = QColor(c)
+        c.setAlphaF(c.alphaF() * opacity)
+        return c
+
+    if render_type == LINE_RENDERER:
+        if layer.offset() != 0 or layer.useCustomDashPattern():
+            return None
+        pen = QPen(color(layer.color()), layer.width(), layer.penStyle(), layer.penCapStyle(), layer.penJoinStyle())
+        return pen, QBrush(), None
+
+    if not layer.offset().isNull():
+        return None
+    if hasattr(layer, "strokeColor"):
+        stroke_color, stroke_width, stroke_style = layer.strokeColor(), layer.strokeWidth(), layer.strokeStyle()
+    elif render_type == POLYGON_RENDERER:
+        stroke_color, stroke_width, stroke_style = layer.borderColor(), layer.borderWidth(), layer.borderStyle()
+    else:
+        stroke_color, stroke_width, stroke_style = layer.borderColor(), layer.outlineWidth(), layer.outlineStyle()
+    pen = QPen(color(stroke_color), stroke_width, stroke_style)
+    if render_type == POLYGON_RENDERER:
+        pen.setJoinStyle(layer.penJoinStyle())
+        return pen, QBrush(color(layer.color()), layer.brushStyle()), None
+
+    shape = layer.encodeShape(layer.shape()) if hasattr(layer, "shape") else layer.name()
+    fill_color = color(layer.color())
+    # markers are drawn as a stroke disc under a fill disc, which needs an opaque fill
+    if shape != "circle" or (stroke_style != Qt.NoPen and fill_color.alpha() < 255):
+        return None
+    return pen, QBrush(fill_color), layer.size()
+
+def _qpolygonf(xx, yy):
+    """Returns a QPolygonF of the given coordinates, written directly in its memory when possible"""
+    n = len(xx)
+    polygon = QPolygonF(n)
+    try:
+        address = polygon.data()
+        address.setsize(8*2*n)
+        coords = np.frombuffer(address, dtype=np.float64).reshape(n, 2)
+        coords[:,0] = xx
+        coords[:,1] = yy
+    except (AttributeError, TypeError, ValueError):
+        # no buffer protocol on this binding
+        polygon = QPolygonF([QPointF(x, y) for x, y in zip(xx, yy)])
+    return polygon
+
+def _draw_simple(painter, style, render_type, xx, yy, valid, vertical, height):
+    """Draw samples with a simple symbol style (see _simple_symbol_style).
+
+    xx, yy: coordinates with an upward Y axis, as in the WKB given to the QGIS renderer
+    height: height of the painted area, to flip the Y axis
+    """
+    pen, brush, marker_size = style
+    painter.save()
+    if render_type == LINE_RENDERER:
+        painter.setPen(pen)
+        for start, end in _runs(valid):
+            if end - start > 1:
+                painter.drawPolyline(_qpolygonf(xx[start:end], height - yy[start:end]))
+    elif render_type == POINT_RENDERER:
+        points = _qpolygonf(xx[valid], height - yy[valid])
+        # a point drawn with a round pen is a disc of the pen width
+        disc_pen = QPen(pen)
+        disc_pen.setCapStyle(Qt.RoundCap)
+        disc_pen.setStyle(Qt.SolidLine)
+        if pen.style() != Qt.NoPen:
+            disc_pen.setWidthF(marker_size + pen.widthF())
+            painter.setPen(disc_pen)
+            painter.drawPoints(points)
+            inner_size = marker_size - pen.widthF()
+        else:
+            inner_size = marker_size
+        if brush.style() != Qt.NoBrush and inner_size > 0:
+            disc_pen.setColor(brush.color())
+            disc_pen.setWidthF(inner_size)
+            painter.setPen(disc_pen)
+            painter.drawPoints(points)
+    elif render_type == POLYGON_RENDERER:
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        for start, end in _runs(valid):
+            ring_x = np.empty(end - start + 2)
+            ring_y = np.empty(end - start + 2)
+            ring_x[:-2], ring_y[:-2] = xx[start:end], yy[start:end]
+            # closed on the value axis, as in _multipolygon_wkb
+            if vertical:
+                ring_x[-2:] = 0.0
+                ring_y[-2], ring_y[-1] = ring_y[-3], ring_y[0]
+            else:
+                ring_x[-2], ring_x[-1] = ring_x[-3], ring_x[0]
+                ring_y[-2:] = 0.0
+            painter.drawPolygon(_qpolygonf(ring_x, height - ring_y))
+    painter.restore()
+
+# in fast rendering mode, the level of detail is chosen for this many times fewer pixels
+FAST_LOD_FACTOR = 4
+
+# curves are rendered on a strip that extends the displayed X range by this many times
+# its length on each side, so that small pans only move the rendered image
+OVERSCAN = 1.0
+
+def _scales(x_orientation, y_orientation, data_rect, item_size):
+    """Returns (pixels per X unit, pixels per Y unit) of a data window drawn on an item"""
+    if x_orientation == ORIENTATION_LEFT_TO_RIGHT and y_orientation == ORIENTATION_UPWARD:
+        x_size, y_size = item_size.width(), item_size.height()
+    else:
+        x_size, y_size = item_size.height(), item_size.width()
+    rw = float(x_size) / data_rect.width() if data_rect.width() > 0 else float(x_size)
+    rh = float(y_size) / data_rect.height() if data_rect.height() > 0 else float(y_size)
+    return rw, rh
+
+class _CurveFrame(object):
+    """Everything needed to render the curve of a PlotItem, captured in the GUI thread
+    so that it can be rendered in another thread"""
+
+    def __init__(self, key, series, lod, data_rect, item_size, x_orientation, y_orientation,
+                 render_type, renderer, render_session, pixel_ratio, render_hints, fast):
+        self.key = key
+        self.series = series
+        self.lod = lod
+        self.data_rect = QRectF(data_rect)
+        self.item_size = QSizeF(item_size)
+        self.x_orientation = x_orientation
+        self.y_orientation = y_orientation
+        self.render_type = render_type
+        self.renderer = renderer
+        self.render_session = render_session
+        self.pixel_ratio = pixel_ratio
+        self.render_hints = render_hints
+        # fast rendering mode: coarser level of detail, without antialiasing
+        self.fast = fast
+
+    def painter_axes(self):
+        """Returns the painter axes of the image of the frame, see _painter_axes"""
+        return _painter_axes(self.x_orientation, self.y_orientation, self.data_rect, self.item_size)
+
+    def contains(self, x_min, x_max):
+        """Returns True if the frame covers the given X range"""
+        # tolerance on the rounding of windows translated by a delta
+        epsilon = 1e-9 * self.data_rect.width()
+        return self.data_rect.x() <= x_min + epsilon and self.data_rect.right() >= x_max - epsilon
+
+def _painter_axes(x_orientation, y_orientation, data_rect, item_size):
+    """Returns ((a, b) of the painter X axis, (a, b) of the painter Y axis) of a data window
+    drawn on an item, painter coordinates being a * value + b"""
+    rw, rh = _scales(x_orientation, y_orientation, data_rect, item_size)
+    if x_orientation == ORIENTATION_LEFT_TO_RIGHT and y_orientation == ORIENTATION_UPWARD:
+        return (rw, -data_rect.x() * rw), (-rh, item_size.height() + data_rect.y() * rh)
+    return (rh, -data_rect.y() * rh), (rw, -data_rect.x() * rw)
+
+def _frame_transform(frame, axes):
+    """Returns the QTransform that places the image rendered for a frame on painter axes"""
+    (ax0, bx0), (ay0, by0) = frame.painter_axes()
+    (ax1, bx1), (ay1, by1) = axes
+    sx, sy = ax1 / ax0, ay1 / ay0
+    return QTransform(sx, 0, 0, sy, bx1 - bx0 * sx, by1 - by0 * sy)
+
+def _render_image(frame, is_cancelled):
+    """Returns (image, (number of input samples, number of drawn samples)) of the curve of a frame,
+    on a transparent image of the item size, in device pixels. None if cancelled"""
+    pixel_ratio = frame.pixel_ratio
+    width = int(np.ceil(frame.item_size.width() * pixel_ratio))
+    height = int(np.ceil(frame.item_size.height() * pixel_ratio))
+    image = QImage(max(width, 1), max(height, 1), QImage.Format_ARGB32_Premultiplied)
+    if hasattr(image, "setDevicePixelRatio"):
+        image.setDevicePixelRatio(pixel_ratio)
+    else:
+        pixel_ratio = 1.0
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    painter.setRenderHints(frame.render_hints)
+    try:
+        stats = _render_curve(painter, frame, pixel_ratio, is_cancelled)
+    finally:
+        painter.end()
+    if stats is None:
+        return None
+    return image, stats
+
+def _render_curve(painter, frame, pixel_ratio, is_cancelled):
+    """Draw the samples of the data window of a frame with its renderer.
+
+    Returns (number of input samples, number of drawn samples), None if cancelled"""
+    data_rect, item_size = frame.data_rect, frame.item_size
+    # number of pixels along the X axis
+    if frame.x_orientation == ORIENTATION_LEFT_TO_RIGHT:
+        x_pixels = item_size.width()
+    else:
+        x_pixels = item_size.height()
+    lod_values = None
+    if frame.lod is not None:
+        # the level of detail is chosen for device pixels (HiDPI screens, exports at a higher resolution)
+        lod_pixels = x_pixels * pixel_ratio
+        if frame.fast:
+            lod_pixels /= FAST_LOD_FACTOR
+        lod_values = frame.lod.window(data_rect.x(), data_rect.right(), lod_pixels)
+
+    if lod_values is not None:
+        x_values_slice, y_values_slice = lod_values
+    else:
+        x_values_slice, y_values_slice = frame.series.window(data_rect.x(), data_rect.right())
+
+    if len(x_values_slice) == 0:
+        return (0, 0)
+    if is_cancelled():
+        return None
+
+    rw, rh = _scales(frame.x_orientation, frame.y_orientation, data_rect, item_size)
+    if frame.x_orientation == ORIENTATION_LEFT_TO_RIGHT and frame.y_orientation == ORIENTATION_UPWARD:
+        xx = (x_values_slice - data_rect.x()) * rw
+        yy = (y_values_slice - data_rect.y()) * rh
+    elif frame.x_orientation == ORIENTATION_DOWNWARD and frame.y_orientation == ORIENTATION_LEFT_TO_RIGHT:
+        xx = (y_values_slice - data_rect.y()) * rh
+        yy = item_size.height() - (x_values_slice - data_rect.x()) * rw
+
+    # M4 decimation: keep the first, last, min and max samples of each device pixel along X,
+    # which draws the same pixels for lines and polygons.
+    # Points are all drawn, since their markers are larger than a pixel.
+    n_samples = len(xx)
+    if frame.render_type != POINT_RENDERER and n_samples > 4 * x_pixels * pixel_ratio:
+        if frame.x_orientation == ORIENTATION_LEFT_TO_RIGHT:
+            indices = m4_indices(xx * pixel_ratio, yy)
+        else:
+            indices = m4_indices(yy * pixel_ratio, xx)
+        xx, yy = xx[indices], yy[indices]
+    stats = (n_samples, len(xx))
+    if is_cancelled():
+        return None
+
+    # NaN values are gaps, lines are not drawn across them
+    valid = ~(np.isnan(xx) | np.isnan(yy))
+    vertical = frame.x_orientation == ORIENTATION_DOWNWARD and frame.y_orientation == ORIENTATION_LEFT_TO_RIGHT
+
+    # simple symbols are drawn directly, without building a geometry
+    style = _simple_symbol_style(frame.renderer, frame.render_type)
+    if style is not None:
+        _draw_simple(painter, style, frame.render_type, xx, yy, valid, vertical, item_size.height())
+        return stats
+
+    if frame.render_type == LINE_RENDERER:
+        runs = [(start, end) for start, end in _runs(valid) if end - start > 1]
+        if not runs:
+            return stats
+        wkb = _multilinestring_wkb(xx, yy, runs)
+    elif frame.render_type == POINT_RENDERER:
+        if not valid.any():
+            return stats
+        wkb = _multipoint_wkb(xx[valid], yy[valid])
+    elif frame.render_type == POLYGON_RENDERER:
+        runs = _runs(valid)
+        if not runs:
+            return stats
+        wkb = _multipolygon_wkb(xx, yy, runs, vertical)
+
+    # build a geometry from the WKB
+    # since numpy arrays have buffer protocol, sip is able to read it
+    geom = QgsGeometry()
+    geom.fromWkb(wkb)
+
+    fields = QgsFields()
+    #fields.append(QgsField("", QVariant.String))
+    feature = QgsFeature(fields, 1)
+    feature.setGeometry(geom)
+
+    context = frame.render_session.context(painter, frame.renderer, fields,
+                                           item_size.width(), item_size.height())
+    context.setExtent(QgsRectangle(0, 1, item_size.width(), item_size.height()))
+    frame.renderer.renderFeature(feature, context)
+    return stats
+
+class _RenderJobSignals(QObject):
+    # the job is finished or has been cancelled: job
+    finished = pyqtSignal(object)
+
+class _RenderJob(QRunnable):
+    """Renders the curve of a frame in a thread of the global thread pool, like a QGIS map rendering job"""
+
+    def __init__(self, frame, lock):
+        """
+        frame: _CurveFrame to render
+        lock: lock shared by the jobs of an item, that use the same render session
+        """
+        QRunnable.__init__(self)
+        # the job is kept alive by its item until finished
+        self.setAutoDelete(False)
+        self.signals = _RenderJobSignals()
+        self.frame = frame
+        self.result = None
+        self.__lock = lock
+        self.__cancelled = False
+
+    def cancel(self):
+        self.__cancelled = True
+
+    def is_cancelled(self):
+        return self.__cancelled
+
+    def run(self):
+        try:
+            # superseded jobs do not wait for the running one, so that they do not hold threads of the pool
+            if not self.__cancelled:
+                with self.__lock:
+                    if not self.__cancelled:
+                        self.result = _render_image(self.frame, self.is_cancelled)
+        except Exception as e:
+            QgsMessageLog.logMessage("Error while rendering: {}".format(e), "QGeoloGIS", QgsMessageLog.WARNING)
+        self.signals.finished.emit(self)
+
 class PlotItem(LogItem):
 
+    # the extent of the value axis has changed: (min, max)
+    valueRangeChanged = pyqtSignal(float, float)
+
     def __init__(self,
                  size=QSizeF(400,200),
                  render_type=POINT_RENDERER,
@@ -47,6 +513,7 @@ class PlotItem(LogItem):
         self.__item_size = size
         self.__data_rect = None
         self.__data = None
+        self.__series = None
         self.__delta = None
         self.__x_orientation = x_orientation
         self.__y_orientation = y_orientation
@@ -76,6 +543,40 @@ class PlotItem(LogItem):
         self.__old_point_to_label = None
         self.__point_to_label = None
 
+        # progress of the data loading, None if data are loaded
+        self.__loading_progress = None
+
+        # level of detail of the data, if any
+        self.__lod = None
+
+        # extent of the values of the whole series
+        self.__value_range = None
+        # if True, the value axis is fitted to the values of the displayed X range
+        self.__auto_fit = False
+
+        # number of samples before and after the M4 decimation, during the last paint
+        self.__render_stats = (0, 0)
+
+        # rendered curve: (frame, image), the key of a frame being made of the data window,
+        # the item size, the device pixel ratio and the versions of the style and of the data
+        self.__curve_image = None
+        self.__style_version = 0
+        self.__data_version = 0
+
+        # clone of the renderer used for rendering, (style version, renderer)
+        # so that the renderer can be edited while a job runs
+        self.__frame_renderer = None
+        # the renderer stays started between paints. Jobs of the item use it one at a time
+        self.__render_session = RenderSession()
+        self.__render_lock = threading.Lock()
+        # curves are rendered in threads, the running job is replaced when the window changes
+        self.__async_rendering = True
+        self.__render_job = None
+        # jobs still running, cancelled or not
+        self.__jobs = set()
+        # fast rendering mode, during interactions
+        self.__fast_rendering = False
+
     def boundingRect(self):
         return QRectF(0, 0, self.__item_size.width(), self.__item_size.height())
 
@@ -105,10 +606,56 @@ class PlotItem(LogItem):
     def set_min_depth(self, min_depth):
         if self.__data_rect is not None:
             self.__data_rect.setX(min_depth)
+            self.__fit_value_axis()
     def set_max_depth(self, max_depth):
         if self.__data_rect is not None:
             w = max_depth - self.__data_rect.x()
             self.__data_rect.setWidth(w)
+            self.__fit_value_axis()
+    def set_depth_window(self, min_depth, max_depth):
+        """Set both edges of the X window, the value axis is fitted once"""
+        if self.__data_rect is not None:
+            self.__data_rect.setX(min_depth)
+            self.__data_rect.setWidth(max_depth - min_depth)
+            self.__fit_value_axis()
+
+    def auto_fit(self):
+        return self.__auto_fit
+
+    def set_auto_fit(self, auto_fit):
+        """If auto_fit is True, the value axis is fitted to the values of the displayed
+        X range each time it changes, otherwise it covers the values of the whole series"""
+        self.__auto_fit = auto_fit
+        if auto_fit:
+            self.__fit_value_axis()
+        elif self.__value_range is not None and self.__data_rect is not None:
+            self.__set_value_range(*self.__value_range)
+        self.update()
+
+    def __fit_value_axis(self):
+        if not self.__auto_fit or self.__series is None or self.__data_rect is None or self.__data_rect.width() <= 0:
+            return
+        x_min, x_max = self.__data_rect.x(), self.__data_rect.right()
+        if self.__lod is not None:
+            # O(log n) on the level of detail pyramid
+            min_y, max_y = self.__lod.window_min_max(x_min, x_max)
+        else:
+            y_values = self.__series.y_values()[self.__series.index_left(x_min):self.__series.index_right(x_max)]
+            y_values = y_values[~np.isnan(y_values)]
+            min_y, max_y = (y_values.min(), y_values.max()) if len(y_values) > 0 else (None, None)
+        if min_y is not None:
+            self.__set_value_range(min_y, max_y)
+
+    def __set_value_range(self, min_y, max_y):
+        """Set the extent of the value axis, with a 20% buffer around values"""
+        self.valueRangeChanged.emit(min_y, max_y)
+        if max_y == 0.0:
+            max_y = 1.0
+        h = max_y - min_y
+        min_y -= h * 0.1
+        max_y += h * 0.1
+        self.__data_rect.setY(min_y)
+        self.__data_rect.setHeight(max_y - min_y)
 
     def layer(self):
         return self.__layer
@@ -118,44 +665,71 @@ class PlotItem(LogItem):
     def data_window(self):
         return self.__data_rect
 
-    def set_data(self, x_values, y_values):
-        self.__x_values = x_values
-        self.__y_values = y_values
+    def set_data(self, x_values, y_values, y_min=None, y_max=None):
+        """Set the values to plot, sorted on X. NaN or None Y values are drawn as gaps.
+
+        y_min, y_max: extent of the value axis, computed from y_values if not given.
+                      Useful when only a part of the data is passed.
+        """
+        # copies are made, values may be owned by a DataInterface. None values become NaN
+        x_values = np.array(x_values, dtype=np.float64)
+        y_values = np.array(y_values, dtype=np.float64)
 
-        if len(self.__x_values) != len(self.__y_values):
+        if len(x_values) != len(y_values):
             raise ValueError("X and Y array has different length : "
-                             "{} != {}".format(len(self.__x_values),
-                                               len(self.__y_values)))
-
-        # Remove None values
-        for i in reversed(range(len(self.__y_values))):
-            if (self.__y_values[i] is None
-                or self.__x_values[i] is None
-                or math.isnan(self.__y_values[i])
-                or math.isnan(self.__x_values[i])):
-                self.__y_values.pop(i)
-                self.__x_values.pop(i)
+                             "{} != {}".format(len(x_values),
+                                               len(y_values)))
+
+        # samples without X cannot be placed, samples without Y are kept as gaps
+        valid = ~np.isnan(x_values)
+        if not valid.all():
+            x_values, y_values = x_values[valid], y_values[valid]
+        x_values.flags.writeable = False
+        y_values.flags.writeable = False
+
+        self.set_series(SampledSeries(x_values, y_values), y_min, y_max)
+
+    def set_series(self, series, y_min=None, y_max=None):
+        """Set the values to plot, as a series (see series.py).
+
+        X values of the series are only computed for the displayed window.
+        y_min, y_max: extent of the value axis, computed from the series if not given.
+        """
+        self.__series = series
+        self.__data_version += 1
 
         # Initialize data rect to display all data
         # with a 20% buffer around Y values
-        min_x = min(self.__x_values)
-        max_x = max(self.__x_values)
-        min_y = min(self.__y_values)
-        max_y = max(self.__y_values)
-        if max_y == 0.0:
-            max_y = 1.0
-        h = max_y - min_y
-        min_y -= h * 0.1
-        max_y += h * 0.1
-        self.__data_rect = QRectF(
-            min_x, min_y,
-            max_x-min_x, max_y-min_y)
+        min_x = series.x_min()
+        max_x = series.x_max()
+        min_y, max_y = y_min, y_max
+        if min_y is None or max_y is None:
+            y_values = series.y_values()
+            y_values = y_values[np.isfinite(y_values)]
+            if len(y_values) > 0:
+                min_y = y_values.min() if min_y is None else min_y
+                max_y = y_values.max() if max_y is None else max_y
+            elif self.__value_range is not None:
+                # no value to fit (only gaps), keep the current extent
+                min_y, max_y = self.__value_range
+            else:
+                min_y, max_y = 0.0, 1.0
+        self.__value_range = (min_y, max_y)
+        self.__data_rect = QRectF(min_x, 0, max_x-min_x, 0)
+        self.__set_value_range(min_y, max_y)
+
+    def set_lod(self, lod):
+        """Set the level of detail pyramid of the data, used to draw
+        only a few samples per pixel"""
+        self.__lod = lod
+        self.__data_version += 1
 
     def renderer(self):
         return self.__renderer
 
     def set_renderer(self, renderer):
         self.__renderer = renderer
+        self.__style_version += 1
 
     def render_type(self):
         return self.__render_type
@@ -163,148 +737,181 @@ class PlotItem(LogItem):
     def set_render_type(self, type):
         self.__render_type = type
         self.__renderer = self.__renderers[self.__render_type]
+        self.__style_version += 1
+
+    def set_loading_progress(self, progress):
+        """Display a loading message with the given progress (in percent). None to remove it"""
+        self.__loading_progress = progress
+        self.update()
+
+    def render_stats(self):
+        """Returns (number of input samples, number of drawn samples, reduction ratio)
+        of the pixel decimation during the last paint"""
+        n_in, n_out = self.__render_stats
+        return n_in, n_out, float(n_in) / n_out if n_out > 0 else 1.0
+
+    def invalidate_cache(self):
+        """Forget the rendered curve, e.g. after the renderer has been modified in place"""
+        self.__style_version += 1
+        self.__curve_image = None
+        self.update()
+
+    def async_rendering(self):
+        return self.__async_rendering
+
+    def set_async_rendering(self, async_rendering):
+        """If async_rendering is True (the default), the curve is rendered in a thread and the
+        previous rendering is displayed meanwhile. Otherwise it is rendered during paint()"""
+        self.__async_rendering = async_rendering
+
+    def fast_rendering(self):
+        return self.__fast_rendering
+
+    def set_fast_rendering(self, fast):
+        """In fast rendering mode, used during interactions, the curve is drawn without
+        antialiasing and with a coarser level of detail"""
+        if fast != self.__fast_rendering:
+            self.__fast_rendering = fast
+            self.update()
+
+    def __scales(self):
+        """Returns (pixels per X unit, pixels per Y unit)"""
+        return _scales(self.__x_orientation, self.__y_orientation, self.__data_rect, self.__item_size)
+
+    def __frame(self, key, overscan, pixel_ratio, render_hints):
+        """Returns the frame to render the curve for the given key, on a strip around
+        the data window extended by overscan times its length on each side"""
+        if self.__frame_renderer is None or self.__frame_renderer[0] != self.__style_version:
+            self.__frame_renderer = (self.__style_version, self.__renderer.clone())
+        lod = self.__lod.snapshot() if self.__lod is not None else None
+        if self.__fast_rendering:
+            render_hints &= ~QPainter.Antialiasing
+        r = self.__data_rect
+        strip_rect = QRectF(r.x() - overscan * r.width(), r.y(), r.width() * (1 + 2 * overscan), r.height())
+        if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT:
+            strip_size = QSizeF(self.__item_size.width() * (1 + 2 * overscan), self.__item_size.height())
+        else:
+            strip_size = QSizeF(self.__item_size.width(), self.__item_size.height() * (1 + 2 * overscan))
+        return _CurveFrame(key, self.__series, lod, strip_rect, strip_size,
+                           self.__x_orientation, self.__y_orientation, self.__render_type,
+                           self.__frame_renderer[1], self.__render_session, pixel_ratio, render_hints,
+                           self.__fast_rendering)
+
+    def __frame_matches(self, frame, key, margin=0.0, allow_fast=True):
+        """Returns True if the frame has the given key, the scale of the data window,
+        and covers the data window extended by margin on each side.
+
+        allow_fast: if False, frames rendered in fast mode do not match
+        """
+        r = self.__data_rect
+        if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT:
+            frame_pixels, pixels = frame.item_size.width(), self.__item_size.width()
+        else:
+            frame_pixels, pixels = frame.item_size.height(), self.__item_size.height()
+        return (frame.key == key
+                and (allow_fast or not frame.fast)
+                and np.isclose(frame.data_rect.width() / frame_pixels, r.width() / pixels, rtol=1e-9)
+                and frame.contains(r.x() - margin, r.right() + margin))
+
+    def __start_render(self, frame):
+        """Start a job to render the frame, replacing the running one"""
+        if self.__render_job is not None:
+            # superseded
+            self.__render_job.cancel()
+        job = _RenderJob(frame, self.__render_lock)
+        job.signals.finished.connect(self.__on_render_finished)
+        self.__render_job = job
+        self.__jobs.add(job)
+        QThreadPool.globalInstance().start(job)
+
+    def __on_render_finished(self, job):
+        self.__jobs.discard(job)
+        if job is not self.__render_job:
+            return
+        self.__render_job = None
+        if job.result is None:
+            return
+        image, self.__render_stats = job.result
+        self.__curve_image = (job.frame, image)
+        self.update()
+
+    def cancel_rendering(self):
+        """Cancel the running render job, if any"""
+        if self.__render_job is not None:
+            self.__render_job.cancel()
+            self.__render_job = None
 
     def paint(self, painter, option, widget):
         self.draw_background(painter)
+        if self.__loading_progress is not None:
+            painter.drawText(self.boundingRect(), Qt.AlignCenter,
+                             "Loading... {:.0f}%".format(self.__loading_progress))
         if self.__data_rect is None:
             return
 
-        imin_x = bisect.bisect_left(self.__x_values, self.__data_rect.x())
-        if imin_x > 0:
-            imin_x -= 1
-        imax_x = bisect.bisect_right(self.__x_values, self.__data_rect.right())
-        if imax_x < len(self.__x_values) - 1:
-            imax_x += 1
-        x_values_slice = np.array(self.__x_values[imin_x:imax_x])
-        y_values_slice = np.array(self.__y_values[imin_x:imax_x])
-
-        if len(x_values_slice) == 0:
+        if _is_vector_device(painter):
+            # exports get the decimated geometry of the curve, which keeps them small and sharp
+            frame = self.__frame(None, 0.0, _vector_pixel_ratio(painter), painter.renderHints())
+            painter.save()
+            painter.setClipRect(self.boundingRect())
+            with self.__render_lock:
+                self.__render_stats = _render_curve(painter, frame, frame.pixel_ratio, lambda: False)
+            painter.restore()
+            self.__paint_label(painter)
             return
 
-        # filter points that are not None (nan in numpy arrays)
-        n_points = len(x_values_slice)
-
-        if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT and self.__y_orientation == ORIENTATION_UPWARD:
-            if self.__data_rect.width() > 0:
-                rw = float(self.__item_size.width()) / self.__data_rect.width()
+        # the curve is rendered once in an image, on a strip larger than the data window.
+        # It is reused until the window leaves the strip, or the scale, the size, the style
+        # or the data change. Overlays (selection, label) are drawn on top.
+        pixel_ratio = _device_pixel_ratio(painter)
+        r = self.__data_rect
+        key = ((r.y(), r.height()),
+               (self.__item_size.width(), self.__item_size.height()),
+               pixel_ratio, self.__style_version, self.__data_version)
+        # a strip rendered in full quality is also used in fast mode, a fast strip is only
+        # rendered when the window leaves it, and replaced once the fast mode is over
+        allow_fast = self.__fast_rendering
+        # rendered strips are only useful for later pans when rendered in the background
+        overscan = OVERSCAN if self.__async_rendering else 0.0
+        # a new strip is rendered in the background when the window gets close to the edge
+        margin = overscan * r.width() / 2
+
+        image_frame = self.__curve_image[0] if self.__curve_image is not None else None
+        if image_frame is None or not self.__frame_matches(image_frame, key, margin, allow_fast):
+            job = self.__render_job
+            if job is None or not self.__frame_matches(job.frame, key, margin, allow_fast):
+                frame = self.__frame(key, overscan, pixel_ratio, painter.renderHints())
+                if self.__async_rendering:
+                    self.__start_render(frame)
+                else:
+                    with self.__render_lock:
+                        image, self.__render_stats = _render_image(frame, lambda: False)
+                    self.__curve_image = (frame, image)
+
+        if self.__curve_image is not None:
+            frame, image = self.__curve_image
+            transform = _frame_transform(frame, _painter_axes(self.__x_orientation, self.__y_orientation,
+                                                              r, self.__item_size))
+            painter.save()
+            painter.setClipRect(self.boundingRect())
+            if self.__frame_matches(frame, key):
+                # same scale: the strip is only moved
+                painter.drawImage(QPointF(transform.dx(), transform.dy()), image)
             else:
-                rw = float(self.__item_size.width())
-            if self.__data_rect.height() > 0:
-                rh = float(self.__item_size.height()) / self.__data_rect.height()
-            else:
-                rh = float(self.__item_size.height())
-            xx = (x_values_slice - self.__data_rect.x()) * rw
-            yy = (y_values_slice - self.__data_rect.y()) * rh
-        elif self.__x_orientation == ORIENTATION_DOWNWARD and self.__y_orientation == ORIENTATION_LEFT_TO_RIGHT:
-            if self.__data_rect.width() > 0:
-                rw = float(self.__item_size.height()) / self.__data_rect.width()
-            else:
-                rw = float(self.__item_size.height())
-            if self.__data_rect.height() > 0:
-                rh = float(self.__item_size.width()) / self.__data_rect.height()
-            else:
-                rh = float(self.__item_size.width())
-            xx = (y_values_slice - self.__data_rect.y()) * rh
-            yy = self.__item_size.height() - (x_values_slice - self.__data_rect.x()) * rw
-        if self.__render_type == LINE_RENDERER:
-            # WKB structure of a linestring
-            #
-            #   01 : endianness
-            #   02 00 00 00 : WKB type (linestring)
-            #   nn nn nn nn : number of points (int32)
-            # Then, for each point:
-            #   xx xx xx xx xx xx xx xx : X coordinate (float64)
-            #   yy yy yy yy yy yy yy yy : Y coordinate (float64)
-
-            wkb = np.zeros(8*2*n_points+9, dtype='uint8')
-            wkb[0] = 1 # wkb endianness
-            wkb[1] = 2 # linestring
-            size_view = np.ndarray(buffer=wkb, dtype='int32', offset=5, shape=(1,))
-            size_view[0] = n_points
-            coords_view = np.ndarray(buffer=wkb, dtype='float64', offset=9, shape=(n_points,2))
-            coords_view[:,0] = xx[:]
-            coords_view[:,1] = yy[:]
-        elif self.__render_type == POINT_RENDERER:
-            # WKB structure of a multipoint
-            # 
-            #   01 : endianness
-            #   04 00 00 00 : WKB type (multipoint)
-            #   nn nn nn nn : number of points (int32)
-            # Then, for each point:
-            #   01 : endianness
-            #   01 00 00 00 : WKB type (point)
-            #   xx xx xx xx xx xx xx xx : X coordinate (float64)
-            #   yy yy yy yy yy yy yy yy : Y coordinate (float64)
-
-            wkb = np.zeros((8*2+5)*n_points+9, dtype='uint8')
-            wkb[0] = 1 # wkb endianness
-            wkb[1] = 4 # multipoint
-            size_view = np.ndarray(buffer=wkb, dtype='int32', offset=5, shape=(1,))
-            size_view[0] = n_points
-            coords_view = np.ndarray(buffer=wkb, dtype='float64', offset=9+5, shape=(n_points,2), strides=(16+5,8))
-            coords_view[:,0] = xx[:]
-            coords_view[:,1] = yy[:]
-            # header of each point
-            h_view = np.ndarray(buffer=wkb, dtype='uint8', offset=9, shape=(n_points,2), strides=(16+5,1))
-            h_view[:,0] = 1 # endianness
-            h_view[:,1] = 1 # point
-        elif self.__render_type == POLYGON_RENDERER:
-            # WKB structure of a polygon
-            # 
-            #   01 : endianness
-            #   03 00 00 00 : WKB type (polygon)
-            #   01 00 00 00 : Number of rings (always 1 here)
-            #   nn nn nn nn : number of points (int32)
-            # Then, for each point:
-            #   xx xx xx xx xx xx xx xx : X coordinate (float64)
-            #   yy yy yy yy yy yy yy yy : Y coordinate (float64)
-            #
-            # We add two additional points to close the polygon
-
-            wkb = np.zeros(8*2*(n_points+2)+9+4, dtype='uint8')
-            wkb[0] = 1 # wkb endianness
-            wkb[1] = 3 # polygon
-            wkb[5] = 1 # number of rings
-            size_view = np.ndarray(buffer=wkb, dtype='int32', offset=9, shape=(1,))
-            size_view[0] = n_points+2
-            coords_view = np.ndarray(buffer=wkb, dtype='float64', offset=9+4, shape=(n_points,2))
-            coords_view[:,0] = xx[:]
-            coords_view[:,1] = yy[:]
-            # two extra points
-            extra_coords = np.ndarray(buffer=wkb, dtype='float64', offset=8*2*n_points+9+4, shape=(2,2))
-            if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT and self.__y_orientation == ORIENTATION_UPWARD:
-                extra_coords[0,0] = coords_view[-1,0]
-                extra_coords[0,1] = 0.0
-                extra_coords[1,0] = coords_view[0,0]
-                extra_coords[1,1] = 0.0
-            elif self.__x_orientation == ORIENTATION_DOWNWARD and self.__y_orientation == ORIENTATION_LEFT_TO_RIGHT:
-                extra_coords[0,0] = 0.0
-                extra_coords[0,1] = coords_view[-1,1]
-                extra_coords[1,0] = 0.0
-                extra_coords[1,1] = coords_view[0,1]
-
-        # build a geometry from the WKB
-        # since numpy arrays have buffer protocol, sip is able to read it
-        geom = QgsGeometry()
-        geom.fromWkb(wkb)
-
-        painter.setClipRect(0, 0, self.__item_size.width(), self.__item_size.height())
+                # the previous rendering is displayed, moved and scaled to the current window,
+                # until the running job is finished
+                painter.setTransform(transform, True)
+                painter.drawImage(0, 0, image)
+            painter.restore()
 
-        fields = QgsFields()
-        #fields.append(QgsField("", QVariant.String))
-        feature = QgsFeature(fields, 1)
-        feature.setGeometry(geom)
-
-        context = qgis_render_context(painter, self.__item_size.width(), self.__item_size.height())
-        context.setExtent(QgsRectangle(0, 1, self.__item_size.width(), self.__item_size.height()))
-
-        self.__renderer.startRender(context, fields)
-        self.__renderer.renderFeature(feature, context)
-        self.__renderer.stopRender(context)
+        self.__paint_label(painter)
 
+    def __paint_label(self, painter):
+        """Draw the marker of the labelled point, if any"""
         if self.__point_to_label is not None:
+            rw, rh = self.__scales()
             i = self.__point_to_label
-            x, y = self.__x_values[i], self.__y_values[i]
+            x, y = self.__series.x_at(i), self.__series.y_values()[i]
             if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT and self.__y_orientation == ORIENTATION_UPWARD:
                 px = (x - self.__data_rect.x()) * rw
                 py = self.__item_size.height() - (y - self.__data_rect.y()) * rh
@@ -315,22 +922,27 @@ class PlotItem(LogItem):
             painter.drawLine(px, py-5, px, py+5)
 
     def mouseMoveEvent(self, event):
+        if self.__series is None or self.__data_rect is None:
+            # no data yet
+            return
         if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT and self.__y_orientation == ORIENTATION_UPWARD:
             xx = (event.scenePos().x() - self.pos().x()) / self.width() * self.__data_rect.width() + self.__data_rect.x()
         elif self.__x_orientation == ORIENTATION_DOWNWARD and self.__y_orientation == ORIENTATION_LEFT_TO_RIGHT:
             xx = (event.scenePos().y() - self.pos().y()) / self.height() * self.__data_rect.width() + self.__data_rect.x()
-        i = bisect.bisect_left(self.__x_values, xx)
-        if i >= 0 and i < len(self.__x_values):
+        series = self.__series
+        i = series.index_left(xx)
+        if i >= 0 and i < len(series):
             # switch the attached point when we are between two points
-            if i > 0 and (xx - self.__x_values[i-1]) < (self.__x_values[i] - xx):
+            if i > 0 and (xx - series.x_at(i-1)) < (series.x_at(i) - xx):
                 i -= 1
-            self.__point_to_label = i
+            # no label on gap markers
+            self.__point_to_label = i if not np.isnan(series.y_values()[i]) else None
         else:
             self.__point_to_label = None
         if self.__point_to_label != self.__old_point_to_label:
             self.update()
         if self.__point_to_label is not None:
-            x, y = self.__x_values[i], self.__y_values[i]
+            x, y = series.x_at(i), series.y_values()[i]
             if self.__x_orientation == ORIENTATION_LEFT_TO_RIGHT and self.__y_orientation == ORIENTATION_UPWARD:
                 dt = datetime.fromtimestamp(x, UTC())
                 txt = "Time: {} Value: {}".format(unicode(dt.strftime("%x %X"), "utf8"),y)
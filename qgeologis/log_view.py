@@ -16,17 +16,18 @@
 #   License along with this library; if not, see <http://www.gnu.org/licenses/>.
 #
 
-from qgis.PyQt.QtCore import Qt, QRectF, QSizeF, QPoint
+from qgis.PyQt.QtCore import Qt, QRectF, QSizeF, QPoint, QTimer
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QGraphicsView, QGraphicsScene, QWidget, QToolBar, QAction, QLabel, QVBoxLayout, QToolTip
 from qgis.PyQt.QtWidgets import QStatusBar
 
-from .common import POLYGON_RENDERER, ORIENTATION_DOWNWARD, ORIENTATION_LEFT_TO_RIGHT
+from .common import POLYGON_RENDERER, ORIENTATION_DOWNWARD, ORIENTATION_LEFT_TO_RIGHT, InteractionLoop, GridScene
 
 from .log_plot import PlotItem
 from .z_scale import ZScaleItem
 from .stratigraphy import StratigraphyItem
 from .legend_item import LegendItem
+from .data_cache import data_cache
 from .imagery_data import ImageryDataItem
 
 import os
@@ -42,11 +43,27 @@ class LogGraphicsView(QGraphicsView):
 
         self.setMouseTracking(True)
 
+        # pan and zoom are applied at most once per frame
+        self.__interaction = InteractionLoop(lambda: self.parentWidget()._update_column_depths(),
+                                             lambda fast: self.parentWidget()._set_fast_rendering(fast),
+                                             self)
+
+        # total width of the columns
+        self.__content_width = 0
+
+    def set_content_width(self, width):
+        """Set the total width of the columns, the view scrolls horizontally if they do not fit"""
+        self.__content_width = width
+        self.__update_scene_rect(self.viewport().size())
+
     def resizeEvent(self, event):
         QGraphicsView.resizeEvent(self, event)
+        self.__update_scene_rect(event.size())
+
+    def __update_scene_rect(self, size):
         # by default, the rect is centered on 0,0,
         # we prefer to have 0,0 in the upper left corner
-        self.scene().setSceneRect(QRectF(0, 0, event.size().width(), event.size().height()))
+        self.scene().setSceneRect(QRectF(0, 0, max(size.width(), self.__content_width), size.height()))
 
     def wheelEvent(self, event):
         delta = -event.delta() / 100.0
@@ -62,7 +79,7 @@ class LogGraphicsView(QGraphicsView):
         dy = event.y() / self.scene().sceneRect().height() * (h - nh)
         self.parentWidget()._min_z += dy
         self.parentWidget()._max_z = self.parentWidget()._min_z + nh
-        self.parentWidget()._update_column_depths()
+        self.__interaction.request_update()
 
     def mouseMoveEvent(self, event):
         if not self.__allow_mouse_translation:
@@ -74,7 +91,7 @@ class LogGraphicsView(QGraphicsView):
             min_z = self.__translation_min_z + delta_y
             self.parentWidget()._min_z = min_z
             self.parentWidget()._max_z = self.__translation_max_z + delta_y
-            self.parentWidget()._update_column_depths()
+            self.__interaction.request_update()
         return QGraphicsView.mouseMoveEvent(self, event)
 
     def mousePressEvent(self, event):
@@ -87,23 +104,15 @@ class LogGraphicsView(QGraphicsView):
 
     def mouseReleaseEvent(self, event):
         if event.pos() == self.__translation_orig:
-            self.parentWidget().select_column_at(event.pos())
+            self.parentWidget().select_column_at(self.mapToScene(event.pos()))
         self.__translation_orig = None
 
         return QGraphicsView.mouseReleaseEvent(self, event)
 
-class MyScene(QGraphicsScene):
+class MyScene(GridScene):
     def __init__(self, x, y, w, h):
-        QGraphicsScene.__init__(self, x, y, w, h)
-
-    def mouseMoveEvent(self, event):
-        # pass the event to the underlying item
-        for item in list(self.items()):
-            r = item.boundingRect()
-            r.translate(item.pos())
-            if r.contains(event.scenePos()):
-                return item.mouseMoveEvent(event)
-        return QGraphicsScene.mouseMoveEvent(self, event)
+        # columns
+        GridScene.__init__(self, x, y, w, h, True)
 
 class WellLogView(QWidget):
 
@@ -118,6 +127,7 @@ class WellLogView(QWidget):
         self.__log_view.setAlignment(Qt.AlignLeft|Qt.AlignTop)
 
         self.__log_scene.sceneRectChanged.connect(self.on_rect_changed)
+        self.__log_view.horizontalScrollBar().valueChanged.connect(self._schedule_visibility_update)
 
         if image_dir is None:
             image_dir = os.path.join(os.path.dirname(__file__), "img")
@@ -136,6 +146,11 @@ class WellLogView(QWidget):
         self.__action_remove_column = QAction(QIcon(os.path.join(image_dir, "remove.svg")), "Remove the column", toolbar)
         self.__action_remove_column.triggered.connect(self.on_remove_column)
 
+        self.__action_auto_fit = QAction("Fit values", toolbar)
+        self.__action_auto_fit.setToolTip("Fit the value axes to the displayed depths")
+        self.__action_auto_fit.setCheckable(True)
+        self.__action_auto_fit.toggled.connect(self.on_auto_fit)
+
         #self.__action_move_content_right = QAction("Move content right", toolbar)
         #self.__action_move_content_left = QAction("Move content left", toolbar)
         #self.__action_move_content_left.triggered.connect(self.on_move_content_left)
@@ -146,6 +161,7 @@ class WellLogView(QWidget):
         toolbar.addAction(self.__action_edit_style)
         toolbar.addAction(self.__action_add_column)
         toolbar.addAction(self.__action_remove_column)
+        toolbar.addAction(self.__action_auto_fit)
 
         #self.__toolbar.addAction(self.__action_move_content_left)
         #self.__toolbar.addAction(self.__action_move_content_right)
@@ -168,6 +184,15 @@ class WellLogView(QWidget):
         self.__columns = []
         # { layer : (log_item, legend_item) }
         self.__data2logitems = {}
+        # data -> list of (signal, slot) connected by this view
+        self.__data_connections = {}
+        # value axes fitted to the displayed X range
+        self.__auto_fit = False
+        # placeholder plot item -> function that returns its data, for columns
+        # whose data are only loaded once visible
+        self.__lazy_columns = {}
+        # the visibility of columns is updated once per event loop iteration
+        self.__visibility_update_pending = False
         self.__column_widths = []
 
         self._min_z = 0
@@ -187,26 +212,69 @@ class WellLogView(QWidget):
     def on_rect_changed(self, rect):
         for item, _ in self.__columns:
             item.set_height(rect.height())
+        self._schedule_visibility_update()
+
+    def _schedule_visibility_update(self):
+        if not self.__visibility_update_pending:
+            self.__visibility_update_pending = True
+            QTimer.singleShot(0, self._update_visible_columns)
+
+    def _update_visible_columns(self, show_all=False):
+        """Columns outside of the horizontal viewport are hidden: they are not painted and their
+        depths are not updated. Lazy columns load their data when they are first visible.
+
+        :param show_all: if True, all the columns are shown, e.g. for an export
+        """
+        self.__visibility_update_pending = False
+        view_rect = self.__log_view.mapToScene(self.__log_view.viewport().rect()).boundingRect()
+        for item, legend in list(self.__columns):
+            visible = show_all or (item.x() < view_rect.right() and item.x() + item.boundingRect().width() > view_rect.left())
+            if visible and item in self.__lazy_columns:
+                # items are created visible, lazy columns are loaded whatever their previous visibility
+                item.setVisible(True)
+                legend.setVisible(True)
+                self.__load_lazy_column(item, legend)
+                continue
+            if visible == item.isVisible():
+                continue
+            item.setVisible(visible)
+            legend.setVisible(visible)
+            if visible:
+                # depths have not been updated while hidden
+                for data, (plot_item, _) in self.__data2logitems.items():
+                    if plot_item is item:
+                        data.set_x_window(self._min_z, self._max_z)
+                item.set_depth_window(self._min_z, self._max_z)
+                item.update()
+
+    def closeEvent(self, event):
+        # release data, their loading is stopped if no other view displays them
+        for data in list(self.__data2logitems):
+            self._release_data(data)
+        QWidget.closeEvent(self, event)
 
     def set_title(self, title):
         self.__title_label.setText(title)
 
     def _place_items(self):
         x = 0
+        offsets = []
         for i, c in enumerate(self.__columns):
             item, legend = c
             width = self.__column_widths[i]
             legend.setPos(x, 0)
             item.setPos(x, legend.boundingRect().height())
+            offsets.append(x)
             x += width
-        self.__log_view.setMinimumSize(x, self.__log_view.minimumSize().height())
+        self.__log_scene.set_cells(offsets, self.__columns)
+        self.__log_view.set_content_width(x)
+        self._schedule_visibility_update()
 
     def _add_column(self, log_item, legend_item):
         self.__log_scene.addItem(log_item)
         self.__log_scene.addItem(legend_item)
 
-        log_item.set_min_depth(self._min_z)
-        log_item.set_max_depth(self._max_z)
+        log_item.set_depth_window(self._min_z, self._max_z)
         self.__columns.append((log_item, legend_item))
         self.__column_widths.append(log_item.boundingRect().width())
 
@@ -221,10 +289,45 @@ class WellLogView(QWidget):
             self._max_z += 1.0
 
     def _update_column_depths(self):
+        # hidden columns are updated when they become visible, see _update_visible_columns
+        for data, (item, _) in self.__data2logitems.items():
+            if item.isVisible():
+                data.set_x_window(self._min_z, self._max_z)
         for item, _ in self.__columns:
-            item.set_min_depth(self._min_z)
-            item.set_max_depth(self._max_z)
-            item.update()
+            if item.isVisible():
+                item.set_depth_window(self._min_z, self._max_z)
+                item.update()
+
+    def set_depth_window(self, min_z, max_z):
+        """Display the depths between min_z and max_z"""
+        self._min_z = min_z
+        self._max_z = max_z
+        self._update_column_depths()
+
+    def columns_width(self):
+        """Total width of the columns"""
+        return sum(self.__column_widths)
+
+    def render_columns(self, painter, height, target=QRectF()):
+        """Render all the columns on a painter, e.g. for an export, with a scene of the given height.
+        Curves are rendered synchronously.
+
+        :param target: rectangle of the painter where the columns are drawn, the whole device by default
+        :returns: the rendered rectangle of the scene
+        """
+        self.__log_scene.setSceneRect(QRectF(0, 0, self.columns_width(), height))
+        self._update_visible_columns(show_all=True)
+        # lazy columns without data have been removed
+        source = QRectF(0, 0, self.columns_width(), height)
+        plot_items = [item for item, _ in self.__columns if isinstance(item, PlotItem) and item.async_rendering()]
+        for item in plot_items:
+            item.set_async_rendering(False)
+        try:
+            self.__log_scene.render(painter, target, source)
+        finally:
+            for item in plot_items:
+                item.set_async_rendering(True)
+        return source
 
     def add_z_scale(self, title="Depth"):
         scale_item = ZScaleItem(self.DEFAULT_COLUMN_WIDTH / 2, self.__log_scene.height(), self._min_z, self._max_z)
@@ -242,6 +345,7 @@ class WellLogView(QWidget):
             raise ValueError("Impossible to remove data column : given data"
                              " object doesn't exist")
 
+        self._release_data(data)
         log_item, legend_item = self.__data2logitems[data]
         for i, (pitem, litem) in enumerate(self.__columns):
             if pitem == log_item and litem == legend_item:
@@ -250,12 +354,16 @@ class WellLogView(QWidget):
                 del self.__data2logitems[data]
                 self.__log_scene.removeItem(log_item)
                 self.__log_scene.removeItem(legend_item)
+                self._place_items()
                 return
 
         # Columns not found
         assert False
 
     def clear_data_columns(self):
+        for data in list(self.__data2logitems):
+            self._release_data(data)
+
         # remove item from scenes
         for (item, legend) in self.__columns:
             self.__log_scene.removeItem(legend)
@@ -265,6 +373,7 @@ class WellLogView(QWidget):
         self.__columns = []
         self.__column_widths = []
         self.__data2logitems = {}
+        self.__lazy_columns = {}
         
         self.__selected_column = -1
         self._place_items()
@@ -276,44 +385,137 @@ class WellLogView(QWidget):
         else:
             self.__status_bar.showMessage(txt)
 
+    def on_auto_fit(self, checked):
+        self.__auto_fit = checked
+        for plot_item, _ in self.__data2logitems.values():
+            plot_item.set_auto_fit(checked)
+
+    def _set_fast_rendering(self, fast):
+        """Render plots in fast mode during interactions, in full quality otherwise"""
+        for plot_item, _ in self.__data2logitems.values():
+            plot_item.set_fast_rendering(fast)
+
+    def _set_legend_scale(self, legend_item, min_value, max_value):
+        legend_item.set_scale("{:.1f}".format(min_value), "{:.1f}".format(max_value))
+        legend_item.update()
+
+    def _release_data(self, data):
+        """Disconnect the data from this view and release them (see data_cache.py)"""
+        if data not in self.__data_connections:
+            # already released
+            return
+        for signal, slot in self.__data_connections.pop(data):
+            signal.disconnect(slot)
+        self.__data2logitems[data][0].cancel_rendering()
+        if not data_cache().release(data):
+            # not shared, stop loading data that will never be displayed
+            data.cancel_loading()
+
     def add_data_column(self, data, title, uom, station_name = None):
+        if data in self.__data2logitems:
+            # already displayed, data shared through the cache are the same object
+            data_cache().release(data)
+            return
+
+        plot_item, legend_item = self.__create_data_column(title, uom, station_name)
+        self._add_column(plot_item, legend_item)
+        self.__attach_data(data, plot_item, legend_item)
+
+    def add_lazy_data_column(self, data_factory, title, uom, station_name = None):
+        """Add a data column whose data are only created when the column is first visible
+
+        :param data_factory: function that returns the data (acquired from data_cache()), or None
+        """
+        plot_item, legend_item = self.__create_data_column(title, uom, station_name)
+        self.__lazy_columns[plot_item] = data_factory
+        self._add_column(plot_item, legend_item)
+
+    def __create_data_column(self, title, uom, station_name):
+        """Returns the (plot_item, legend_item) of a new data column"""
         plot_item = PlotItem(size=QSizeF(self.DEFAULT_COLUMN_WIDTH, self.__log_scene.height()),
                              render_type = POLYGON_RENDERER,
                              x_orientation = ORIENTATION_DOWNWARD,
                              y_orientation = ORIENTATION_LEFT_TO_RIGHT)
-
-        plot_item.set_layer(data.get_layer())
         plot_item.tooltipRequested.connect(lambda txt: self.on_plot_tooltip(txt, station_name))
 
         legend_item = LegendItem(self.DEFAULT_COLUMN_WIDTH, title, unit_of_measure=uom)
-        data.data_modified.connect(lambda data=data : self._update_data_column(data))
+        return plot_item, legend_item
+
+    def __load_lazy_column(self, plot_item, legend_item):
+        data = self.__lazy_columns.pop(plot_item)()
+        if data is None or data in self.__data2logitems:
+            # no data, or already displayed by another column
+            if data is not None:
+                data_cache().release(data)
+            self.__remove_column(plot_item, legend_item)
+            return
+        self.__attach_data(data, plot_item, legend_item)
+
+    def __remove_column(self, item, legend):
+        """Remove a column that displays no data"""
+        i = [c[0] for c in self.__columns].index(item)
+        del self.__columns[i]
+        del self.__column_widths[i]
+        self.__log_scene.removeItem(legend)
+        self.__log_scene.removeItem(item)
+        if self.__selected_column == i:
+            self.__selected_column = -1
+        elif self.__selected_column > i:
+            self.__selected_column -= 1
+        self._place_items()
+        self._update_button_visibility()
+
+    def __attach_data(self, data, plot_item, legend_item):
+        """Display data in a column"""
+        plot_item.set_layer(data.get_layer())
+
+        # placeholder while data are loaded in the background
+        if data.is_loading():
+            plot_item.set_loading_progress(0.0)
+
+        plot_item.set_auto_fit(self.__auto_fit)
+        plot_item.valueRangeChanged.connect(lambda min_value, max_value:
+                                            self._set_legend_scale(legend_item, min_value, max_value))
+
+        # data may be shared with other views, connections are removed when the data are released
+        connections = [(data.data_modified, lambda data=data : self._update_data_column(data)),
+                       (data.loading_progress, plot_item.set_loading_progress),
+                       (data.loading_finished, lambda: plot_item.set_loading_progress(None))]
+        for signal, slot in connections:
+            signal.connect(slot)
+        self.__data_connections[data] = connections
 
         self.__data2logitems[data] = (plot_item, legend_item)
-        self._add_column(plot_item, legend_item)
         self._update_data_column(data)
-        self._update_column_depths()
+        if plot_item.isVisible():
+            data.set_x_window(self._min_z, self._max_z)
+            plot_item.set_depth_window(self._min_z, self._max_z)
+            plot_item.update()
 
     def _update_data_column(self, data):
 
         plot_item, legend_item = self.__data2logitems[data]
 
-        y_values = data.get_y_values()
-        x_values = data.get_x_values()
-        if y_values is None or x_values is None:
+        series = data.get_series()
+        if series is None or len(series) == 0:
             plot_item.set_data_window(None)
+            plot_item.update()
             return
 
-        plot_item.set_data(data.get_x_values(), data.get_y_values())
+        plot_item.set_series(series, data.get_y_min(), data.get_y_max())
+        plot_item.set_lod(data.lod_pyramid())
+        # keep the current window, set_series resets it to the data extent
+        if self._min_z is not None:
+            plot_item.set_depth_window(self._min_z, self._max_z)
 
 #        r = QRectF(0, min_y, (max_x-min_x)/delta, max_y)
 #        plot_item.set_data_window(r)
 
-        # legend
-        min_str = "{:.1f}".format(min(data.get_y_values()))
-        max_str = "{:.1f}".format(max(data.get_y_values()))
-        legend_item.set_scale(min_str, max_str)
+        # the legend follows the value axis, see _set_legend_scale
 
-        self.__log_scene.update()
+        # only this column is redrawn
+        plot_item.update()
+        legend_item.update()
 
     def add_stratigraphy(self, layer, column_mapping, title):
         item = StratigraphyItem(self.DEFAULT_COLUMN_WIDTH,
@@ -398,17 +600,24 @@ class WellLogView(QWidget):
             return
 
         sel = self.__selected_column
-
-        # remove item from scenes
         item, legend = self.__columns[sel]
-        self.__log_scene.removeItem(legend)
-        self.__log_scene.removeItem(item)
-
-        # remove from internal list
-        del self.__columns[sel]
-        del self.__column_widths[sel]
         self.__selected_column = -1
-        self._place_items()
+
+        for data, (plot_item, _) in self.__data2logitems.items():
+            if plot_item is item:
+                # data are released
+                self.remove_data_column(data)
+                break
+        else:
+            # remove item from scenes
+            self.__log_scene.removeItem(legend)
+            self.__log_scene.removeItem(item)
+            self.__lazy_columns.pop(item, None)
+
+            # remove from internal list
+            del self.__columns[sel]
+            del self.__column_widths[sel]
+            self._place_items()
         self._update_button_visibility()
 
     def on_edit_style(self):
@@ -61,6 +61,13 @@ if sys.version_info.major == 3:
     QgsDataSourceURI = QgsDataSourceUri
 
     QgsMessageBar.CRITICAL = Qgis.Critical
+    QgsMessageLog.WARNING = Qgis.Warning
+
+    # symbol output units
+    QgsSymbolV2 = QgsSymbol
+    QgsSymbolV2.MM = QgsUnitTypes.RenderMillimeters
+    QgsSymbolV2.MapUnit = QgsUnitTypes.RenderMapUnits
+    QgsSymbolV2.Pixel = QgsUnitTypes.RenderPixels
 
     def qgsCoordinateTransform(src, tgt):
         return QgsCoordinateTransform(src, tgt, QgsProject.instance().transformContext())
@@ -81,5 +88,8 @@ else:
         return QgsCoordinateTransform(src, tgt)
     QgsFeatureRendererV2._load = QgsFeatureRendererV2.load
 
+    # no task manager, data are loaded synchronously
+    QgsTask = None
+
     def qgsAddMapLayer(layer, addToLegend = True):
         QgsMapLayerRegistry.instance().addMapLayers([layer], addToLegend)
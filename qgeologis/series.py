@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Series of (X, Y) values sorted on X.
+
+A SampledSeries stores its X values explicitly, while a RegularSeries stores regularly sampled
+segments as (x_start, x_delta, y_values) and computes X values only when asked for.
+Both give the same interface: index lookups, X values of given indices and window slicing.
+
+NaN Y values are gap markers: lines are not drawn across them.
+"""
+
+import bisect
+import math
+
+import numpy as np
+
+# policies to merge overlapping segments
+# the segment with the highest priority is kept
+OVERLAP_KEEP_FIRST = "keep_first"
+OVERLAP_KEEP_LATEST = "keep_latest"
+# values are averaged, on the sampling of the segment with the highest priority
+OVERLAP_AVERAGE = "average"
+
+OVERLAP_POLICIES = (OVERLAP_KEEP_FIRST, OVERLAP_KEEP_LATEST, OVERLAP_AVERAGE)
+
+# tolerance on the position of a sample, relatively to the sampling interval
+_EPSILON = 1e-9
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+class SampledSeries(object):
+    """Series with explicit X values"""
+
+    def __init__(self, x_values, y_values):
+        """
+        x_values: X values, sorted
+        y_values: Y values, same length as x_values
+        """
+        self.__x_values = np.asarray(x_values, dtype=np.float64)
+        self.__y_values = np.asarray(y_values, dtype=np.float64)
+        if len(self.__x_values) != len(self.__y_values):
+            raise ValueError("X and Y array has different length : "
+                             "{} != {}".format(len(self.__x_values), len(self.__y_values)))
+
+    def __len__(self):
+        return len(self.__y_values)
+
+    def nbytes(self):
+        return self.__x_values.nbytes + self.__y_values.nbytes
+
+    def x_values(self):
+        return self.__x_values
+
+    def y_values(self):
+        return self.__y_values
+
+    def x_at(self, indices):
+        """Returns the X value(s) of the given index or array of indices"""
+        return self.__x_values[indices]
+
+    def x_min(self):
+        return self.__x_values[0] if len(self) > 0 else None
+
+    def x_max(self):
+        return self.__x_values[-1] if len(self) > 0 else None
+
+    def index_left(self, x):
+        """Returns the number of samples with a X value lower than x"""
+        return int(np.searchsorted(self.__x_values, x, side="left"))
+
+    def index_right(self, x):
+        """Returns the number of samples with a X value lower or equal to x"""
+        return int(np.searchsorted(self.__x_values, x, side="right"))
+
+    def window(self, x_min, x_max):
+        """Returns (x_values, y_values) of samples between x_min and x_max,
+        with one more sample on each side, if any"""
+        i_start, i_end = _window_indices(self, x_min, x_max)
+        return self.__x_values[i_start:i_end], self.__y_values[i_start:i_end]
+
+
+class RegularSeries(object):
+    """Series made of regularly sampled segments.
+
+    Only the start and the interval of each segment are stored, X values are computed
+    arithmetically from indices.
+    """
+
+    # names of the arrays returned by arrays()
+    ARRAYS = ("starts", "deltas", "offsets", "y_values")
+
+    def __init__(self, segments):
+        """
+        segments: sequence of (x_start, x_delta, y_values), sorted on X and not overlapping.
+                  x_delta must be positive.
+        """
+        segments = [(x_start, x_delta, y_values) for x_start, x_delta, y_values in segments if len(y_values) > 0]
+        for _, x_delta, _ in segments:
+            if not x_delta > 0:
+                raise ValueError("Invalid interval between X values: {}".format(x_delta))
+        self.__starts = np.array([s[0] for s in segments], dtype=np.float64)
+        self.__deltas = np.array([s[1] for s in segments], dtype=np.float64)
+        # index of the first sample of each segment, plus the total number of samples
+        self.__offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum([len(s[2]) for s in segments], out=self.__offsets[1:])
+        if segments:
+            y_values = np.concatenate([np.asarray(s[2], dtype=np.float64) for s in segments])
+        else:
+            y_values = np.empty(0)
+        self.__y_values = _read_only(y_values)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Build a series from the arrays returned by arrays(), without copying them"""
+        series = cls([])
+        series.__starts = arrays["starts"]
+        series.__deltas = arrays["deltas"]
+        series.__offsets = arrays["offsets"]
+        series.__y_values = arrays["y_values"]
+        return series
+
+    def arrays(self):
+        """Returns the arrays of the series, by name"""
+        return {"starts": self.__starts, "deltas": self.__deltas,
+                "offsets": self.__offsets, "y_values": self.__y_values}
+
+    def __len__(self):
+        return int(self.__offsets[-1])
+
+    def nbytes(self):
+        return self.__starts.nbytes + self.__deltas.nbytes + self.__offsets.nbytes + self.__y_values.nbytes
+
+    def segments(self):
+        """Returns the list of (x_start, x_delta, y_values) segments"""
+        return [(self.__starts[i], self.__deltas[i], self.__y_values[self.__offsets[i]:self.__offsets[i+1]])
+                for i in range(len(self.__starts))]
+
+    def x_values(self):
+        """Returns all the X values. This expands the series and should be avoided on large data"""
+        return self.x_at(np.arange(len(self)))
+
+    def y_values(self):
+        return self.__y_values
+
+    def x_at(self, indices):
+        """Returns the X value(s) of the given index or array of indices"""
+        indices = np.asarray(indices)
+        segment = np.searchsorted(self.__offsets, indices, side="right") - 1
+        return self.__starts[segment] + (indices - self.__offsets[segment]) * self.__deltas[segment]
+
+    def x_min(self):
+        return self.__starts[0] if len(self) > 0 else None
+
+    def x_max(self):
+        return self.x_at(len(self) - 1) if len(self) > 0 else None
+
+    def __segment_of(self, x):
+        """Returns the index of the last segment starting before x, -1 if none"""
+        return int(np.searchsorted(self.__starts, x, side="right")) - 1
+
+    def index_left(self, x):
+        """Returns the number of samples with a X value lower than x"""
+        segment = self.__segment_of(x)
+        if segment < 0:
+            return 0
+        offset, end = self.__offsets[segment], self.__offsets[segment + 1]
+        # first sample of the segment greater or equal to x, X values are computed
+        # with rounding errors and a sample at x may be slightly off
+        i = np.ceil((x - self.__starts[segment]) / self.__deltas[segment] - _EPSILON)
+        return int(min(offset + i, end))
+
+    def index_right(self, x):
+        """Returns the number of samples with a X value lower or equal to x"""
+        segment = self.__segment_of(x)
+        if segment < 0:
+            return 0
+        offset, end = self.__offsets[segment], self.__offsets[segment + 1]
+        # first sample of the segment greater than x, see index_left()
+        i = np.floor((x - self.__starts[segment]) / self.__deltas[segment] + _EPSILON) + 1
+        return int(min(offset + i, end))
+
+    def window(self, x_min, x_max):
+        """Returns (x_values, y_values) of samples between x_min and x_max,
+        with one more sample on each side, if any. Only X values of the window are computed"""
+        i_start, i_end = _window_indices(self, x_min, x_max)
+        return self.x_at(np.arange(i_start, i_end)), self.__y_values[i_start:i_end]
+
+
+def _window_indices(series, x_min, x_max):
+    """Returns the (start, end) indices of the samples between x_min and x_max,
+    extended by one sample on each side"""
+    i_start = max(series.index_left(x_min) - 1, 0)
+    i_end = min(series.index_right(x_max) + 1, len(series))
+    return i_start, max(i_start, i_end)
+
+
+def _runs(mask):
+    """Returns the list of (start, end) indices of the runs of True values of a boolean array"""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+def _merge_pieces(segments, overlap_policy):
+    """Cut segments where they overlap a segment of higher priority, see merge_segments.
+    Returns the sorted list of (x_start, x_delta, y_values) pieces, without gap markers"""
+    # merged pieces, as [x_start, x_delta, x_end, sums, counts]. They are kept sorted and do
+    # not overlap, so that their ends are sorted as well
+    pieces, p_starts, p_ends = [], [], []
+    for x_start, x_delta, y_values in segments:
+        y_values = np.asarray(y_values, dtype=np.float64)
+        n = len(y_values)
+        if n == 0:
+            continue
+        x_end = x_start + x_delta * (n - 1)
+        keep = np.ones(n, dtype=bool)
+        # a piece that falls between two samples splits the segment without removing any sample
+        splits = []
+        # only the pieces overlapping the segment are compared with it
+        lo, hi = bisect.bisect_left(p_ends, x_start), bisect.bisect_right(p_starts, x_end)
+        for piece in pieces[lo:hi]:
+            p_start, p_delta, p_end, p_sums, p_counts = piece
+            # samples covered by the piece are not kept
+            first = min(max(math.ceil((p_start - x_start) / x_delta - _EPSILON), 0), n)
+            last = min(max(math.floor((p_end - x_start) / x_delta + _EPSILON) + 1, 0), n)
+            keep[first:last] = False
+            if first >= last:
+                splits.append(first)
+            if overlap_policy == OVERLAP_AVERAGE:
+                # add values interpolated on the samples of the piece
+                p_x = p_start + p_delta * np.arange(len(p_sums))
+                inside = np.flatnonzero((p_x >= x_start - _EPSILON * x_delta) & (p_x <= x_end + _EPSILON * x_delta))
+                values = np.interp(p_x[inside], x_start + x_delta * np.arange(n), y_values)
+                valid = ~np.isnan(values)
+                p_sums[inside[valid]] += values[valid]
+                p_counts[inside[valid]] += 1
+
+        for first, last in _runs(keep):
+            bounds = [first] + [i for i in splits if first < i < last] + [last]
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                values = y_values[first:last]
+                valid = ~np.isnan(values)
+                start, end = x_start + first * x_delta, x_start + (last - 1) * x_delta
+                i = bisect.bisect_left(p_starts, start)
+                pieces.insert(i, [start, x_delta, end, np.where(valid, values, 0.0), valid.astype(np.int64)])
+                p_starts.insert(i, start)
+                p_ends.insert(i, end)
+
+    merged = []
+    for x_start, x_delta, _, sums, counts in pieces:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            merged.append((x_start, x_delta, np.where(counts > 0, sums / counts, np.nan)))
+    return merged
+
+def _extent(x_start, x_delta, y_values):
+    """Returns the (first, last) X values of a segment, (None, None) if it has no value"""
+    if len(y_values) == 0:
+        return (None, None)
+    return (x_start, x_start + x_delta * (len(y_values) - 1))
+
+def _is_gap(x_start, x_delta, n, next_start, next_delta):
+    """Returns True if a gap marker is needed between a segment of n values and the next one"""
+    return next_start - (x_start + x_delta * (n - 1)) > 1.5 * max(x_delta, next_delta)
+
+def merge_segments(segments, overlap_policy=OVERLAP_KEEP_FIRST):
+    """Merge regularly sampled segments into a sorted list of non overlapping segments,
+    suitable for a RegularSeries.
+
+    segments: sequence of (x_start, x_delta, y_values), by decreasing priority
+    overlap_policy: one of OVERLAP_POLICIES, how values are chosen where segments overlap
+
+    Segments are cut where they overlap a segment of higher priority. A NaN value is appended
+    to a segment followed by a gap, so that lines are not drawn across missing intervals.
+    """
+    if overlap_policy not in OVERLAP_POLICIES:
+        raise ValueError("Unknown overlap policy: {}".format(overlap_policy))
+
+    pieces = _merge_pieces(segments, overlap_policy)
+    merged = []
+    for i, (x_start, x_delta, y_values) in enumerate(pieces):
+        if i + 1 < len(pieces) and _is_gap(x_start, x_delta, len(y_values), pieces[i + 1][0], pieces[i + 1][1]):
+            # gap marker
+            y_values = np.append(y_values, np.nan)
+        merged.append((x_start, x_delta, y_values))
+    return merged
+
+
+class SegmentMerger(object):
+    """Incremental merge_segments.
+
+    Segments are identified by a key that gives their priority. Segments that overlap, directly or
+    through other segments, form clusters that do not interact with each other: when segments are
+    added, replaced or removed, only the clusters they touch are merged again and spliced in the
+    merged values.
+    """
+
+    def __init__(self, overlap_policy=OVERLAP_KEEP_FIRST, reverse=False):
+        """
+        overlap_policy: one of OVERLAP_POLICIES
+        reverse: segments are by decreasing priority in the order of their keys, or in the
+                 reverse order if True
+        """
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError("Unknown overlap policy: {}".format(overlap_policy))
+        self.__overlap_policy = overlap_policy
+        self.__reverse = reverse
+        # key -> (x_start, x_delta, y_values)
+        self.__segments = {}
+        # clusters, sorted and not overlapping: X extents and keys of their segments
+        self.__cluster_starts = []
+        self.__cluster_ends = []
+        self.__cluster_keys = []
+        # merged pieces: X start, interval, number of values and whether a gap marker follows them
+        self.__starts = np.empty(0)
+        self.__deltas = np.empty(0)
+        self.__lengths = np.empty(0, dtype=np.int64)
+        self.__marked = np.empty(0, dtype=bool)
+        self.__y_values = _read_only(np.empty(0))
+        self.__series = None
+
+    def series(self):
+        """Returns the merged segments as a RegularSeries"""
+        if self.__series is None:
+            offsets = np.zeros(len(self.__starts) + 1, dtype=np.int64)
+            np.cumsum(self.__lengths + self.__marked, out=offsets[1:])
+            self.__series = RegularSeries.from_arrays({"starts": self.__starts, "deltas": self.__deltas,
+                                                       "offsets": offsets, "y_values": self.__y_values})
+        return self.__series
+
+    def update(self, segments=(), removed=()):
+        """Add or replace segments and remove others.
+
+        segments: iterable of (key, x_start, x_delta, y_values)
+        removed: keys of the segments to remove
+        Returns the index of the first value of the series that has changed
+        """
+        # X extents that change, with the keys of the segments that now cover them
+        extents = []
+        for key in removed:
+            if key in self.__segments:
+                extents.append(_extent(*self.__segments.pop(key)) + ((),))
+        changed = set(removed)
+        for key, x_start, x_delta, y_values in segments:
+            changed.add(key)
+            if key in self.__segments:
+                extents.append(_extent(*self.__segments[key]) + ((),))
+            self.__segments[key] = (x_start, x_delta, y_values)
+            extents.append(_extent(x_start, x_delta, y_values) + ((key,),))
+        extents = [extent for extent in extents if extent[0] is not None]
+        if not extents:
+            return len(self.series())
+
+        # clusters touched by the changes are removed, to be merged again with them
+        touched = set()
+        for x_start, x_end, _ in extents:
+            touched.update(range(bisect.bisect_left(self.__cluster_ends, x_start),
+                                 bisect.bisect_right(self.__cluster_starts, x_end)))
+        # changed segments are grouped by their new extent
+        extents += [(self.__cluster_starts[c], self.__cluster_ends[c], self.__cluster_keys[c] - changed) for c in touched]
+        for c in sorted(touched, reverse=True):
+            del self.__cluster_starts[c], self.__cluster_ends[c], self.__cluster_keys[c]
+
+        groups = []
+        for x_start, x_end, keys in sorted(extents, key=lambda extent: extent[0]):
+            if groups and x_start <= groups[-1][1]:
+                groups[-1][1] = max(groups[-1][1], x_end)
+                groups[-1][2].update(keys)
+            else:
+                groups.append([x_start, x_end, set(keys)])
+
+        replaced = []
+        for x_start, x_end, keys in groups:
+            keys = sorted(keys, reverse=self.__reverse)
+            if keys:
+                key_extents = [_extent(*self.__segments[key]) for key in keys]
+                c = bisect.bisect_left(self.__cluster_starts, x_start)
+                self.__cluster_starts.insert(c, min(extent[0] for extent in key_extents))
+                self.__cluster_ends.insert(c, max(extent[1] for extent in key_extents))
+                self.__cluster_keys.insert(c, set(keys))
+            # pieces of the previous state of the group are within its extent
+            replaced.append((int(np.searchsorted(self.__starts, x_start, side="left")),
+                             int(np.searchsorted(self.__starts, x_end, side="right")),
+                             _merge_pieces([self.__segments[key] for key in keys], self.__overlap_policy)))
+        return self.__splice(replaced)
+
+    def __splice(self, replaced):
+        """Replace ranges of pieces by new ones, gap markers are updated around them.
+
+        replaced: sorted list of (first piece, end piece, new pieces)
+        Returns the index of the first value that has changed
+        """
+        offsets = np.zeros(len(self.__starts) + 1, dtype=np.int64)
+        np.cumsum(self.__lengths + self.__marked, out=offsets[1:])
+
+        # the gap marker of the piece before a range depends on the first piece of the range,
+        # this piece is replaced as well. Ranges that touch are joined
+        ranges = []
+        for first, end, pieces in replaced:
+            pieces = list(pieces)
+            if first > 0 and not (ranges and first == ranges[-1][1]):
+                first -= 1
+                n = int(self.__lengths[first])
+                pieces.insert(0, (self.__starts[first], self.__deltas[first],
+                                  self.__y_values[offsets[first]:offsets[first] + n]))
+            if ranges and first == ranges[-1][1]:
+                ranges[-1][1] = end
+                ranges[-1][2].extend(pieces)
+            else:
+                ranges.append([first, end, pieces])
+
+        starts, deltas, lengths, marked, y_values = [], [], [], [], []
+        def keep(first, end):
+            starts.append(self.__starts[first:end])
+            deltas.append(self.__deltas[first:end])
+            lengths.append(self.__lengths[first:end])
+            marked.append(self.__marked[first:end])
+            y_values.append(self.__y_values[offsets[first]:offsets[end]])
+
+        kept = 0
+        for first, end, pieces in ranges:
+            keep(kept, first)
+            kept = end
+            # pieces after the range are not modified
+            pieces = pieces + [(self.__starts[end], self.__deltas[end], None)] if end < len(self.__starts) else pieces
+            for (x_start, x_delta, values), (next_start, next_delta, _) in zip(pieces, pieces[1:] + [(None, None, None)]):
+                if values is None:
+                    break
+                gap = next_start is not None and _is_gap(x_start, x_delta, len(values), next_start, next_delta)
+                starts.append([x_start])
+                deltas.append([x_delta])
+                lengths.append([len(values)])
+                marked.append([gap])
+                y_values.append(values)
+                if gap:
+                    y_values.append([np.nan])
+        keep(kept, len(self.__starts))
+
+        # values of the piece before the first range are not modified
+        first = ranges[0][0]
+        first_change = int(offsets[first] + self.__lengths[first]) if replaced[0][0] > 0 else 0
+
+        self.__starts = np.concatenate(starts).astype(np.float64)
+        self.__deltas = np.concatenate(deltas).astype(np.float64)
+        self.__lengths = np.concatenate(lengths).astype(np.int64)
+        self.__marked = np.concatenate(marked).astype(bool)
+        self.__y_values = _read_only(np.concatenate(y_values).astype(np.float64))
+        self.__series = None
+        return first_change
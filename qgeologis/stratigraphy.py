@@ -25,12 +25,61 @@ from qgis.PyQt.QtXml import QDomDocument
 from .qt_qgis_compat import QgsFeatureRendererV2, QgsRectangle, QgsField, QgsFields, QgsGeometry
 from .qt_qgis_compat import QgsFeature
 
-from .common import LogItem, POLYGON_RENDERER, qgis_render_context
+from .common import LogItem, POLYGON_RENDERER, RenderSession
 
+import numpy as np
 import os
 
+def load_stratigraphy_renderer(style_file=None):
+    """Returns the renderer of stratigraphy columns, from a style file, or a default one"""
+    # change current directory, so that relative paths to SVG get correctly resolved
+    os.chdir(os.path.dirname(__file__))
+
+    if style_file:
+        doc = QDomDocument()
+        doc.setContent(open(style_file, "r").read())
+        return QgsFeatureRendererV2._load(doc.documentElement())
+    return QgsFeatureRendererV2.defaultRenderer(POLYGON_RENDERER)
+
+class _IntervalIndex(object):
+    """Depth intervals sorted by their top, to find the ones that overlap a depth range
+    by bisection"""
+
+    def __init__(self, depth_from, depth_to):
+        """
+        depth_from, depth_to: depths of the intervals, sorted on depth_from
+        """
+        self.depth_from = np.asarray(depth_from, dtype=float)
+        self.depth_to = np.asarray(depth_to, dtype=float)
+        # deepest bottom of the intervals up to each one, non decreasing even when intervals are nested
+        self.__max_depth_to = np.maximum.accumulate(self.depth_to) if len(self.depth_to) else self.depth_to
+
+    def __len__(self):
+        return len(self.depth_from)
+
+    def overlapping(self, min_z, max_z):
+        """Returns the sorted indices of the intervals that overlap [min_z, max_z]"""
+        # intervals before start end above min_z, intervals from end start below max_z
+        start = np.searchsorted(self.__max_depth_to, min_z, side="left")
+        end = np.searchsorted(self.depth_from, max_z, side="right")
+        indices = np.arange(start, max(start, end))
+        return indices[self.depth_to[indices] >= min_z]
+
+    def containing(self, z):
+        """Returns the index of the first interval that strictly contains z, None if there is none"""
+        start = np.searchsorted(self.__max_depth_to, z, side="right")
+        end = np.searchsorted(self.depth_from, z, side="left")
+        for i in range(start, end):
+            if self.depth_to[i] > z:
+                return i
+        return None
+
 class StratigraphyItem(LogItem):
-    def __init__(self, width, height, style_file=None, parent=None):
+    def __init__(self, width, height, style_file=None, parent=None, renderer=None, render_session=None):
+        """
+        renderer: renderer to use instead of the one of style_file, may be shared by several items
+        render_session: RenderSession of the renderer, to share prepared symbols between items
+        """
         LogItem.__init__(self, parent)
 
         self.__width = width
@@ -38,18 +87,25 @@ class StratigraphyItem(LogItem):
         self.__min_z = 0
         self.__max_z = 100
 
+        # intervals sorted on depth_from, and their _IntervalIndex
         self.__data = None
+        self.__index = None
+        # feature of each interval, created when first drawn
+        self.__features = []
+        # (font key, formation code) -> width of the label
+        self.__label_widths = {}
+        # (key, list of intervals drawn) of the displayed depths, see __interval_layout
+        self.__layout = None
         self.__layer = None
 
-        # change current directory, so that relative paths to SVG get correctly resolved
-        os.chdir(os.path.dirname(__file__))
+        self.__fields = QgsFields()
+        self.__fields.append(QgsField("formation_code", QVariant.String))
+        self.__fields.append(QgsField("rock_code", QVariant.String))
 
-        if style_file:
-            doc = QDomDocument()
-            doc.setContent(open(style_file, "r").read())
-            self.__renderer = QgsFeatureRendererV2._load(doc.documentElement())
-        else:
-            self.__renderer = QgsFeatureRendererV2.defaultRenderer(POLYGON_RENDERER)
+        self.__renderer = renderer if renderer is not None else load_stratigraphy_renderer(style_file)
+
+        # the renderer stays started between paints
+        self.__render_session = render_session if render_session is not None else RenderSession()
 
     def boundingRect(self):
         return QRectF(0, 0, self.__width, self.__height)
@@ -70,67 +126,111 @@ class StratigraphyItem(LogItem):
         self.__height = height
 
     def set_data(self, data):
-        self.__data = data
+        """
+        data: list of (depth_from, depth_to, formation_code, rock_code, formation_description, rock_description)
+        """
+        rows = [d for d in data if d[0] is not None and d[1] is not None]
+        rows.sort(key=lambda d: d[0])
+        self.__data = rows
+        self.__index = _IntervalIndex([d[0] for d in rows], [d[1] for d in rows])
+        self.__features = [None] * len(rows)
+        self.__label_widths = {}
+        self.__layout = None
 
     def layer(self):
         return self.__layer
     def set_layer(self, layer):
         self.__layer = layer
 
+    def __feature(self, i):
+        """Returns the feature of an interval, its geometry is set by the caller"""
+        feature = self.__features[i]
+        if feature is None:
+            _, _, formation_code, rock_code, _, _ = self.__data[i]
+            feature = QgsFeature(self.__fields, i)
+            feature["formation_code"] = formation_code
+            feature["rock_code"] = rock_code
+            self.__features[i] = feature
+        return feature
+
+    def __label_width(self, painter, formation_code):
+        """Returns the width of a label, measured once per font"""
+        key = (painter.font().key(), formation_code)
+        width = self.__label_widths.get(key)
+        if width is None:
+            width = painter.fontMetrics().width(formation_code)
+            self.__label_widths[key] = width
+        return width
+
+    def __interval_layout(self, painter):
+        """Returns the list of (index, y1, y2, geometry, label position or None) of the intervals
+        that overlap the displayed depths. It is kept until the depths or the size change"""
+        key = (self.__min_z, self.__max_z, self.__width, self.__height, painter.font().key())
+        if self.__layout is not None and self.__layout[0] == key:
+            return self.__layout[1]
+
+        fm = painter.fontMetrics()
+        scale = self.__height / (self.__max_z - self.__min_z)
+        layout = []
+        for i in self.__index.overlapping(self.__min_z, self.__max_z):
+            depth_from, depth_to, formation_code, _, _, _ = self.__data[i]
+            y1 = (depth_from - self.__min_z) * scale
+            y2 = (depth_to - self.__min_z) * scale
+
+            # legend text
+            label = None
+            if formation_code:
+                w = self.__label_width(painter, formation_code)
+                x = (self.__width/2 - w) / 2 + self.__width/2
+                y = (y1+y2)/2
+                if y - fm.ascent() > y1 and y + fm.descent() < y2:
+                    label = (x, y)
+            #'~/.qgis2/python/plugins/thyrsis/styles/usgs' || rock_code || '.svg'
+            # polygon
+            geom = QgsGeometry.fromQPolygonF(QPolygonF(QRectF(0, self.__height-y1, self.__width/2, y1-y2)))
+            layout.append((i, y1, y2, geom, label))
+
+        self.__layout = (key, layout)
+        return layout
+
     def paint(self, painter, option, widget):
         self.draw_background(painter)
 
         painter.setClipRect(0, 0, self.__width-1, self.__height-1)
 
-        context = qgis_render_context(painter, self.__width, self.__height)
-        context.setExtent(QgsRectangle(0, 0, self.__width, self.__height))
-        fields = QgsFields()
-        fields.append(QgsField("formation_code", QVariant.String))
-        fields.append(QgsField("rock_code", QVariant.String))
-        self.__renderer.startRender(context, fields)
-
-        for i, d in enumerate(self.__data):
-            depth_from, depth_to, formation_code, rock_code, _, _ = d
+        if self.__data is None or self.__max_z == self.__min_z:
+            return
 
-            y1 = (depth_from - self.__min_z) / (self.__max_z - self.__min_z) * self.__height
-            y2 = (depth_to - self.__min_z) / (self.__max_z - self.__min_z) * self.__height
+        context = self.__render_session.context(painter, self.__renderer, self.__fields, self.__width, self.__height)
+        context.setExtent(QgsRectangle(0, 0, self.__width, self.__height))
 
+        # only the intervals that overlap the displayed depths are drawn
+        for i, y1, y2, geom, label in self.__interval_layout(painter):
             painter.setPen(QPen())
             painter.setBrush(QBrush())
             if i == 0:
                 painter.drawLine(0, y1, self.__width-1, y1)
             painter.drawLine(0, y2, self.__width-1, y2)
 
-            # legend text
-            if formation_code:
-                fm = painter.fontMetrics()
-                w = fm.width(formation_code)
-                x = (self.__width/2 - w) / 2 + self.__width/2
-                y = (y1+y2)/2
-                if y - fm.ascent() > y1 and y + fm.descent() < y2:
-                    painter.drawText(x, y, formation_code)
-            #'~/.qgis2/python/plugins/thyrsis/styles/usgs' || rock_code || '.svg'
-            # polygon
-            geom = QgsGeometry.fromQPolygonF(QPolygonF(QRectF(0, self.__height-y1, self.__width/2, y1-y2)))
+            if label is not None:
+                painter.drawText(label[0], label[1], self.__data[i][2])
 
-            feature = QgsFeature(fields, 1)
-            feature["formation_code"] = formation_code
-            feature["rock_code"] = rock_code
+            feature = self.__feature(i)
             feature.setGeometry(geom)
-
             self.__renderer.renderFeature(feature, context)
 
-        self.__renderer.stopRender(context)
-
     def mouseMoveEvent(self, event):
+        if self.__data is None:
+            return
         z = (event.scenePos().y() - self.pos().y()) / self.height() * (self.__max_z - self.__min_z) + self.__min_z
-        for d in self.__data:
-            depth_from, depth_to, _, _, formation_description, rock_description = d
-            if z > depth_from and z < depth_to:
-                self.tooltipRequested.emit(u"Formation: {} Rock: {}".format(formation_description, rock_description))
-                break
+        i = self.__index.containing(z)
+        if i is not None:
+            _, _, _, _, formation_description, rock_description = self.__data[i]
+            self.tooltipRequested.emit(u"Formation: {} Rock: {}".format(formation_description, rock_description))
 
     def edit_style(self):
+        # the renderer may be edited in place by the dialog
+        self.__render_session.reset()
         dlg = StratigraphyStyleDialog(self.__layer, self.__renderer)
         if dlg.exec_() == QDialog.Accepted:
             self.__renderer = dlg.renderer().clone()
@@ -226,3 +326,24 @@ class StratigraphyStyleDialog(QDialog):
         self.__renderer = self.__sw.currentWidget().renderer().clone()
         self.update()
         return QDialog.accept(self)
+
+if __name__ == '__main__':
+    # python -m qgeologis.stratigraphy
+    import timeit
+
+    # detailed log: 20000 intervals of 10 cm, a window of 20 m
+    n = 20000
+    depth_from = np.arange(n) * 0.1
+    depth_to = depth_from + 0.1
+    index = _IntervalIndex(depth_from, depth_to)
+    min_z, max_z = 1000.0, 1020.0
+
+    def linear_scan():
+        return [i for i in range(n) if depth_from[i] <= max_z and depth_to[i] >= min_z]
+
+    def bisection():
+        return index.overlapping(min_z, max_z)
+
+    assert list(bisection()) == linear_scan()
+    for f in (linear_scan, bisection):
+        print("{}: {:.3f} ms per paint".format(f.__name__, timeit.timeit(f, number=20) / 20 * 1000))
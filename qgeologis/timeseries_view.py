@@ -21,10 +21,11 @@ from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QGraphicsView, QGraphicsScene, QWidget, QToolBar, QAction, QLabel, QVBoxLayout
 from qgis.PyQt.QtWidgets import QStatusBar
 
-from .common import POINT_RENDERER, ORIENTATION_UPWARD, ORIENTATION_LEFT_TO_RIGHT
+from .common import POINT_RENDERER, ORIENTATION_UPWARD, ORIENTATION_LEFT_TO_RIGHT, InteractionLoop, GridScene
 from .log_plot import PlotItem
 from .time_scale import TimeScaleItem
 from .legend_item import LegendItem
+from .data_cache import data_cache
 
 import os
 
@@ -39,6 +40,11 @@ class TimeSeriesGraphicsView(QGraphicsView):
 
         self.setMouseTracking(True)
 
+        # pan and zoom are applied at most once per frame
+        self.__interaction = InteractionLoop(lambda: self.parentWidget()._update_row_depths(),
+                                             lambda fast: self.parentWidget()._set_fast_rendering(fast),
+                                             self)
+
     def resizeEvent(self, event):
         QGraphicsView.resizeEvent(self, event)
         # by default, the rect is centered on 0,0,
@@ -59,7 +65,7 @@ class TimeSeriesGraphicsView(QGraphicsView):
         dx = event.x() / self.scene().sceneRect().width() * (w - nw)
         self.parentWidget()._min_x += dx
         self.parentWidget()._max_x = self.parentWidget()._min_x + nw
-        self.parentWidget()._update_row_depths()
+        self.__interaction.request_update()
 
     def mouseMoveEvent(self, event):
         if not self.__allow_mouse_translation:
@@ -70,7 +76,7 @@ class TimeSeriesGraphicsView(QGraphicsView):
             delta_x = delta.x() / self.scene().sceneRect().width() * (self.parentWidget()._max_x - self.parentWidget()._min_x)
             self.parentWidget()._min_x = self.__translation_min_x + delta_x
             self.parentWidget()._max_x = self.__translation_max_x + delta_x
-            self.parentWidget()._update_row_depths()
+            self.__interaction.request_update()
         return QGraphicsView.mouseMoveEvent(self, event)
 
     def mousePressEvent(self, event):
@@ -88,18 +94,10 @@ class TimeSeriesGraphicsView(QGraphicsView):
 
         return QGraphicsView.mouseReleaseEvent(self, event)
 
-class MyScene(QGraphicsScene):
+class MyScene(GridScene):
     def __init__(self, x, y, w, h):
-        QGraphicsScene.__init__(self, x, y, w, h)
-
-    def mouseMoveEvent(self, event):
-        # pass the event to the underlying item
-        for item in list(self.items()):
-            r = item.boundingRect()
-            r.translate(item.pos())
-            if r.contains(event.scenePos()):
-                return item.mouseMoveEvent(event)
-        return QGraphicsScene.mouseMoveEvent(self, event)
+        # rows
+        GridScene.__init__(self, x, y, w, h, False)
 
 class TimeSeriesView(QWidget):
 
@@ -132,11 +130,17 @@ class TimeSeriesView(QWidget):
         self.__action_remove_row = QAction(QIcon(os.path.join(image_dir, "remove.svg")), "Remove the row", self.__toolbar)
         self.__action_remove_row.triggered.connect(self.on_remove_row)
 
+        self.__action_auto_fit = QAction("Fit values", self.__toolbar)
+        self.__action_auto_fit.setToolTip("Fit the value axes to the displayed time range")
+        self.__action_auto_fit.setCheckable(True)
+        self.__action_auto_fit.toggled.connect(self.on_auto_fit)
+
         self.__toolbar.addAction(self.__action_move_row_up)
         self.__toolbar.addAction(self.__action_move_row_down)
         self.__toolbar.addAction(self.__action_edit_style)
         self.__toolbar.addAction(self.__action_add_row)
         self.__toolbar.addAction(self.__action_remove_row)
+        self.__toolbar.addAction(self.__action_auto_fit)
 
         self.__title_label = QLabel()
         if title is not None:
@@ -156,6 +160,10 @@ class TimeSeriesView(QWidget):
         self.__rows = []
         # { layer : (log_item, legend_item) }
         self.__data2logitems = {}
+        # data -> list of (signal, slot) connected by this view
+        self.__data_connections = {}
+        # value axes fitted to the displayed X range
+        self.__auto_fit = False
         self.__row_heights = []
 
         self._min_x = None
@@ -175,27 +183,36 @@ class TimeSeriesView(QWidget):
         for item, _ in self.__rows:
             item.set_width(rect.width())
 
+    def closeEvent(self, event):
+        # release data, their loading is stopped if no other view displays them
+        for data in list(self.__data2logitems):
+            self._release_data(data)
+        QWidget.closeEvent(self, event)
+
     def set_title(self, title):
         self.__title_label.setText(title)
 
     def _place_items(self):
         y = 0
+        offsets = []
         for i, r in enumerate(self.__rows):
             item, legend = r
             height = self.__row_heights[i]
             legend.setPos(0, y)
             item.setPos(legend.boundingRect().width(), y)
+            offsets.append(y)
             y += height
+        self.__scene.set_cells(offsets, self.__rows)
         self.__view.setMinimumSize(self.__view.minimumSize().width(), y)
 
-    def _add_row(self, log_item, legend_item):
+    def _add_row(self, log_item, legend_item, index=0):
         self.__scene.addItem(log_item)
         self.__scene.addItem(legend_item)
 
-        log_item.set_min_depth(self._min_x)
-        log_item.set_max_depth(self._max_x)
-        self.__rows.insert(0, (log_item, legend_item))
-        self.__row_heights.insert(0, log_item.boundingRect().height())
+        if self._min_x is not None:
+            log_item.set_depth_window(self._min_x, self._max_x)
+        self.__rows.insert(index, (log_item, legend_item))
+        self.__row_heights.insert(index, log_item.boundingRect().height())
 
         self._place_items()
 
@@ -208,11 +225,43 @@ class TimeSeriesView(QWidget):
             self._max_x += 60
 
     def _update_row_depths(self):
+        if self._min_x is None:
+            return
+        for data in self.__data2logitems:
+            data.set_x_window(self._min_x, self._max_x)
         for item, _ in self.__rows:
-            item.set_min_depth(self._min_x)
-            item.set_max_depth(self._max_x)
+            item.set_depth_window(self._min_x, self._max_x)
             item.update()
 
+    def set_time_window(self, min_x, max_x):
+        """Display the times between min_x and max_x"""
+        self._min_x = min_x
+        self._max_x = max_x
+        self._update_row_depths()
+
+    def rows_height(self):
+        """Total height of the rows"""
+        return sum(self.__row_heights)
+
+    def render_rows(self, painter, width, target=QRectF()):
+        """Render all the rows on a painter, e.g. for an export, with a scene of the given width.
+        Curves are rendered synchronously.
+
+        :param target: rectangle of the painter where the rows are drawn, the whole device by default
+        :returns: the rendered rectangle of the scene
+        """
+        source = QRectF(0, 0, width, self.rows_height())
+        self.__scene.setSceneRect(source)
+        plot_items = [item for item, _ in self.__rows if isinstance(item, PlotItem) and item.async_rendering()]
+        for item in plot_items:
+            item.set_async_rendering(False)
+        try:
+            self.__scene.render(painter, target, source)
+        finally:
+            for item in plot_items:
+                item.set_async_rendering(True)
+        return source
+
     def remove_data_row(self, data):
         """Remove data row from widget
 
@@ -224,14 +273,16 @@ class TimeSeriesView(QWidget):
             raise ValueError("Impossible to remove data row : given data"
                              " object doesn't exist")
 
+        self._release_data(data)
         log_item, legend_item = self.__data2logitems[data]
         for i, (pitem, litem) in enumerate(self.__rows):
             if pitem == log_item and litem == legend_item:
                 self.__rows.pop(i)
-                self.__row_widths.pop(i)
+                self.__row_heights.pop(i)
                 del self.__data2logitems[data]
                 self.__scene.removeItem(log_item)
                 self.__scene.removeItem(legend_item)
+                self._place_items()
                 return
 
         # Rows not found
@@ -243,7 +294,38 @@ class TimeSeriesView(QWidget):
         else:
             self.__status_bar.showMessage(txt)
 
+    def on_auto_fit(self, checked):
+        self.__auto_fit = checked
+        for plot_item, _ in self.__data2logitems.values():
+            plot_item.set_auto_fit(checked)
+
+    def _set_fast_rendering(self, fast):
+        """Render plots in fast mode during interactions, in full quality otherwise"""
+        for plot_item, _ in self.__data2logitems.values():
+            plot_item.set_fast_rendering(fast)
+
+    def _set_legend_scale(self, legend_item, min_value, max_value):
+        legend_item.set_scale(min_value, max_value)
+        legend_item.update()
+
+    def _release_data(self, data):
+        """Disconnect the data from this view and release them (see data_cache.py)"""
+        if data not in self.__data_connections:
+            # already released
+            return
+        for signal, slot in self.__data_connections.pop(data):
+            signal.disconnect(slot)
+        self.__data2logitems[data][0].cancel_rendering()
+        if not data_cache().release(data):
+            # not shared, stop loading data that will never be displayed
+            data.cancel_loading()
+
     def add_data_row(self, data, title, uom, station_name = None):
+        if data in self.__data2logitems:
+            # already displayed, data shared through the cache are the same object
+            data_cache().release(data)
+            return
+
         plot_item = PlotItem(size=QSizeF(self.__scene.width(), self.DEFAULT_ROW_HEIGHT),
                              render_type = POINT_RENDERER,
                              x_orientation = ORIENTATION_LEFT_TO_RIGHT,
@@ -253,15 +335,22 @@ class TimeSeriesView(QWidget):
         plot_item.tooltipRequested.connect(lambda txt:self.on_plot_tooltip(station_name, txt))
 
         legend_item = LegendItem(self.DEFAULT_ROW_HEIGHT, title, unit_of_measure=uom, is_vertical=True)
-        data.data_modified.connect(lambda data=data : self._update_data_row(data))
 
-        if self._min_x is None:
-            self._min_x, self._max_x = data.get_x_min(), data.get_x_max()
-            # if we have only one value, center it on a 2 minutes range
-            if self._min_x == self._max_x:
-                self._min_x -= 60
-                self._max_x += 60
-            self.add_time_scale()
+        # placeholder while data are loaded in the background
+        if data.is_loading():
+            plot_item.set_loading_progress(0.0)
+
+        plot_item.set_auto_fit(self.__auto_fit)
+        plot_item.valueRangeChanged.connect(lambda min_value, max_value:
+                                            self._set_legend_scale(legend_item, min_value, max_value))
+
+        # data may be shared with other views, connections are removed when the data are released
+        connections = [(data.data_modified, lambda data=data : self._update_data_row(data)),
+                       (data.loading_progress, plot_item.set_loading_progress),
+                       (data.loading_finished, lambda: plot_item.set_loading_progress(None))]
+        for signal, slot in connections:
+            signal.connect(slot)
+        self.__data_connections[data] = connections
 
         self.__data2logitems[data] = (plot_item, legend_item)
         self._add_row(plot_item, legend_item)
@@ -271,27 +360,45 @@ class TimeSeriesView(QWidget):
     def add_time_scale(self, title="Time"):
         scale_item = TimeScaleItem(self.__scene.width(), self.DEFAULT_ROW_HEIGHT * 3 / 4, self._min_x, self._max_x)
         legend_item = LegendItem(self.DEFAULT_ROW_HEIGHT * 3 / 4, title, is_vertical = True)
-        self._add_row(scale_item, legend_item)
+        # the time scale stays below the data rows
+        self._add_row(scale_item, legend_item, len(self.__rows))
+
+    def _init_time_window(self, data):
+        """Initialize the time window on the extent of the first data available"""
+        self._min_x, self._max_x = data.get_x_min(), data.get_x_max()
+        # if we have only one value, center it on a 2 minutes range
+        if self._min_x == self._max_x:
+            self._min_x -= 60
+            self._max_x += 60
+        self.add_time_scale()
 
     def _update_data_row(self, data):
 
         plot_item, legend_item = self.__data2logitems[data]
 
-        y_values = data.get_y_values()
-        x_values = data.get_x_values()
-        if y_values is None or x_values is None:
+        if self._min_x is None and data.get_x_min() is not None:
+            self._init_time_window(data)
+
+        series = data.get_series()
+        if series is None or len(series) == 0:
             plot_item.set_data_window(None)
+            plot_item.update()
             return
 
-        plot_item.set_data(data.get_x_values(), data.get_y_values())
+        plot_item.set_series(series, data.get_y_min(), data.get_y_max())
+        plot_item.set_lod(data.lod_pyramid())
+        # keep the current window, set_series resets it to the data extent
+        if self._min_x is not None:
+            plot_item.set_depth_window(self._min_x, self._max_x)
 
         #r = QRectF(0, min_y, (max_x-min_x)/delta, max_y)
         #plot_item.set_data_window(r)
 
-        # legend
-        legend_item.set_scale(data.get_y_min(), data.get_y_max())
+        # the legend follows the value axis, see _set_legend_scale
 
-        self.__scene.update()
+        # only this row is redrawn
+        plot_item.update()
+        legend_item.update()
 
     def select_row_at(self, pos):
         y = pos.y()
@@ -349,17 +456,23 @@ class TimeSeriesView(QWidget):
             return
 
         sel = self.__selected_row
-
-        # remove item from scenes
         item, legend = self.__rows[sel]
-        self.__scene.removeItem(legend)
-        self.__scene.removeItem(item)
-
-        # remove from internal list
-        del self.__rows[sel]
-        del self.__row_heights[sel]
         self.__selected_row = -1
-        self._place_items()
+
+        for data, (plot_item, _) in self.__data2logitems.items():
+            if plot_item is item:
+                # data are released
+                self.remove_data_row(data)
+                break
+        else:
+            # remove item from scenes
+            self.__scene.removeItem(legend)
+            self.__scene.removeItem(item)
+
+            # remove from internal list
+            del self.__rows[sel]
+            del self.__row_heights[sel]
+            self._place_items()
         self._update_button_visibility()
 
     def on_edit_style(self):
@@ -20,7 +20,11 @@ from .qgeologis.qt_qgis_compat import QgsMessageBar, QgsFeatureRequest, QgsVecto
 
 from .qgeologis.log_view import WellLogView
 from .qgeologis.timeseries_view import TimeSeriesView
-from .qgeologis.data_interface import FeatureData, LayerData
+from .qgeologis.correlation_view import CorrelationView
+from .qgeologis.data_interface import FeatureData, LayerData, WindowedLayerData, read_station_segments
+from .qgeologis.series import OVERLAP_KEEP_FIRST
+from .qgeologis.data_cache import data_cache
+from .qgeologis.disk_cache import disk_cache
 
 from qgis.PyQt.QtCore import Qt, pyqtSignal, QSettings
 from qgis.PyQt.QtWidgets import QAction, QDialog, QVBoxLayout, QDialogButtonBox, QAbstractItemView
@@ -158,10 +162,7 @@ class DataSelector(QDialog):
             cfg = item.data(Qt.UserRole)
             if cfg["type"] in ("continuous", "instantaneous"):
                 uri, provider = cfg["source"]
-                data_l = QgsVectorLayer(uri, "data_layer", provider)
-                req = QgsFeatureRequest()
                 filter_expr = "{}={}".format(cfg["feature_ref_column"], self.__feature_id)
-                req.setFilterExpression(filter_expr)
                 print("Layer", uri, "Filter", filter_expr)
 
                 title = cfg["name"]
@@ -172,22 +173,28 @@ class DataSelector(QDialog):
                         title = cfg["filter_value"]
                     else:
                         title = cfg["name"]
-
-                    f = None
-                    for f in data_l.getFeatures(req):
-                        pass
-                    if f is None:
+                    columns = ("instantaneous", cfg["event_column"], cfg["value_column"])
+                    if cfg.get("windowed"):
+                        # only the displayed window is loaded, data are not shared
+                        data = self.__create_data(cfg, filter_expr)
+                    else:
+                        data = data_cache().acquire((uri, provider, filter_expr, columns),
+                                                    lambda: self.__create_data(cfg, filter_expr))
+                    if data is None:
                         return
-                    uom = cfg["uom"] if "uom" in cfg else "@" + cfg["uom_column"]
-                    data = LayerData(data_l, cfg["event_column"], cfg["value_column"], filter_expression=filter_expr, uom=uom)
                     uom = data.uom()
 
                 if cfg["type"] == "continuous":
                     uom = cfg["uom"]
-                    fids = [f.id() for f in data_l.getFeatures(req)]
-                    data = FeatureData(data_l, cfg["values_column"], feature_ids=fids,
-                                       x_start_fieldname=cfg["start_measure_column"],
-                                       x_delta_fieldname=cfg["interval_column"])
+                    columns = ("continuous", cfg["values_column"], cfg["start_measure_column"], cfg["interval_column"],
+                               cfg.get("overlap_policy", OVERLAP_KEEP_FIRST))
+                    data_factory = lambda key=(uri, provider, filter_expr, columns), cfg=cfg, filter_expr=filter_expr: \
+                        data_cache().acquire(key, lambda: self.__create_data(cfg, filter_expr))
+                    if hasattr(self.__viewer, "add_lazy_data_column"):
+                        # data are only loaded once the column is visible
+                        self.__viewer.add_lazy_data_column(data_factory, title, uom, station_name = self.__feature_name)
+                        continue
+                    data = data_factory()
 
                 if hasattr(self.__viewer, "add_data_column"):
                     self.__viewer.add_data_column(data, title, uom, station_name = self.__feature_name)
@@ -198,6 +205,37 @@ class DataSelector(QDialog):
 
         QDialog.accept(self)
 
+    def __create_data(self, cfg, filter_expr):
+        """Returns a new DataInterface for the given configuration, None if there is no feature"""
+        uri, provider = cfg["source"]
+        data_l = QgsVectorLayer(uri, "data_layer", provider)
+        req = QgsFeatureRequest()
+        req.setFilterExpression("{}={}".format(cfg["feature_ref_column"], self.__feature_id))
+        # data are read later, only feature ids are needed here
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes([])
+
+        if cfg["type"] == "instantaneous":
+            # only check there is at least one feature
+            check_req = QgsFeatureRequest(req)
+            check_req.setLimit(1)
+            if len(list(data_l.getFeatures(check_req))) == 0:
+                return None
+            uom = cfg["uom"] if "uom" in cfg else "@" + cfg["uom_column"]
+            if cfg.get("windowed"):
+                return WindowedLayerData(data_l, cfg["event_column"], cfg["value_column"], filter_expression=filter_expr, uom=uom)
+            return LayerData(data_l, cfg["event_column"], cfg["value_column"], filter_expression=filter_expr, uom=uom,
+                             load_async=True, disk_cache=disk_cache())
+
+        fids = [f.id() for f in data_l.getFeatures(req)]
+        return FeatureData(data_l, cfg["values_column"], feature_ids=fids,
+                           x_start_fieldname=cfg["start_measure_column"],
+                           x_delta_fieldname=cfg["interval_column"],
+                           load_async=True,
+                           overlap_policy=cfg.get("overlap_policy", OVERLAP_KEEP_FIRST),
+                           filter_expression=filter_expr,
+                           disk_cache=disk_cache())
+
     def on_selection_changed(self):
         self.__sub_selection_combo.clear()
         self.__sub_selection_combo.setEnabled(False)
@@ -329,6 +367,93 @@ class TimeSeriesWrapper(TimeSeriesView):
         s = DataSelector(self, self.__feature.id(), self.__feature[self.__config["name_column"]], self.__config["timeseries"], self.__config)
         s.exec_()
 
+class CorrelationViewWrapper(CorrelationView):
+    def __init__(self, config, features):
+        CorrelationView.__init__(self, ", ".join(str(f[config["name_column"]]) for f in features))
+        self.setWindowTitle("Well correlation viewer")
+        self.__config = config
+        self.__features = features
+
+        # stratigraphy of all the wells, read in one request
+        cfg = config["stratigraphy_config"]
+        uri, provider = cfg["source"]
+        l = QgsVectorLayer(uri, "layer", provider)
+        l.setSubsetString(self.__ids_filter(cfg["feature_ref_column"]))
+        columns = (cfg["depth_from_column"],
+                   cfg["depth_to_column"],
+                   cfg["formation_code_column"],
+                   cfg["rock_code_column"],
+                   cfg.get("formation_description_column"),
+                   cfg.get("rock_description_column"))
+        rows = {}
+        for f in l.getFeatures():
+            rows.setdefault(f[cfg["feature_ref_column"]], []).append([f[c] if c is not None else None for c in columns])
+
+        elevation_column = config.get("elevation_column")
+        for feature in features:
+            self.add_well(feature.id(), feature[config["name_column"]],
+                          rows.get(feature.id(), []),
+                          feature[elevation_column] if elevation_column else None)
+
+    def __ids_filter(self, ref_column):
+        return "{} IN ({})".format(ref_column, ",".join(str(f.id()) for f in self.__features))
+
+    def on_add_column(self):
+        sources = [cfg for cfg in self.__config["log_measures"] if cfg["type"] == "continuous"]
+
+        dlg = QDialog()
+        vbox = QVBoxLayout()
+        list_widget = QListWidget()
+        list_widget.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        vbox.addWidget(list_widget)
+        vbox.addWidget(button_box)
+        dlg.setWindowTitle("Choose the data to add")
+        dlg.setLayout(vbox)
+        for cfg in sources:
+            item = QListWidgetItem(cfg["name"])
+            item.setData(Qt.UserRole, cfg)
+            list_widget.addItem(item)
+        button_box.rejected.connect(dlg.reject)
+        button_box.accepted.connect(dlg.accept)
+        if not dlg.exec_():
+            return
+
+        for item in list_widget.selectedItems():
+            cfg = item.data(Qt.UserRole)
+            uri, provider = cfg["source"]
+            data_l = QgsVectorLayer(uri, "data_layer", provider)
+            columns = ("continuous", cfg["values_column"], cfg["start_measure_column"], cfg["interval_column"],
+                       cfg.get("overlap_policy", OVERLAP_KEEP_FIRST))
+            # same keys as DataSelector, so that data are shared with the well log views
+            keys = dict((feature.id(), (uri, provider, "{}={}".format(cfg["feature_ref_column"], feature.id()), columns))
+                        for feature in self.__features)
+
+            # values of all the wells that are not loaded yet, read in one request
+            to_read = [well_id for well_id, key in keys.items() if not data_cache().contains(key)]
+            segments = {}
+            if to_read:
+                segments = read_station_segments(data_l, cfg["feature_ref_column"], to_read, cfg["values_column"],
+                                                 cfg["start_measure_column"], cfg["interval_column"])
+
+            for feature in self.__features:
+                key = keys[feature.id()]
+                if not data_cache().contains(key) and feature.id() not in segments:
+                    # no data for this well
+                    continue
+                filter_expr = key[2]
+                data = data_cache().acquire(key,
+                                            lambda cfg=cfg, filter_expr=filter_expr, well_segments=segments.get(feature.id()):
+                                            FeatureData(data_l, cfg["values_column"],
+                                                        feature_ids=[segment[0] for segment in well_segments],
+                                                        x_start_fieldname=cfg["start_measure_column"],
+                                                        x_delta_fieldname=cfg["interval_column"],
+                                                        overlap_policy=cfg.get("overlap_policy", OVERLAP_KEEP_FIRST),
+                                                        filter_expression=filter_expr,
+                                                        disk_cache=disk_cache(),
+                                                        segments=well_segments))
+                self.add_data_column(feature.id(), data, cfg["name"], cfg["uom"])
+
 def get_layer_config():
     """Open and parse the configuration file"""
 
@@ -364,28 +489,41 @@ class QGeoloGISPlugin:
         self.view_log_action = QAction(u'View well log', self.iface.mainWindow())
         self.view_timeseries_action = QAction(u'View timeseries', self.iface.mainWindow())
         self.load_base_layer_action = QAction(u'Load base layer', self.iface.mainWindow())
+        self.view_correlation_action = QAction(u'View well correlation', self.iface.mainWindow())
+        self.view_correlation_action.setToolTip(u'View the selected wells side by side')
         self.view_log_action.triggered.connect(lambda : self.on_view_graph(WellLogViewWrapper))
         self.view_timeseries_action.triggered.connect(lambda: self.on_view_graph(TimeSeriesWrapper))
         self.load_base_layer_action.triggered.connect(self.on_load_base_layer)
+        self.view_correlation_action.triggered.connect(self.on_view_correlation)
         self.iface.addToolBarIcon(self.view_log_action)
         self.iface.addToolBarIcon(self.view_timeseries_action)
+        self.iface.addToolBarIcon(self.view_correlation_action)
         self.iface.addToolBarIcon(self.load_base_layer_action)
 
         self.load_config_action = QAction("Load configuration file", self.iface.mainWindow())
         self.load_config_action.triggered.connect(self.on_load_config)
         self.iface.addPluginToMenu(u"QGeoloGIS", self.load_config_action)
 
+        self.clear_cache_action = QAction("Clear the data cache", self.iface.mainWindow())
+        self.clear_cache_action.triggered.connect(self.on_clear_cache)
+        self.iface.addPluginToMenu(u"QGeoloGIS", self.clear_cache_action)
+
     def unload(self):
         self.iface.removeToolBarIcon(self.view_log_action)
         self.iface.removeToolBarIcon(self.view_timeseries_action)
+        self.iface.removeToolBarIcon(self.view_correlation_action)
         self.iface.removeToolBarIcon(self.load_base_layer_action)
         self.view_log_action.setParent(None)
         self.view_timeseries_action.setParent(None)
+        self.view_correlation_action.setParent(None)
         self.load_base_layer_action.setParent(None)
         
         self.iface.removePluginMenu(u"QGeoloGIS", self.load_config_action)
         self.load_config_action.setParent(None)
 
+        self.iface.removePluginMenu(u"QGeoloGIS", self.clear_cache_action)
+        self.clear_cache_action.setParent(None)
+
     def on_view_graph(self, graph_class):
         layer_config = get_layer_config()
         if self.iface.activeLayer() is None:
@@ -407,6 +545,25 @@ class QGeoloGISPlugin:
             self.__windows.append(w)
         self.__tool.featureSelected.connect(on_feature_selected)
 
+    def on_view_correlation(self):
+        layer_config = get_layer_config()
+        layer = self.iface.activeLayer()
+        if layer is None:
+            self.iface.messageBar().pushMessage(u"Please select an active layer", QgsMessageBar.CRITICAL)
+            return
+        uri, provider = layer.source(), layer.dataProvider().name()
+        if (uri, provider) not in layer_config:
+            self.iface.messageBar().pushMessage(u"Unconfigured layer", QgsMessageBar.CRITICAL)
+            return
+        features = list(layer.selectedFeatures())
+        if len(features) == 0:
+            self.iface.messageBar().pushMessage(u"Please select wells on the active layer", QgsMessageBar.CRITICAL)
+            return
+
+        w = CorrelationViewWrapper(layer_config[(uri, provider)], features)
+        w.show()
+        self.__windows.append(w)
+
     def on_load_base_layer(self):
         # look for base layers in the config
         layer_config = get_layer_config()
@@ -437,6 +594,14 @@ class QGeoloGISPlugin:
                 uri, provider = item.data(Qt.UserRole)
                 self.iface.addVectorLayer(uri, item.text(), provider)
 
+    def on_clear_cache(self):
+        cache = disk_cache()
+        size = cache.size()
+        cache.clear()
+        # data kept in memory may have been read from the disk cache
+        data_cache().clear()
+        self.iface.messageBar().pushMessage(u"Data cache cleared ({:.1f} MiB freed)".format(size / 1024.0 / 1024.0))
+
     def on_load_config(self):
         import os
         file_name = QFileDialog.getOpenFileName(None, "Choose a configuration file to load", os.path.dirname(__file__))
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+# The plugin directory is a package that needs QGIS (see __init__.py): tests import the
+# qgeologis package directly, which runs without QGIS for the modules that only use numpy.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+import warnings
+
+import numpy as np
+import pytest
+
+from qgeologis.array_parser import parse_array_string, array_from_list, array_from_attribute
+
+def test_parse_array_string():
+    values = parse_array_string("{1.5,NULL, 3}")
+    assert np.array_equal(values, [1.5, np.nan, 3.0], equal_nan=True)
+    assert len(parse_array_string("{}")) == 0
+
+def test_parse_array_string_rejects_malformed_text():
+    with pytest.raises(ValueError):
+        parse_array_string("{1,2,abc,4}")
+
+def test_parse_array_string_detects_truncation(monkeypatch):
+    """numpy < 2 returns the values read before the first unexpected one, with a DeprecationWarning"""
+    def truncated_fromstring(text, dtype, sep):
+        warnings.warn("string or file could not be read to its end", DeprecationWarning)
+        return np.array([1.0, 2.0])
+    monkeypatch.setattr(np, "fromstring", truncated_fromstring)
+    with pytest.raises(ValueError):
+        parse_array_string("{1,2,abc,4}")
+    # the per value fallback gives the complete array
+    assert np.array_equal(parse_array_string("{1,2,NULL,4}"), [1.0, 2.0, np.nan, 4.0], equal_nan=True)
+
+def test_array_from_list():
+    assert np.array_equal(array_from_list([1, None, 2.5]), [1.0, np.nan, 2.5], equal_nan=True)
+    # numeric strings are values, only NULL values are NaN
+    assert np.array_equal(array_from_list(["1", "NULL", 2.5]), [1.0, np.nan, 2.5], equal_nan=True)
+
+def test_array_from_list_null_variants():
+    class NullVariant(object):
+        def isNull(self):
+            return True
+    assert np.array_equal(array_from_list([NullVariant(), 3.0]), [np.nan, 3.0], equal_nan=True)
+
+def test_array_from_attribute():
+    assert np.array_equal(array_from_attribute((1, 2)), [1.0, 2.0])
+    assert np.array_equal(array_from_attribute("{1,2}"), [1.0, 2.0])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+
+from qgeologis.series import merge_segments, RegularSeries
+from qgeologis.lod import LodPyramid, m4_indices
+
+def _gapped_series():
+    """Two segments of 1000 samples, 4000 units apart"""
+    rng = np.random.RandomState(0)
+    return RegularSeries(merge_segments([(0.0, 1.0, rng.rand(1000)), (5000.0, 1.0, rng.rand(1000))]))
+
+def test_window_keeps_gap_markers():
+    pyramid = LodPyramid(_gapped_series())
+    window = pyramid.window(0, 6000, 20)
+    assert window is not None
+    x_values, y_values = window
+    # the gap marker is kept, between the two segments
+    nans = np.flatnonzero(np.isnan(y_values))
+    assert len(nans) == 1
+    assert x_values[nans[0] - 1] < 1000.0
+    assert x_values[nans[0] + 1] >= 5000.0
+
+def test_gap_markers_at_every_level():
+    series = _gapped_series()
+    pyramid = LodPyramid(series)
+    gap = int(np.flatnonzero(np.isnan(series.y_values()))[0])
+    for level in pyramid.levels():
+        assert gap in pyramid.indices(0, len(series), level)
+
+def test_update_keeps_gap_markers():
+    series = _gapped_series()
+    pyramid = LodPyramid(series)
+    updated = LodPyramid(series)
+    updated.update(series, 500)
+    for name, array in pyramid.arrays().items():
+        assert np.array_equal(array, updated.arrays()[name]), name
+
+def _rasterize(pixels, y_values):
+    """Cells (column, row) covered by a line through the samples, interrupted by NaN values"""
+    segments = np.flatnonzero(~np.isnan(y_values[:-1]) & ~np.isnan(y_values[1:]))
+    dx, dy = pixels[segments + 1] - pixels[segments], y_values[segments + 1] - y_values[segments]
+    # points along each segment, less than a quarter of a cell apart
+    n_steps = (4 * np.maximum(np.abs(dx), np.abs(dy))).astype(int) + 2
+    segment_of = np.repeat(np.arange(len(segments)), n_steps)
+    t = (np.arange(len(segment_of)) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps)) / (n_steps[segment_of] - 1.0)
+    x = pixels[segments][segment_of] + t * dx[segment_of]
+    y = y_values[segments][segment_of] + t * dy[segment_of]
+    return set(zip(np.floor(x).astype(int), np.floor(y).astype(int)))
+
+def _gappy_values(rng, n):
+    y_values = rng.rand(n) * 50.0
+    y_values[rng.rand(n) < 0.1] = np.nan
+    return y_values
+
+def test_m4_is_pixel_identical_with_gaps():
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        n = 400
+        pixels = np.sort(rng.rand(n)) * 20.0
+        y_values = _gappy_values(rng, n)
+        kept = m4_indices(pixels, y_values)
+        assert len(kept) < n
+        assert _rasterize(pixels[kept], y_values[kept]) == _rasterize(pixels, y_values)
+
+def test_m4_keeps_every_gap_of_a_column():
+    y_values = np.array([1.0, 2.0, np.nan, 10.0, 20.0, np.nan, 5.0, 6.0])
+    kept = m4_indices(np.zeros(len(y_values)), y_values)
+    assert list(kept) == list(range(len(y_values)))
+
+def test_indices_are_pixel_identical_with_gaps():
+    rng = np.random.RandomState(1)
+    for _ in range(5):
+        y_values = _gappy_values(rng, 2048)
+        pyramid = LodPyramid(RegularSeries([(0.0, 1.0, y_values)]))
+        for level in pyramid.levels():
+            # pixel columns aligned on buckets
+            pixels = np.arange(len(y_values)) / float(2 << level)
+            kept = pyramid.indices(0, len(y_values), level)
+            assert _rasterize(pixels[kept], y_values[kept]) == _rasterize(pixels, y_values)
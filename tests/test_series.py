@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+#   Copyright (C) 2018 Oslandia <infos@oslandia.com>
+#
+#   This file is a piece of free software; you can redistribute it and/or
+#   modify it under the terms of the GNU Library General Public
+#   License as published by the Free Software Foundation; either
+#   version 2 of the License, or (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Library General Public License for more details.
+#   You should have received a copy of the GNU Library General Public
+#   License along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+
+from qgeologis.series import merge_segments, RegularSeries, SampledSeries, SegmentMerger
+from qgeologis.series import OVERLAP_POLICIES, OVERLAP_KEEP_FIRST, OVERLAP_KEEP_LATEST, OVERLAP_AVERAGE
+
+def test_regular_indices_match_sampled():
+    """Indices of a RegularSeries are the ones of the same samples with explicit X values,
+    even when X values are not exact in floating point (0.1 steps)"""
+    regular = RegularSeries(merge_segments([(0.0, 0.1, np.zeros(50)), (10.0, 0.1, np.zeros(50))]))
+    sampled = SampledSeries(regular.x_values(), regular.y_values())
+
+    x_values = regular.x_values()
+    queries = np.concatenate((x_values, (x_values[1:] + x_values[:-1]) / 2, [3 * 0.1, 7 * 0.1, -1.0, 20.0]))
+    for x in queries:
+        assert regular.index_left(x) == sampled.index_left(x), x
+        assert regular.index_right(x) == sampled.index_right(x), x
+
+def test_merge_keep_first():
+    merged = merge_segments([(0.0, 1.0, [1.0, 1.0, 1.0]), (1.0, 1.0, [2.0, 2.0, 2.0])], OVERLAP_KEEP_FIRST)
+    series = RegularSeries(merged)
+    assert list(series.x_values()) == [0.0, 1.0, 2.0, 3.0]
+    assert list(series.y_values()) == [1.0, 1.0, 1.0, 2.0]
+
+def test_merge_keep_latest():
+    # segments are given by decreasing priority, the caller orders them
+    merged = merge_segments([(1.0, 1.0, [2.0, 2.0, 2.0]), (0.0, 1.0, [1.0, 1.0, 1.0])], OVERLAP_KEEP_LATEST)
+    series = RegularSeries(merged)
+    assert list(series.x_values()) == [0.0, 1.0, 2.0, 3.0]
+    assert list(series.y_values()) == [1.0, 2.0, 2.0, 2.0]
+
+def test_merge_average():
+    merged = merge_segments([(0.0, 1.0, [1.0, 1.0, 1.0]), (1.0, 1.0, [3.0, 3.0, 3.0])], OVERLAP_AVERAGE)
+    series = RegularSeries(merged)
+    assert list(series.x_values()) == [0.0, 1.0, 2.0, 3.0]
+    assert list(series.y_values()) == [1.0, 2.0, 2.0, 3.0]
+
+def test_merge_gap_markers():
+    merged = merge_segments([(0.0, 1.0, [1.0, 1.0]), (2.0, 1.0, [2.0]), (10.0, 1.0, [3.0])])
+    y_values = RegularSeries(merged).y_values()
+    # contiguous segments are not separated, a NaN is inserted before the gap
+    assert np.isnan(y_values).sum() == 1
+    assert list(y_values[:3]) == [1.0, 1.0, 2.0] and np.isnan(y_values[3]) and y_values[4] == 3.0
+
+def test_merge_piece_between_samples():
+    """A segment sampled more coarsely than a segment of higher priority is split around it"""
+    merged = merge_segments([(1.2, 0.1, [5.0, 5.0]), (0.0, 1.0, [1.0, 1.0, 1.0])])
+    x_values = RegularSeries(merged).x_values()
+    assert np.all(np.diff(x_values) > 0)
+
+def test_segment_merger_matches_merge_segments():
+    rng = np.random.RandomState(0)
+    for overlap_policy in OVERLAP_POLICIES:
+        for reverse in (False, True):
+            merger = SegmentMerger(overlap_policy, reverse)
+            segments = {}
+            for _ in range(20):
+                old = merger.series()
+                added = {}
+                for _ in range(rng.randint(0, 5)):
+                    y_values = rng.rand(rng.randint(0, 20))
+                    y_values[rng.rand(len(y_values)) < 0.1] = np.nan
+                    added[int(rng.randint(0, 30))] = (rng.randint(0, 400) * 0.5, rng.choice([0.25, 0.5, 1.0]), y_values)
+                removed = [int(key) for key in rng.randint(0, 30, rng.randint(0, 3))]
+                for key in removed:
+                    segments.pop(key, None)
+                segments.update(added)
+
+                first_change = merger.update([(key,) + segment for key, segment in added.items()], removed)
+                expected = RegularSeries(merge_segments([segments[key] for key in sorted(segments, reverse=reverse)],
+                                                        overlap_policy))
+                series = merger.series()
+                assert np.array_equal(series.y_values(), expected.y_values(), equal_nan=True)
+                assert np.allclose(series.x_values(), expected.x_values())
+                # values before the first change are the same as before
+                n = min(first_change, len(old))
+                assert np.array_equal(series.y_values()[:n], old.y_values()[:n], equal_nan=True)